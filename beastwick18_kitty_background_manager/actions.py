@@ -0,0 +1,168 @@
+import os
+import re
+from pathlib import Path
+from typing import List, Optional
+import beastwick18_kitty_background_manager.config as cfg
+import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.publish as publish
+import beastwick18_kitty_background_manager.rotation as rotation
+import beastwick18_kitty_background_manager.profiling as profiling
+import beastwick18_kitty_background_manager.lookahead as lookahead
+import beastwick18_kitty_background_manager.variants as variants
+import beastwick18_kitty_background_manager.stats as stats
+import beastwick18_kitty_background_manager.bulk as bulk
+import beastwick18_kitty_background_manager.fuzzy as fuzzy
+import beastwick18_kitty_background_manager.tags as tags
+
+# The commands in here do not print anything and only return plain data, so that they can be
+# run either by the cli or by the daemon on behalf of the cli
+
+class ActionError(Exception):
+    pass
+
+def _path(p: Optional[Path]):
+    return None if p is None else str(p)
+
+def switch_to(file: Path, artefact: Optional[Path] = None, remember: bool = True, size: Optional[str] = None):
+    # Without a window size the one of the last switch is used, so the daemon and runs outside of
+    # a terminal keep the geometry that was detected before
+    if size is None:
+        size = variants.remembered()
+    cfg.set_next(file, remember, size)
+    with profiling.span('publish'):
+        if artefact is not None:
+            # Prepared ahead of time by the look-ahead queue, so only the rename is left to do
+            publish.replace(artefact, cfg.current_path / cfg.CURRENT_FILE)
+        else:
+            src, mode = variants.source(file, size, cfg.get('switch_mode'))
+            publish.publish(src, cfg.current_path / cfg.CURRENT_FILE, mode)
+    return {'next': str(cfg.next)}
+
+def use_collection(name: Optional[str]):
+    if not tags.use(name):
+        raise ActionError(f'There is no collection called "{name}"')
+    # The queue was drawn from the collection that was active before
+    lookahead.flush()
+
+def set_background(bg: Optional[str] = None, enabled: Optional[bool] = None, size: Optional[str] = None, collection: Optional[str] = None):
+    if collection is not None:
+        use_collection(collection)
+        if bg is None:
+            return next_background(size=size)
+    if bg is None:
+        raise ActionError('Give the name of a background or a collection to switch to')
+    # A name that does not exist is taken as the start of the name of a background, if only one starts with it
+    if (file := tools.search_enabled_disabled(enabled, bg)) is None and (file := fuzzy.resolve(tools.search_folders(enabled), bg)) is None:
+        raise ActionError(fuzzy.suggest(f'Could not set background {bg}.png', tools.search_folders(enabled), bg))
+    return switch_to(file, size=size)
+
+def _check_tags(tag: Optional[List[str]], not_tag: Optional[List[str]]):
+    if len(unknown := tags.missing((tag or []) + (not_tag or []))) > 0:
+        raise ActionError(f'Unknown tag "{unknown[0]}"')
+
+def random_background(disabled: bool = False, shuffle: Optional[bool] = None, size: Optional[str] = None, dark: Optional[bool] = None, hue: Optional[str] = None,
+                      tag: Optional[List[str]] = None, not_tag: Optional[List[str]] = None):
+    path: Path = cfg.disabled_path if disabled else cfg.enabled_path
+    
+    if shuffle is None:
+        shuffle = cfg.get('random_mode') == 'shuffle'
+    if size is None:
+        size = variants.remembered()
+    if hue is not None and hue not in stats.HUES:
+        raise ActionError(f'Unknown hue "{hue}". Valid values are ({", ".join(stats.HUES)})')
+    _check_tags(tag, not_tag)
+    
+    filtered = dark is not None or hue is not None or bool(tag) or bool(not_tag)
+    condition, params = '', ()
+    if dark is not None or hue is not None:
+        # Only images that were never looked at are decoded, on every core like reindex does by
+        # default. Everything else is a query on the index
+        stats.fill_missing([path], os.cpu_count() or 1)
+        condition, params = stats.condition(index.folder_key(path), dark, hue)
+    condition, params = index.all_of((condition, params), tags.condition(tag or [], not_tag or [], tags.active()))
+    # The queue is only drawn from the active collection, so it can only be used when there are no other filters
+    if shuffle and not disabled and not filtered and (queued := lookahead.pop(size)) is not None:
+        rotation.mark_drawn(path, queued[0].stem)
+        return switch_to(*queued, size=size)
+    if shuffle:
+        bg = rotation.draw(path, cfg.get_next(), condition, params)
+    else:
+        bg = rotation.reservoir_choice(index.names(path, condition, params))
+    if bg is None:
+        if filtered:
+            raise ActionError('No background matches the given filters')
+        return {'next': None}
+    
+    file: Path = path / (bg + '.png')
+    if not file.exists() or file.is_dir():
+        raise ActionError('Could not set a random background')
+    return switch_to(file, size=size)
+
+def next_background(size: Optional[str] = None):
+    # Stepping through the rotation always uses the shuffle bag, so nothing repeats too early
+    return random_background(shuffle=True, size=size)
+
+def previous_background(steps: int = 1, size: Optional[str] = None):
+    if (file := lookahead.step_back(steps)) is None:
+        raise ActionError('There is no earlier background to go back to')
+    # The background that is replaced comes up again next, it was only skipped over
+    if cfg.get_next() is not None and cfg.next.is_file() and cfg.next.parent.resolve() == cfg.enabled_path.resolve():
+        lookahead.push_front(cfg.next)
+    return switch_to(file, remember=False, size=size)
+
+def entries(enabled: bool = True, disabled: bool = True, sort: str = 'name', reverse: bool = False, match: Optional[List[str]] = None,
+            regex: bool = False, limit: Optional[int] = None, offset: int = 0, tag: Optional[List[str]] = None, not_tag: Optional[List[str]] = None):
+    # Yields (folder, name, size, mtime, width, height) for the selected backgrounds, as the index returns them
+    if sort not in index.ORDERS:
+        raise ActionError(f'Cannot sort by "{sort}". Valid values are ({", ".join(index.ORDERS)})')
+    folders = [f for f, shown in ((cfg.enabled_path, enabled), (cfg.disabled_path, disabled)) if shown]
+    if regex:
+        for pattern in match or []:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ActionError(f'Invalid regular expression "{pattern}": {e}')
+    _check_tags(tag, not_tag)
+    condition, params = index.all_of(bulk.condition(match or [], regex), tags.condition(tag or [], not_tag or []))
+    if sort == 'luminance':
+        stats.fill_missing(folders, os.cpu_count() or 1)
+    return index.query(folders, condition, params, sort, reverse, limit, offset)
+
+def list_backgrounds(enabled: bool = True, disabled: bool = True, sort: str = 'name', reverse: bool = False, match: Optional[List[str]] = None,
+                     regex: bool = False, limit: Optional[int] = None, offset: int = 0, tag: Optional[List[str]] = None, not_tag: Optional[List[str]] = None):
+    listing = {index.folder_key(cfg.enabled_path): [], index.folder_key(cfg.disabled_path): []}
+    for folder, name, *_ in entries(enabled, disabled, sort, reverse, match, regex, limit, offset, tag, not_tag):
+        listing[folder].append(name)
+    return {
+        'next': _path(cfg.next) if cfg.get_next() is not None else None,
+        'previous': _path(cfg.previous) if cfg.get_previous() is not None else None,
+        'enabled': listing[index.folder_key(cfg.enabled_path)],
+        'disabled': listing[index.folder_key(cfg.disabled_path)],
+    }
+
+COMMANDS = {
+    'set': set_background,
+    'random': random_background,
+    'next': next_background,
+    'prev': previous_background,
+    'list': list_backgrounds,
+}
+
+# Commands that change the background, after these the look-ahead queue is topped up again
+SWITCHES = {'set', 'random', 'next', 'prev'}
+
+def refills(command: str, args: dict):
+    # The queue is only popped by shuffled draws, without those it would prepare files nobody uses
+    if command not in SWITCHES:
+        return False
+    if command == 'next':
+        return True
+    if command == 'random' and args.get('shuffle') is not None:
+        return args['shuffle']
+    return cfg.get('random_mode') == 'shuffle'
+
+def run(command: str, **args):
+    if command not in COMMANDS:
+        raise ActionError(f'Unknown command "{command}"')
+    return COMMANDS[command](**args)
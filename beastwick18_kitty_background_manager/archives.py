@@ -0,0 +1,46 @@
+from pathlib import Path
+import beastwick18_kitty_background_manager.tools as tools
+
+class ArchiveError(Exception):
+    pass
+
+def is_archive(file: Path):
+    import zipfile
+    import tarfile
+    try:
+        return zipfile.is_zipfile(file) or tarfile.is_tarfile(file)
+    except OSError:
+        return False
+
+def _zip_members(file: Path):
+    import zipfile
+    with zipfile.ZipFile(file) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            with archive.open(info) as f:
+                yield info.filename, f
+
+def _tar_members(file: Path):
+    import tarfile
+    # Read as a stream, a compressed tar can only be walked from the start anyway and this way
+    # nothing but the current member is ever held
+    with tarfile.open(file, 'r|*') as archive:
+        for info in archive:
+            if info.isfile():
+                yield info.name, archive.extractfile(info)
+
+def members(file: Path):
+    # Yields (name, content) for every image in the archive, one at a time and without writing
+    # anything to disk. Whether a member is an image is decided by its first bytes, the rest of
+    # the other members is never read into memory
+    import zipfile
+    import tarfile
+    try:
+        walk = _zip_members(file) if zipfile.is_zipfile(file) else _tar_members(file)
+        for name, f in walk:
+            head = f.read(tools.SNIFF_BYTES)
+            if tools.image_type(head) is not None:
+                yield name, head + f.read()
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+        raise ArchiveError(str(e)) from e
@@ -0,0 +1,165 @@
+import os
+import re
+import glob
+import fnmatch
+from pathlib import Path
+from typing import List
+import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.originals as originals
+
+def matcher(pattern: str, regex: bool):
+    # Both kinds of patterns have to match the whole name
+    if regex:
+        return re.compile(pattern).fullmatch
+    return re.compile(fnmatch.translate(pattern)).match
+
+def condition(patterns: List[str], regex: bool = False):
+    # The same matching as matcher(), as an SQL condition on the name of an image
+    if not patterns:
+        return '', ()
+    expressions = [p if regex else fnmatch.translate(p) for p in patterns]
+    return ' OR '.join(['name REGEXP ?'] * len(expressions)), tuple(f'(?:{e})\\Z' for e in expressions)
+
+def is_pattern(name: str, regex: bool):
+    return regex or glob.has_magic(name)
+
+def select(folders, patterns: List[str], regex: bool = False, everything: bool = False):
+    # Every folder is listed once for the whole batch. Plain names are taken from the first folder
+    # that has them, like search_enabled_disabled does, patterns match in all of the folders.
+    # Returns (folder, name, match) for every selected background and the patterns that matched nothing
+    listing = [(folder, list(index.names(folder))) for folder in folders]
+    if everything:
+        return [(folder, name, None) for folder, names in listing for name in names], []
+
+    lookup = [(folder, set(names)) for folder, names in listing]
+    selected = {}
+    unmatched = []
+    for pattern in patterns:
+        found = False
+        if not is_pattern(pattern, regex):
+            if (folder := next((f for f, names in lookup if pattern in names), None)) is not None:
+                selected.setdefault((folder, pattern), None)
+                found = True
+        else:
+            match = matcher(pattern, regex)
+            for folder, names in listing:
+                for name in names:
+                    if (m := match(name)) is not None:
+                        selected.setdefault((folder, name), m)
+                        found = True
+        if not found:
+            unmatched.append(pattern)
+    return [(folder, name, m) for (folder, name), m in selected.items()], unmatched
+
+def plan_moves(selected, dest: Path):
+    # Name conflicts are resolved against the names in the destination plus the ones handed out
+    # earlier in the batch, so no file has to be probed on disk
+    taken = set(index.names(dest))
+    moves = []
+    failed = []
+    for folder, name, _ in selected:
+        target = name if name not in taken else tools.unused_name(name, taken)
+        if target is None:
+            failed.append(folder / (name + '.png'))
+            continue
+        taken.add(target)
+        moves.append((folder / (name + '.png'), dest / (target + '.png')))
+    return moves, failed
+
+def _rename_all(moves):
+    done = []
+    errors = []
+    for src, dest in moves:
+        try:
+            os.rename(src, dest)
+        except OSError as e:
+            errors.append((src, e))
+            continue
+        done.append((src, dest))
+    return done, errors
+
+def apply_moves(moves):
+    # A file can only take the name of another file in the same batch (e.g. when two names are
+    # swapped) once that one is out of the way, so such batches go through temporary names first
+    sources = {src for src, _ in moves}
+    folders = {f for src, dest in moves for f in (src.parent, dest.parent)}
+    with index.transaction():
+        if any(dest in sources and dest != src for src, dest in moves):
+            before = index.stamp(folders)
+            staged, errors = _rename_all([(src, src.with_name(f'.{src.name}.{os.getpid()}.tmp')) for src, _ in moves])
+            index.move_files(staged, before)
+            final = dict(moves)
+            before = index.stamp(folders)
+            done, more = _rename_all([(tmp, final[src]) for src, tmp in staged])
+            index.move_files(done, before)
+            moved_from = {tmp: src for src, tmp in staged}
+            return [(moved_from[tmp], dest) for tmp, dest in done], errors + more
+
+        before = index.stamp(folders)
+        done, errors = _rename_all(moves)
+        index.move_files(done, before)
+        return done, errors
+
+def delete(files):
+    # The originals are looked up first, the rows that point to them are gone afterwards
+    kept = originals.used_by(files)
+    before = index.stamp({file.parent for file in files})
+    done = []
+    errors = []
+    for file in files:
+        try:
+            file.unlink()
+        except OSError as e:
+            errors.append((file, e))
+            continue
+        done.append(file)
+    index.remove_files(done, before)
+    originals.prune(kept)
+    return done, errors
+
+def rename_target(template: str, name: str, n: int, match, regex: bool):
+    # Regular expressions fill in their groups (\1, \g<name>), globs can use {name} and a counter {n}
+    if regex:
+        return match.expand(template)
+    if match is not None:
+        return template.format(name=name, n=n)
+    return template
+
+def plan_renames(selected, template: str, regex: bool = False, overwrite: bool = False):
+    # Returns the moves, the names that had to get a suffix as (name, wanted, given) and the files
+    # that could not be renamed
+    leaving = {}
+    for folder, name, _ in selected:
+        leaving.setdefault(folder, set()).add(name)
+    existing = {folder: set(index.names(folder)) - names for folder, names in leaving.items()}
+    assigned = {folder: set() for folder in leaving}
+
+    moves = []
+    suffixed = []
+    failed = []
+    wanted = []
+    for n, (folder, name, match) in enumerate(selected, 1):
+        try:
+            target = rename_target(template, name, n, match, regex)
+        except (re.error, IndexError, KeyError, ValueError):
+            target = None
+        if not target or os.sep in target:
+            # The file keeps its name, so nothing else in the batch may take it
+            existing[folder].add(name)
+            failed.append(folder / (name + '.png'))
+            continue
+        wanted.append((folder, name, target))
+
+    for folder, name, target in wanted:
+        # Overwriting is only allowed for files outside the batch, two renamed files never share a name
+        if target in assigned[folder] or (target in existing[folder] and not overwrite):
+            if (given := tools.unused_name(target, assigned[folder] | existing[folder])) is None:
+                failed.append(folder / (name + '.png'))
+                continue
+            suffixed.append((name, target, given))
+            target = given
+        assigned[folder].add(target)
+        if target != name:
+            moves.append((folder / (name + '.png'), folder / (target + '.png')))
+    return moves, suffixed, failed
@@ -1,24 +1,25 @@
 import os
 from enum import Enum
 from pathlib import Path
-import json
 import typer
-from PIL import ImageColor
 import beastwick18_kitty_background_manager.tools as tools
 import beastwick18_kitty_background_manager.output as out
+import beastwick18_kitty_background_manager.state as state
+import beastwick18_kitty_background_manager.publish as publish
+import beastwick18_kitty_background_manager.profiling as profiling
 from dataclasses import dataclass
-from typing import Any, Callable
+from typing import Any, Callable, Optional
 
 APP_NAME = 'kittybg'
 CONFIG_FILE = 'config.json'
 CURRENT_FILE = 'current.png'
 
-enabled_path: Path = None
-disabled_path: Path = None
-current_path: Path = None
+# enabled_path, disabled_path, current_path, inbox_path, next and previous are only set once the config
+# is loaded, which happens the first time one of them is accessed (see __getattr__ below)
+LAZY_ATTRIBUTES = ('enabled_path', 'disabled_path', 'current_path', 'inbox_path', 'next', 'previous')
 
-previous: Path = None
-next: Path = None
+loaded = False
+loaded_signature = None
 
 @dataclass
 class ConfProperty:
@@ -36,17 +37,32 @@ def add_property(name: str, value: Any, validate_method: Callable):
 
 add_property('brightness', 0.1, lambda n, x: tools.assert_type(n, x, (float, int)))
 add_property('contrast', 1.0, lambda n, x: tools.assert_type(n, x, (float, int)))
+add_property('auto_brightness', False, lambda n, x: tools.assert_type(n, x, bool))
+add_property('target_luminance', 0.05, lambda n, x: tools.assert_type(n, x, (float, int)) and tools.assert_range(n, 0, 1, x))
+add_property('keep_originals', True, lambda n, x: tools.assert_type(n, x, bool))
 add_property('enabled_path', '/home/$USER/Pictures/kittyWallpapers/', lambda n, x: tools.assert_type(n, x, str))
 add_property('disabled_path', '/home/$USER/Pictures/kittyWallpapers/disabled/', lambda n, x: tools.assert_type(n, x, str))
 add_property('current_path', '/home/$USER/Pictures/kittyWallpapers/current/', lambda n, x: tools.assert_type(n, x, str))
+add_property('inbox_path', '/home/$USER/Pictures/kittyWallpapers/inbox/', lambda n, x: tools.assert_type(n, x, str))
 add_property('preview_size', 512, lambda n, x: tools.assert_type(n, x, int) and tools.assert_range('preview_size', 0, 4096, x))
 add_property('preview_align', 'left', lambda n, x: tools.assert_type(n, x, str) and tools.assert_in(n, x, ('left', 'center', 'right')))
 add_property('crop_and_scale', True, lambda n, x: tools.assert_type(n, x, bool))
 add_property('crop_size', '1920x1080', lambda n, x: tools.assert_type(n, x, str) and tools.valid_dimensions(n, x))
+add_property('variant_sizes', '', lambda n, x: tools.assert_type(n, x, str) and all(tools.valid_dimensions(n, d.strip()) for d in x.split(',') if d.strip()))
+add_property('variant_cache_size', 256, lambda n, x: tools.assert_type(n, x, int) and tools.assert_range(n, 0, 65536, x))
 add_property('scale_type', 'fill', lambda n, x: tools.assert_type(n, x, str) and tools.assert_in(n, x, ('fill', 'fit', 'none')))
 add_property('background_color', '#000000', lambda n, x: tools.valid_color(n, x))
 add_property('preview_on_add', True, lambda n, x: tools.assert_type(n, x, bool))
 add_property('preview_fill', False, lambda n, x: tools.assert_type(n, x, bool))
+add_property('preview_backend', 'kitty', lambda n, x: tools.assert_type(n, x, str) and tools.assert_in(n, x, ('kitty', 'pixcat')))
+add_property('preview_transmission', 'auto', lambda n, x: tools.assert_type(n, x, str) and tools.assert_in(n, x, ('auto', 'file', 'shm', 'temp', 'direct')))
+add_property('thumbnail_cache_size', 64, lambda n, x: tools.assert_type(n, x, int) and tools.assert_range(n, 0, 65536, x))
+add_property('random_mode', 'random', lambda n, x: tools.assert_type(n, x, str) and tools.assert_in(n, x, ('random', 'shuffle')))
+add_property('on_duplicate', 'warn', lambda n, x: tools.assert_type(n, x, str) and tools.assert_in(n, x, ('warn', 'skip', 'allow')))
+add_property('duplicate_distance', 6, lambda n, x: tools.assert_type(n, x, int) and tools.assert_range(n, 0, 64, x))
+add_property('queue_size', 2, lambda n, x: tools.assert_type(n, x, int) and tools.assert_range(n, 0, 64, x))
+add_property('history_size', 20, lambda n, x: tools.assert_type(n, x, int) and tools.assert_range(n, 0, 1000, x))
+add_property('switch_mode', 'copy', lambda n, x: tools.assert_type(n, x, str) and tools.assert_in(n, x, publish.SWITCH_MODES))
 
 def generate_default_config():
     data = {}
@@ -56,16 +72,21 @@ def generate_default_config():
     data['background']['next'] = ''
     data['background']['previous'] = ''
     
-    config_path: Path = tools.get_app_file(CONFIG_FILE)
-    with config_path.open('w') as f:
-        json_str = json.dumps(data, indent=4)
-        f.write(json_str)
+    return data
+
+def transaction():
+    return state.transaction(tools.get_app_file(CONFIG_FILE), default=generate_default_config)
+
+def read():
+    # config.json as it is on disk, for readers that do not need to wait for the lock
+    return state.read(tools.get_app_file(CONFIG_FILE)) or {}
 
 def set_paths():
-    global enabled_path, disabled_path, current_path
+    global enabled_path, disabled_path, current_path, inbox_path
     enabled_path = Path(os.path.expandvars(conf['enabled_path'].value))
     disabled_path = Path(os.path.expandvars(conf['disabled_path'].value))
     current_path = Path(os.path.expandvars(conf['current_path'].value))
+    inbox_path = Path(os.path.expandvars(conf['inbox_path'].value))
 
 def load_options(options):
     for name, data in conf.items():
@@ -86,76 +107,100 @@ def load_background(background):
         previous = Path(os.path.expandvars(p))
 
 def load_config():
+    with profiling.span('config.load'):
+        _load_config()
+
+def _load_config():
     config_path: Path = tools.get_app_file(CONFIG_FILE)
-    if not config_path.is_file():
+    if not state.exists(config_path):
         typer.echo(f'Config file does not exist, {out.to_link_style("creating it...", config_path.parent, fg=typer.colors.BLUE)}')
-        generate_default_config()
+        with transaction():
+            pass
         return
     
-    with config_path.open('r') as f:
-        data = json.load(f)
-        if (options := data.get('options')) is not None:
-            load_options(options)
-        if (background := data.get('background')) is not None:
-            load_background(background)
+    global loaded_signature
+    loaded_signature = state.signature(config_path)
+    data = state.read(config_path)
+    if (options := data.get('options')) is not None:
+        load_options(options)
+    if (background := data.get('background')) is not None:
+        load_background(background)
 
 def save_config():
-    config_path: Path = tools.get_app_file(CONFIG_FILE)
-    
-    with config_path.open('r+') as f:
-        data = json.load(f)
-        
-        data.update({'options': {name: data.value for name, data in conf.items()}})
-        
-        json_str = json.dumps(data, indent=4)
-        
-        f.seek(0)
-        f.write(json_str)
-        f.truncate()
+    ensure_loaded()
+    with transaction() as data:
+        data['options'] = {name: prop.value for name, prop in conf.items()}
 
 def update_property(property: str, value):
     config_path: Path = tools.get_app_file(CONFIG_FILE)
-    if not config_path.is_file():
+    if not state.exists(config_path):
         out.error('Cannot save config file: config.json does not exist')
         return
     if property not in conf:
         out.error(f'Property "{property}" does not exist')
         return
     
-    with config_path.open('r+') as f:
-        data = json.load(f)
+    with transaction() as data:
         conf[property].value = value
-        
-        data.update({'options': {name: data.value for name, data in conf.items()}})
-        
-        json_str = json.dumps(data, indent=4)
-        
-        f.seek(0)
-        f.write(json_str)
-        f.truncate()
+        # Only touch this one property, so concurrent changes to other options are kept
+        data.setdefault('options', {})[property] = value
 
-def set_next(n: Path):
+def set_next(n: Path, remember: bool = True, size: Optional[str] = None):
     if n is None:
         return
     global next
     next = n
-    config_path: Path = tools.get_app_file(CONFIG_FILE)
     
-    with config_path.open('r+') as f:
-        data = json.load(f)
+    with transaction() as data:
         background = data.get('background')
-        bg = {'background': {'next': str(next.resolve())}}
+        bg = {'next': str(next.resolve())}
         
         if background is not None and (p := background.get('next')) is not None:
-            bg['background']['previous'] = p
+            bg['previous'] = p
+            # The look-ahead queue and the history of earlier backgrounds are kept as they are
+            bg['queue'] = background.get('queue', [])
+            history = background.get('history', [])
+            if remember and p not in ('', bg['next']):
+                history = (history + [p])[-get('history_size'):] if get('history_size') > 0 else []
+            bg['history'] = history
+            # The last known window size is kept for switches that cannot detect one themselves
+            if size is None:
+                size = background.get('size')
         
-        data.update(bg)
-        
-        json_str = json.dumps(data, indent=4)
-        
-        f.seek(0)
-        f.write(json_str)
-        f.truncate()
+        bg['size'] = size
+        data['background'] = bg
+
+def ensure_loaded():
+    global loaded, next, previous
+    if loaded:
+        return
+    loaded = True
+    next = None
+    previous = None
+    load_config()
+    set_paths()
+
+def refresh():
+    global loaded
+    # Reload the config if another process changed config.json since it was loaded. Returns whether it was
+    if loaded and state.signature(tools.get_app_file(CONFIG_FILE)) == loaded_signature:
+        return False
+    loaded = False
+    ensure_loaded()
+    return True
+
+def get(name: str, override: Any = None):
+    # Command line options default to None and fall back to the config file through here
+    if override is not None:
+        return override
+    ensure_loaded()
+    return conf[name].value
+
+def __getattr__(name: str):
+    if name in LAZY_ATTRIBUTES:
+        ensure_loaded()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 def get_next():
     if next is None or next.stem == '':
@@ -0,0 +1,92 @@
+import os
+import math
+from pathlib import Path
+from typing import List, Tuple
+import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.thumbnails as thumbnails
+import beastwick18_kitty_background_manager.publish as publish
+
+PADDING = 8
+LABEL_HEIGHT = 14
+BACKGROUND = (24, 24, 24)
+# Outline drawn in place of a background that could not be read
+PLACEHOLDER = (96, 96, 96)
+# Pixel size assumed when the terminal does not report one
+FALLBACK_SIZE = (1280, 720)
+# Lines of text printed around the sheet
+RESERVED_LINES = 3
+
+def layout(tile: int, count: int):
+    w, h = tools.terminal_pixel_size() or FALLBACK_SIZE
+    cell_w = tile + PADDING
+    cell_h = tile + LABEL_HEIGHT + PADDING
+    
+    import shutil
+    lines = shutil.get_terminal_size().lines
+    h -= RESERVED_LINES * h // max(lines, 1)
+    
+    columns = max(1, w // cell_w)
+    rows = max(1, h // cell_h)
+    per_page = columns * rows
+    pages = max(1, math.ceil(count / per_page))
+    return columns, rows, per_page, pages
+
+def _label(draw, font, text: str, width: int):
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + '…', font=font) > width:
+        text = text[:-1]
+    return text + '…'
+
+def _tile(file: Path, tile: int, cached: bool):
+    # Returns the path of the cached thumbnail, or the decoded tile itself when the cache is turned off.
+    # None for a background that can not be read, it should not take the rest of the page with it
+    try:
+        if cached:
+            return thumbnails.get(file, tile, False, evict_after=False)
+        from PIL import Image
+        with Image.open(file) as img:
+            img.draft('RGB', (tile, tile))
+            img.thumbnail((tile, tile))
+            return img.convert('RGB')
+    except Exception:
+        return None
+
+def build(entries: List[Tuple[Path, Tuple[int, int, int]]], tile: int, columns: int, jobs: int = None):
+    from PIL import Image, ImageDraw, ImageFont
+    from concurrent.futures import ThreadPoolExecutor
+    
+    # Thumbnails come from the cache, only missing ones are decoded. PIL releases the GIL while
+    # decoding and resizing, so threads are enough here
+    cached = thumbnails.budget() > 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        thumbs = list(executor.map(lambda e: _tile(e[0], tile, cached), entries))
+    if cached:
+        # Once per page, every eviction has to look at the whole cache
+        thumbnails.evict()
+    
+    rows = math.ceil(len(entries) / columns)
+    cell_w = tile + PADDING
+    cell_h = tile + LABEL_HEIGHT + PADDING
+    sheet = Image.new('RGB', (columns * cell_w + PADDING, rows * cell_h + PADDING), BACKGROUND)
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default()
+    
+    for n, ((file, color), thumb) in enumerate(zip(entries, thumbs)):
+        x = PADDING + (n % columns) * cell_w
+        y = PADDING + (n // columns) * cell_h
+        if thumb is None:
+            draw.rectangle((x, y, x + tile - 1, y + tile - 1), outline=PLACEHOLDER)
+        else:
+            if isinstance(thumb, Path):
+                with Image.open(thumb) as img:
+                    thumb = img.convert('RGB')
+            sheet.paste(thumb, (x + (tile - thumb.width) // 2, y + (tile - thumb.height) // 2))
+        draw.text((x, y + tile + 2), _label(draw, font, file.stem, tile), fill=color, font=font)
+    
+    # Another gallery run may be showing the sheet, it only ever sees a complete file
+    path = tools.get_cache_dir('gallery') / 'sheet.png'
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    sheet.save(tmp, format='PNG', compress_level=1)
+    publish.replace(tmp, path)
+    return path
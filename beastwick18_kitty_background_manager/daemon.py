@@ -0,0 +1,181 @@
+import os
+import json
+import signal
+import socket
+from pathlib import Path
+from typing import Optional
+import beastwick18_kitty_background_manager.config as cfg
+import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.output as out
+
+SOCKET_FILE = 'kittybg.sock'
+CONNECT_TIMEOUT = 0.5
+REPLY_TIMEOUT = 30
+
+# Set in the daemon process itself, so it never tries to forward requests to itself
+serving = False
+
+def socket_path():
+    if (runtime_dir := os.environ.get('XDG_RUNTIME_DIR')):
+        return Path(runtime_dir) / SOCKET_FILE
+    return tools.get_app_file(SOCKET_FILE)
+
+def request(command: str, **args):
+    # Returns None when no daemon is listening, so the caller can do the work itself
+    if serving or os.environ.get('KITTYBG_NO_DAEMON'):
+        return None
+    path = socket_path()
+    if not path.exists():
+        return None
+    
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(CONNECT_TIMEOUT)
+        try:
+            s.connect(str(path))
+        except (FileNotFoundError, ConnectionRefusedError, socket.timeout):
+            return None
+        
+        # Past this point the daemon may already be acting on the request, so failures are
+        # reported instead of silently running the command a second time
+        s.settimeout(REPLY_TIMEOUT)
+        try:
+            s.sendall(json.dumps({'command': command, 'args': args}).encode() + b'\n')
+            data = b''
+            while not data.endswith(b'\n'):
+                if not (chunk := s.recv(65536)):
+                    break
+                data += chunk
+            return json.loads(data)
+        except (OSError, ValueError) as e:
+            return {'ok': False, 'error': f'The daemon did not answer: {e}'}
+
+def handle(message: dict):
+    import beastwick18_kitty_background_manager.actions as actions
+    command = message.get('command')
+    args = message.get('args') or {}
+    
+    if command == 'ping':
+        return {'ok': True, 'result': os.getpid()}
+    
+    try:
+        # Pick up changes made to config.json by commands that were not forwarded
+        cfg.refresh()
+        return {'ok': True, 'result': actions.run(command, **args)}
+    except (actions.ActionError, TypeError) as e:
+        return {'ok': False, 'error': str(e)}
+    except Exception as e:
+        # Anything else is a failure of the daemon itself (e.g. a locked index or a full disk). The
+        # client still gets an answer and the daemon keeps serving
+        out.error(f'Could not run {command}: {type(e).__name__}: {e}')
+        return {'ok': False, 'error': f'The daemon could not run {command}: {e}'}
+
+async def _client(reader: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter', stop: 'asyncio.Event'):
+    import beastwick18_kitty_background_manager.actions as actions
+    message = None
+    response = {}
+    try:
+        line = await reader.readline()
+        try:
+            message = json.loads(line)
+        except ValueError:
+            response = {'ok': False, 'error': 'Malformed request'}
+        else:
+            if message.get('command') == 'stop':
+                stop.set()
+                response = {'ok': True, 'result': None}
+            else:
+                response = handle(message)
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+    finally:
+        writer.close()
+    if isinstance(message, dict) and response.get('ok') and actions.refills(message.get('command'), message.get('args') or {}):
+        # Only done once the client has its answer, so the switch itself is never slowed down by it
+        _refill()
+
+def _refill():
+    import beastwick18_kitty_background_manager.lookahead as lookahead
+    try:
+        lookahead.refill()
+    except Exception as e:
+        out.error(f'Could not prepare the upcoming backgrounds: {type(e).__name__}: {e}')
+
+async def _rotate(interval: float):
+    import asyncio
+    import beastwick18_kitty_background_manager.actions as actions
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            cfg.refresh()
+            actions.next_background()
+        except actions.ActionError:
+            continue
+        except Exception as e:
+            # Giving up here would leave the daemon running without its timer, try again next time
+            out.error(f'Could not advance to the next background: {type(e).__name__}: {e}')
+            continue
+        _refill()
+
+def _warm_thumbnails(files, target, limit: int):
+    # Runs on another thread while the loop keeps refreshing the config, so everything it needs from
+    # the config is read before and passed in
+    import beastwick18_kitty_background_manager.thumbnails as thumbnails
+    for file in files:
+        try:
+            thumbnails.make(file, target, False)
+        except Exception:
+            continue
+    thumbnails.evict_folder(thumbnails.cache_dir(), limit)
+
+async def _main(path: Path, interval: Optional[float]):
+    import asyncio
+    import beastwick18_kitty_background_manager.index as index
+    import beastwick18_kitty_background_manager.thumbnails as thumbnails
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    # Requests are served one at a time on the event loop, which keeps the sqlite connection and
+    # the config globals on a single thread
+    server = await asyncio.start_unix_server(lambda r, w: _client(r, w, stop), path=str(path))
+    os.chmod(path, 0o600)
+    
+    _refill()
+    tasks = []
+    if interval is not None:
+        tasks.append(asyncio.create_task(_rotate(interval)))
+    
+    files = [folder / (name + '.png') for folder in (cfg.enabled_path, cfg.disabled_path) for name in index.names(folder)]
+    warm = []
+    if (limit := thumbnails.budget()) > 0:
+        warm.append(loop.run_in_executor(None, _warm_thumbnails, files, thumbnails.target_size(cfg.get('preview_size'), False), limit))
+    
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*warm, return_exceptions=True)
+
+def serve(interval: Optional[float] = None):
+    import asyncio
+    global serving
+    path = socket_path()
+    if (response := request('ping')) is not None and response.get('ok'):
+        return response['result']
+    
+    # Nothing answered, so whatever is left at the socket path is stale
+    if path.exists() or path.is_symlink():
+        path.unlink()
+    
+    serving = True
+    cfg.ensure_loaded()
+    try:
+        asyncio.run(_main(path, interval))
+    finally:
+        serving = False
+        if path.exists():
+            path.unlink()
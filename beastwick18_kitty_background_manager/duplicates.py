@@ -0,0 +1,162 @@
+import os
+import hashlib
+from pathlib import Path
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.profiling as profiling
+
+ACTIONS = ('warn', 'skip', 'allow')
+HASH_BITS = 64
+MASK = (1 << HASH_BITS) - 1
+# images.phash of a file that could not be decoded, so it is not tried again until the file
+# changes. dhash() never returns it
+UNREADABLE = -(1 << (HASH_BITS - 1))
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+def dhash(img):
+    from PIL import Image
+    # Every bit says whether a pixel of a 9x8 grey thumbnail is darker than its right neighbour,
+    # which survives rescaling, re-encoding and small changes in tone
+    if img.mode not in ('L', 'RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    px = img.resize((9, 8), Image.BOX).convert('L').tobytes()
+    value = 0
+    for y in range(8):
+        row = px[y * 9:y * 9 + 9]
+        for x in range(8):
+            value = value << 1 | (row[x] < row[x + 1])
+    # SQLite integers are signed 64 bit
+    value = value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+    # One bit off is still the same image
+    return value + 1 if value == UNREADABLE else value
+
+def distance(a: int, b: int):
+    return ((a ^ b) & MASK).bit_count()
+
+class BKTree:
+    # Nodes are [hash, item, {distance: child}]
+    def __init__(self):
+        self.root = None
+
+    def add(self, value: int, item):
+        node = [value, item, {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while (child := current[2].get(d := distance(value, current[0]))) is not None:
+            current = child
+        current[2][d] = node
+
+    def find(self, value: int, limit: int):
+        # By the triangle inequality only subtrees whose edge is within limit of d can hold a match
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_value, item, children = stack.pop()
+            d = distance(value, node_value)
+            if d <= limit:
+                matches.append((d, item))
+            stack.extend(child for edge, child in children.items() if d - limit <= edge <= d + limit)
+        matches.sort(key=lambda m: m[0])
+        return matches
+
+def hash_image(path: str):
+    from PIL import Image, UnidentifiedImageError
+    # Files that can not be decoded are never reported as duplicates. None if the file is gone
+    try:
+        sha256 = file_hash(path)
+    except OSError:
+        return None
+    try:
+        with Image.open(path) as img:
+            return sha256, dhash(img)
+    except (OSError, UnidentifiedImageError):
+        return sha256, UNREADABLE
+
+def _missing(db, keys):
+    placeholders = ', '.join('?' * len(keys))
+    return db.execute(f'SELECT folder, name FROM images WHERE folder IN ({placeholders}) AND (sha256 IS NULL OR phash IS NULL)', keys).fetchall()
+
+def fill_missing(folders, jobs: int = 1):
+    # Images that were copied into the folders by hand have not been hashed yet
+    db = index.connect()
+    keys = [index.refresh(f) for f in folders]
+    rows = _missing(db, keys)
+    if len(rows) == 0:
+        return 0
+
+    paths = [os.path.join(folder, name + '.png') for folder, name in rows]
+    jobs = min(jobs, len(paths))
+    with profiling.span('duplicates.fill'):
+        if jobs == 1:
+            results = [hash_image(p) for p in paths]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(hash_image, paths, chunksize=16))
+
+    with index.transaction():
+        db.executemany('UPDATE images SET sha256 = ?, phash = ? WHERE folder = ? AND name = ?',
+                       ((*hashes, folder, name) for (folder, name), hashes in zip(rows, results) if hashes is not None))
+    return len(rows)
+
+def record(file: Path, sha256: str, source: str, phash: int):
+    with index.transaction() as db:
+        db.execute('UPDATE images SET sha256 = ?, source = ?, phash = ? WHERE folder = ? AND name = ?',
+                   (sha256, source, phash, index.folder_key(file.parent), file.stem))
+
+def library(folders, jobs: int = 1):
+    # A BK-tree over the perceptual hashes and a lookup of the exact hashes of every image in the folders
+    fill_missing(folders, jobs)
+    keys = [index.folder_key(f) for f in folders]
+    placeholders = ', '.join('?' * len(keys))
+    tree = BKTree()
+    exact = {}
+    rows = index.connect().execute(f'SELECT folder, name, sha256, source, phash FROM images WHERE folder IN ({placeholders}) AND phash IS NOT NULL AND phash != ?', (*keys, UNREADABLE))
+    for folder, name, sha256, source, phash in rows:
+        file = Path(folder) / (name + '.png')
+        tree.add(phash, file)
+        exact.setdefault(sha256, file)
+        if source is not None:
+            exact.setdefault(source, file)
+    return tree, exact
+
+def find(tree: BKTree, exact: dict, source: str, phash: int, limit: int):
+    # Returns the closest match and the distance to it, which is None for a byte for byte copy
+    if (file := exact.get(source)) is not None:
+        return file, None
+    if matches := tree.find(phash, limit):
+        d, file = matches[0]
+        return file, d
+    return None
+
+def _root(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def clusters(folders, limit: int, jobs: int = 1):
+    fill_missing(folders, jobs)
+    keys = [index.folder_key(f) for f in folders]
+    placeholders = ', '.join('?' * len(keys))
+    rows = index.connect().execute(f'SELECT folder, name, phash FROM images WHERE folder IN ({placeholders}) AND phash IS NOT NULL AND phash != ? ORDER BY folder, name', (*keys, UNREADABLE)).fetchall()
+
+    # Each image only looks for matches among the ones inserted before it, so every pair is seen once
+    tree = BKTree()
+    parent = list(range(len(rows)))
+    for i, (_, _, phash) in enumerate(rows):
+        for _, j in tree.find(phash, limit):
+            parent[_root(parent, i)] = _root(parent, j)
+        tree.add(phash, i)
+
+    groups = {}
+    for i, (folder, name, _) in enumerate(rows):
+        groups.setdefault(_root(parent, i), []).append(Path(folder) / (name + '.png'))
+    return [g for g in groups.values() if len(g) > 1]
@@ -0,0 +1,62 @@
+from pathlib import Path
+import beastwick18_kitty_background_manager.index as index
+
+# The most names offered when completing on the command line
+COMPLETIONS = 50
+# Names that share trigrams with a mistyped name are only compared in full for this many of them,
+# the index hands over the most promising ones first
+CANDIDATES = 200
+# How alike (difflib ratio) a mistyped name and a background have to be to count as a match
+MIN_SIMILARITY = 0.6
+# The most names suggested when a background can not be found
+SUGGESTIONS = 3
+
+def search(folders, text: str, limit: int):
+    # Returns up to limit (folder, name), best first: the name itself, names starting with text, names
+    # containing it, then names that are alike, for typos. Ties go to the folder that was given first
+    import difflib
+    order = {index.folder_key(f): n for n, f in enumerate(folders)}
+    lowered = text.lower()
+
+    def rank(row):
+        folder, name = row
+        position = name.lower().find(lowered)
+        return name != text, position != 0, position, len(name), name, order[folder]
+
+    found = sorted(index.containing(folders, text, limit), key=rank)
+    if len(found) < limit and len(text) >= 3:
+        seen = set(found)
+        alike = []
+        for folder, name in index.sharing_trigrams(folders, text, CANDIDATES):
+            if (folder, name) in seen:
+                continue
+            if (ratio := difflib.SequenceMatcher(None, lowered, name.lower()).ratio()) >= MIN_SIMILARITY:
+                alike.append((-ratio, len(name), name, order[folder], folder))
+        found += [(folder, name) for *_, name, _, folder in sorted(alike)[:limit - len(found)]]
+    return found
+
+def resolve(folders, text: str):
+    # The background a partial name can only refer to: the one that is called that apart from case,
+    # or else the only one that starts with it. Anything less certain is left to the user, see suggest()
+    lowered = text.lower()
+    # A name is in each folder at most once, so one more row than folders shows whether there is a second name
+    found = [(folder, name) for folder, name in search(folders, text, len(folders) + 1) if name.lower().startswith(lowered)]
+    exact = [(folder, name) for folder, name in found if name.lower() == lowered]
+    if len({name for _, name in exact or found}) != 1:
+        return None
+    folder, name = (exact or found)[0]
+    return Path(folder) / (name + '.png')
+
+def suggest(message: str, folders, text: str):
+    # A name that is in several folders is only suggested once
+    if len(found := list(dict.fromkeys(name for _, name in search(folders, text, SUGGESTIONS * len(folders))))[:SUGGESTIONS]) > 0:
+        message += '. Did you mean ' + ', '.join(f'"{name}"' for name in found) + '?'
+    return message
+
+def complete(folders, incomplete: str, limit: int = COMPLETIONS):
+    # Shells put what is offered in place of the word being completed, so names that start with it
+    # are offered on their own when there are any
+    names = [name for _, name in search(folders, incomplete, limit)]
+    lowered = incomplete.lower()
+    starting = [name for name in names if name.lower().startswith(lowered)]
+    return list(dict.fromkeys(starting or names))
@@ -0,0 +1,468 @@
+import os
+import re
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.profiling as profiling
+
+INDEX_FILE = 'index.db'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Each entry upgrades the schema by one version, new entries must only ever be appended
+MIGRATIONS = [
+    '''
+    CREATE TABLE folders (
+        path TEXT PRIMARY KEY,
+        mtime INTEGER NOT NULL
+    );
+    CREATE TABLE images (
+        id INTEGER PRIMARY KEY,
+        folder TEXT NOT NULL,
+        name TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime INTEGER NOT NULL,
+        width INTEGER,
+        height INTEGER,
+        UNIQUE (folder, name)
+    );
+    CREATE INDEX images_name ON images (name);
+    ''',
+    '''
+    CREATE TABLE rotation (
+        image_id INTEGER PRIMARY KEY REFERENCES images (id),
+        drawn INTEGER NOT NULL DEFAULT 0,
+        weight REAL NOT NULL DEFAULT 1.0
+    );
+    CREATE TRIGGER images_delete_rotation AFTER DELETE ON images BEGIN
+        DELETE FROM rotation WHERE image_id = old.id;
+    END;
+    ''',
+    '''
+    ALTER TABLE images ADD COLUMN sha256 TEXT;
+    ALTER TABLE images ADD COLUMN source TEXT;
+    ALTER TABLE images ADD COLUMN phash INTEGER;
+    ''',
+    '''
+    ALTER TABLE images ADD COLUMN luminance REAL;
+    ALTER TABLE images ADD COLUMN contrast REAL;
+    ALTER TABLE images ADD COLUMN saturation REAL;
+    ALTER TABLE images ADD COLUMN hue REAL;
+    ALTER TABLE images ADD COLUMN palette TEXT;
+    CREATE INDEX images_luminance ON images (folder, luminance);
+    ''',
+    '''
+    ALTER TABLE images ADD COLUMN original TEXT;
+    ALTER TABLE images ADD COLUMN params TEXT;
+    CREATE INDEX images_original ON images (original);
+    ''',
+    '''
+    CREATE VIRTUAL TABLE image_names USING fts5 (name, content = 'images', content_rowid = 'id', tokenize = 'trigram');
+    INSERT INTO image_names (image_names) VALUES ('rebuild');
+    CREATE TABLE name_changes (
+        id INTEGER PRIMARY KEY,
+        image_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        added INTEGER NOT NULL
+    );
+    CREATE TRIGGER images_insert_name AFTER INSERT ON images BEGIN
+        INSERT INTO name_changes (image_id, name, added) VALUES (new.id, new.name, 1);
+    END;
+    CREATE TRIGGER images_delete_name AFTER DELETE ON images BEGIN
+        INSERT INTO name_changes (image_id, name, added) VALUES (old.id, old.name, 0);
+    END;
+    CREATE TRIGGER images_rename AFTER UPDATE OF name ON images BEGIN
+        INSERT INTO name_changes (image_id, name, added) VALUES (old.id, old.name, 0), (new.id, new.name, 1);
+    END;
+    ''',
+    '''
+    CREATE TABLE tags (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        collection INTEGER NOT NULL DEFAULT 0,
+        active INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (collection, name)
+    );
+    CREATE TABLE image_tags (
+        tag_id INTEGER NOT NULL REFERENCES tags (id),
+        image_id INTEGER NOT NULL REFERENCES images (id),
+        PRIMARY KEY (tag_id, image_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX image_tags_image ON image_tags (image_id);
+    CREATE TRIGGER images_delete_tags AFTER DELETE ON images BEGIN
+        DELETE FROM image_tags WHERE image_id = old.id;
+    END;
+    CREATE TRIGGER tags_delete_images AFTER DELETE ON tags BEGIN
+        DELETE FROM image_tags WHERE tag_id = old.id;
+    END;
+    ''',
+    '''
+    CREATE INDEX images_file ON images (size, mtime);
+    ''',
+    '''
+    CREATE TABLE originals (
+        sha256 TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        params TEXT
+    );
+    CREATE INDEX originals_path ON originals (path);
+    ''',
+]
+
+# Upserting keeps the id of an existing row, which INSERT OR REPLACE would not.
+# The hashes and statistics are dropped as soon as the file changed, they are computed again when needed
+UPSERT_IMAGE = '''
+    INSERT INTO images (folder, name, size, mtime, width, height) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (folder, name) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, width = excluded.width, height = excluded.height,
+        sha256 = iif(size = excluded.size AND mtime = excluded.mtime, sha256, NULL),
+        source = iif(size = excluded.size AND mtime = excluded.mtime, source, NULL),
+        phash = iif(size = excluded.size AND mtime = excluded.mtime, phash, NULL),
+        luminance = iif(size = excluded.size AND mtime = excluded.mtime, luminance, NULL),
+        contrast = iif(size = excluded.size AND mtime = excluded.mtime, contrast, NULL),
+        saturation = iif(size = excluded.size AND mtime = excluded.mtime, saturation, NULL),
+        hue = iif(size = excluded.size AND mtime = excluded.mtime, hue, NULL),
+        palette = iif(size = excluded.size AND mtime = excluded.mtime, palette, NULL)
+'''
+
+# Orders backgrounds can be listed in, as the columns that are sorted by. Images without
+# statistics always come last
+ORDERS = {
+    'name': ('name',),
+    'luminance': ('luminance', 'name'),
+    'size': ('size', 'name'),
+    'mtime': ('mtime', 'name'),
+}
+
+# folders.mtime of a folder that was not there the last time it was looked at. Its rows are kept
+# until it is back, so a folder on a drive that is not mounted does not lose its tags and originals
+MISSING = -1
+
+_db = None
+_depth = 0
+
+def connect():
+    global _db
+    if _db is not None:
+        return _db
+
+    import sqlite3
+    _db = sqlite3.connect(tools.get_app_file(INDEX_FILE), timeout=30, isolation_level=None)
+    _db.execute('PRAGMA journal_mode=WAL')
+    _db.execute('PRAGMA synchronous=NORMAL')
+    # Backs the REGEXP operator, which sqlite leaves to the application
+    _db.create_function('regexp', 2, _regexp, deterministic=True)
+
+    version = _db.execute('PRAGMA user_version').fetchone()[0]
+    if version < len(MIGRATIONS):
+        with transaction():
+            # Re-read the version inside the write lock in case another process migrated first
+            version = _db.execute('PRAGMA user_version').fetchone()[0]
+            for migration in MIGRATIONS[version:]:
+                for statement in _statements(migration):
+                    _db.execute(statement)
+            _db.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+    return _db
+
+def _regexp(pattern: str, value: str):
+    return value is not None and _compile(pattern).match(value) is not None
+
+_patterns = {}
+
+def _compile(pattern: str):
+    if (compiled := _patterns.get(pattern)) is None:
+        compiled = _patterns[pattern] = re.compile(pattern)
+    return compiled
+
+def _statements(script: str):
+    # executescript() would commit the migration transaction, so split the script by hand.
+    # Splitting on ';' alone would cut triggers in half
+    import sqlite3
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ''
+
+@contextmanager
+def transaction():
+    global _depth
+    db = connect()
+    if _depth == 0:
+        db.execute('BEGIN IMMEDIATE')
+    _depth += 1
+    try:
+        yield db
+    except BaseException:
+        _depth -= 1
+        if _depth == 0:
+            db.execute('ROLLBACK')
+        raise
+    _depth -= 1
+    if _depth == 0:
+        db.execute('COMMIT')
+
+def folder_key(folder: Path):
+    return os.path.abspath(folder)
+
+def png_size(path):
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(24)
+    except OSError:
+        return None, None
+    if len(header) < 24 or not header.startswith(PNG_SIGNATURE):
+        return None, None
+    return struct.unpack('>II', header[16:24])
+
+def _stat_row(path):
+    st = os.stat(path)
+    w, h = png_size(path)
+    return st.st_size, st.st_mtime_ns, w, h
+
+def _folder_mtime(folder):
+    try:
+        return os.stat(folder).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+def _mark_fresh(key, mtime):
+    _db.execute('INSERT INTO folders (path, mtime) VALUES (?, ?) ON CONFLICT (path) DO UPDATE SET mtime = excluded.mtime', (key, mtime))
+
+def _scan(folder: Path, key: str, mtime: int, full: bool = False, dropping=()):
+    with profiling.span('index.scan'):
+        _scan_folder(folder, key, mtime, full, dropping)
+
+def _same_content(path: str, sha256):
+    import beastwick18_kitty_background_manager.duplicates as duplicates
+    return sha256 is None or duplicates.file_hash(path) == sha256
+
+def _moved_here(db, folder: Path, key: str, name: str, size: int, mtime: int, gone, dropping):
+    # The row of a file that was renamed or moved by hand. A rename keeps the size and mtime, the
+    # content is compared too where it was hashed before. Rows of folders that are not there are
+    # left alone, unless the index is dropping that folder anyway
+    path = os.path.join(folder, name + '.png')
+    candidates = [(image_id, sha256) for image_id, other, other_name, sha256 in
+                  db.execute('SELECT id, folder, name, sha256 FROM images WHERE size = ? AND mtime = ?', (size, mtime))
+                  if (other_name in gone if other == key else
+                      (other in dropping or os.path.isdir(other)) and not os.path.exists(os.path.join(other, other_name + '.png')))]
+    if len(candidates) != 1 or not _same_content(path, candidates[0][1]):
+        return None
+    return candidates[0][0]
+
+def _arrivals(db, key: str):
+    # Files in the other indexed folders that have no row yet, by size and mtime. Only looked for
+    # when files went missing from the folder that is scanned, they could have been moved there
+    arrivals = {}
+    for other, in db.execute('SELECT path FROM folders WHERE path != ? AND mtime != ?', (key, MISSING)).fetchall():
+        known = {name for name, in db.execute('SELECT name FROM images WHERE folder = ?', (other,))}
+        try:
+            with os.scandir(other) as it:
+                for entry in it:
+                    if entry.name.endswith('.png') and len(entry.name) > 4 and entry.name[:-4] not in known and entry.is_file():
+                        st = entry.stat()
+                        arrivals.setdefault((st.st_size, st.st_mtime_ns), []).append((other, entry.name[:-4]))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return arrivals
+
+def _scan_folder(folder: Path, key: str, mtime: int, full: bool, dropping):
+    db = connect()
+    known = {name for name, in db.execute('SELECT name FROM images WHERE folder = ?', (key,))}
+
+    found = set()
+    with os.scandir(folder) as it:
+        for entry in it:
+            # DirEntry.is_file() is answered by readdir on most filesystems, so only new files cost a stat
+            if entry.name.endswith('.png') and len(entry.name) > 4 and entry.is_file():
+                found.add(entry.name[:-4])
+
+    with transaction():
+        gone = known - found
+        # Without any other rows, e.g. on the first scan, there is nothing a new file could have been before
+        elsewhere = gone or db.execute('SELECT 1 FROM images WHERE folder != ? LIMIT 1', (key,)).fetchone() is not None
+        rows = []
+        # A full scan also re-reads the files that are already known, in case they were changed in place
+        for name in sorted(found if full else found - known):
+            try:
+                row = (key, name, *_stat_row(os.path.join(folder, name + '.png')))
+            except FileNotFoundError:
+                continue
+            # Files that were renamed or moved by hand keep their id, and with it their tags, turn in the rotation and original
+            if name not in known and elsewhere and (image_id := _moved_here(db, folder, key, name, row[2], row[3], gone, dropping)) is not None:
+                moved = db.execute('SELECT name FROM images WHERE id = ? AND folder = ?', (image_id, key)).fetchone()
+                gone.discard(moved[0] if moved is not None else None)
+                db.execute('UPDATE images SET folder = ?, name = ? WHERE id = ?', (key, name, image_id))
+                continue
+            rows.append(row)
+        arrivals = _arrivals(db, key) if gone else {}
+        for name in gone:
+            image_id, size, mtime, sha256 = db.execute('SELECT id, size, mtime, sha256 FROM images WHERE folder = ? AND name = ?', (key, name)).fetchone()
+            if len(moved := arrivals.get((size, mtime), [])) == 1 and _same_content(os.path.join(*moved[0]) + '.png', sha256):
+                db.execute('UPDATE images SET folder = ?, name = ? WHERE id = ?', (*moved.pop(), image_id))
+            else:
+                db.execute('DELETE FROM images WHERE id = ?', (image_id,))
+        db.executemany(UPSERT_IMAGE, rows)
+        _mark_fresh(key, mtime)
+
+def refresh(folder: Path):
+    # Returns the key of the folder in the images table, or None while the folder is not there
+    db = connect()
+    key = folder_key(folder)
+    mtime = _folder_mtime(folder)
+    row = db.execute('SELECT mtime FROM folders WHERE path = ?', (key,)).fetchone()
+    if mtime is None:
+        if row is not None and row[0] != MISSING:
+            with transaction():
+                _mark_fresh(key, MISSING)
+        return None
+
+    if row is None or row[0] != mtime:
+        # Anything could have happened to a folder while it was gone, so all of its files are looked at again
+        _scan(folder, key, mtime, full=row is not None and row[0] == MISSING)
+    return key
+
+def order_by(order: str = 'name', reverse: bool = False):
+    direction = 'DESC' if reverse else 'ASC'
+    return ', '.join(f'{column} {direction} NULLS LAST' for column in ORDERS[order])
+
+def all_of(*conditions):
+    # Joins (condition, params) pairs like the ones from stats.condition() with AND, leaving out empty ones
+    used = [(condition, params) for condition, params in conditions if condition]
+    return ' AND '.join(f'({condition})' for condition, _ in used), tuple(p for _, params in used for p in params)
+
+def names(folder: Path, condition: str = '', params=(), order: str = 'name'):
+    # condition is an extra SQL condition on the images table, e.g. from stats.condition()
+    key = refresh(folder)
+    where = f'folder = ? AND ({condition})' if condition else 'folder = ?'
+    for name, in connect().execute(f'SELECT name FROM images WHERE {where} ORDER BY {order_by(order)}', (key, *params)):
+        yield name
+
+def query(folders, condition: str = '', params=(), order: str = 'name', reverse: bool = False, limit: int = None, offset: int = 0):
+    # Returns a cursor over (folder, name, size, mtime, width, height) across all of the folders
+    keys = [refresh(f) for f in folders]
+    placeholders = ', '.join('?' * len(keys))
+    where = f'folder IN ({placeholders})' + (f' AND ({condition})' if condition else '')
+    return connect().execute(f'''SELECT folder, name, size, mtime, width, height FROM images WHERE {where}
+                                     ORDER BY {order_by(order, reverse)} LIMIT ? OFFSET ?''', (*keys, *params, -1 if limit is None else limit, offset))
+
+def _sync_names():
+    # The triggers only log which names changed. Writing to the full text index from a trigger
+    # flushes it once per row, which made the first scan of a large folder several times slower
+    db = connect()
+    if db.execute('SELECT 1 FROM name_changes LIMIT 1').fetchone() is None:
+        return
+    with transaction():
+        db.execute('''INSERT INTO image_names (image_names, rowid, name)
+                      SELECT iif(added, NULL, 'delete'), image_id, name FROM name_changes ORDER BY id''')
+        db.execute('DELETE FROM name_changes')
+
+def _phrase(text: str):
+    return '"' + text.replace('"', '""') + '"'
+
+def containing(folders, text: str, limit: int):
+    # Returns (folder, name) for up to limit names that contain text, ignoring case. Names that start
+    # with it come first, shorter names before longer ones. From 3 characters on the trigram index
+    # answers this, shorter text has to be looked for in every name
+    keys = [refresh(f) for f in folders]
+    _sync_names()
+    placeholders = ', '.join('?' * len(keys))
+    if len(text) >= 3:
+        source, match, arg = 'image_names JOIN images i ON i.id = image_names.rowid', 'image_names MATCH ?', _phrase(text)
+    else:
+        source, match, arg = 'images i', 'instr(lower(i.name), ?) > 0', text.lower()
+    return connect().execute(f'''SELECT i.folder, i.name FROM {source} WHERE {match} AND i.folder IN ({placeholders})
+                                     ORDER BY instr(lower(i.name), ?) != 1, length(i.name), i.name LIMIT ?''', (arg, *keys, text.lower(), limit))
+
+def sharing_trigrams(folders, text: str, limit: int):
+    # Returns (folder, name) for up to limit names that have any 3 characters in a row in common with
+    # text, the ones that share the most (and the rarest) first
+    keys = [refresh(f) for f in folders]
+    _sync_names()
+    placeholders = ', '.join('?' * len(keys))
+    text = text.lower()
+    if len(grams := {text[i:i + 3] for i in range(len(text) - 2)}) == 0:
+        return []
+    return connect().execute(f'''SELECT i.folder, i.name FROM image_names JOIN images i ON i.id = image_names.rowid
+                                     WHERE image_names MATCH ? AND i.folder IN ({placeholders}) ORDER BY rank LIMIT ?''',
+                             (' OR '.join(_phrase(g) for g in sorted(grams)), *keys, limit))
+
+def stored_names(folder: Path):
+    # What the index holds right now, without checking the folder for changes first
+    return [name for name, in connect().execute('SELECT name FROM images WHERE folder = ?', (folder_key(folder),))]
+
+def contains(folder: Path, name: str):
+    key = refresh(folder)
+    return connect().execute('SELECT 1 FROM images WHERE folder = ? AND name = ?', (key, name)).fetchone() is not None
+
+def stamp(folders):
+    # The mtimes of the folders right before we change them. Handed to add_file, remove_files or
+    # move_files afterwards, the folders are then taken as up to date if nobody else had changed them
+    return {folder_key(f): _folder_mtime(f) for f in folders}
+
+def add_file(file: Path, before: dict = None):
+    db = connect()
+    key = folder_key(file.parent)
+    with transaction():
+        db.execute(UPSERT_IMAGE, (key, file.stem, *_stat_row(file)))
+        _touch(key, file.parent, before)
+
+def remove_file(file: Path, before: dict = None):
+    remove_files([file], before)
+
+def remove_files(files, before: dict = None):
+    db = connect()
+    folders = {}
+    with transaction():
+        for file in files:
+            key = folder_key(file.parent)
+            db.execute('DELETE FROM images WHERE folder = ? AND name = ?', (key, file.stem))
+            folders[key] = file.parent
+        for key, folder in folders.items():
+            _touch(key, folder, before)
+
+def move_files(moves, before: dict = None):
+    db = connect()
+    folders = {}
+    with transaction():
+        for src, dest in moves:
+            src_key = folder_key(src.parent)
+            dest_key = folder_key(dest.parent)
+            # Update the row in place so the image keeps its id
+            db.execute('DELETE FROM images WHERE folder = ? AND name = ?', (dest_key, dest.stem))
+            cur = db.execute('UPDATE images SET folder = ?, name = ? WHERE folder = ? AND name = ?', (dest_key, dest.stem, src_key, src.stem))
+            if cur.rowcount == 0:
+                db.execute(UPSERT_IMAGE, (dest_key, dest.stem, *_stat_row(dest)))
+            folders[src_key] = src.parent
+            folders[dest_key] = dest.parent
+        # The folders' mtimes are only recorded once all of the moves are done
+        for key, folder in folders.items():
+            _touch(key, folder, before)
+
+def _touch(key: str, folder: Path, before: dict = None):
+    # Our own change moved the folder's mtime. It is recorded, so the next lookup does not rescan, only
+    # if the index was up to date right before the change. Otherwise a file that was added by someone
+    # else in the meantime would never be scanned, so the folder is left to the next lookup
+    if before is None or (expected := before.get(key)) is None:
+        return
+    row = _db.execute('SELECT mtime FROM folders WHERE path = ?', (key,)).fetchone()
+    if row is not None and row[0] == expected and (mtime := _folder_mtime(folder)) is not None:
+        _mark_fresh(key, mtime)
+
+def rebuild(folders):
+    db = connect()
+    keys = [folder_key(f) for f in folders]
+    placeholders = ', '.join('?' * len(keys))
+    with transaction():
+        # Rows of folders that are not indexed anymore are dropped last, files that were moved from
+        # one of them into the new folders take their rows along
+        dropping = {key for key, in db.execute(f'SELECT DISTINCT folder FROM images WHERE folder NOT IN ({placeholders})', keys)}
+        for folder, key in zip(folders, keys):
+            if (mtime := _folder_mtime(folder)) is None:
+                refresh(folder)
+            else:
+                _scan(folder, key, mtime, full=True, dropping=dropping)
+        db.execute(f'DELETE FROM images WHERE folder NOT IN ({placeholders})', keys)
+        db.execute(f'DELETE FROM folders WHERE path NOT IN ({placeholders})', keys)
+    return db.execute(f'SELECT count(*) FROM images WHERE folder IN ({placeholders}) AND folder NOT IN (SELECT path FROM folders WHERE mtime = ?)',
+                      (*keys, MISSING)).fetchone()[0]
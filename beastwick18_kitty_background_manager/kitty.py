@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import base64
+import random
+import select
+import tempfile
+from pathlib import Path
+from typing import Optional
+import beastwick18_kitty_background_manager.tools as tools
+
+ESC = b'\x1b'
+CHUNK_SIZE = 4096
+REPLY_TIMEOUT = 1.0
+MAX_ID = 2 ** 32 - 1
+# The number of uploaded images remembered per kitty window
+MAX_REMEMBERED = 256
+TRANSMISSIONS = ('auto', 'file', 'shm', 'temp', 'direct')
+
+class Terminal:
+    def __init__(self, out=None):
+        self.out = out if out is not None else sys.stdout.buffer
+
+    def write(self, data: bytes):
+        self.out.write(data)
+        self.out.flush()
+
+    def query(self, data: bytes, timeout: float = REPLY_TIMEOUT):
+        # kitty answers on the terminal's input, so echo and line buffering have to be off
+        # while waiting, otherwise the answer would be printed to the screen
+        import termios
+        import tty
+        try:
+            fd = os.open('/dev/tty', os.O_RDWR | os.O_NOCTTY)
+        except OSError:
+            self.write(data)
+            return None
+        old = termios.tcgetattr(fd)
+        try:
+            tty.setcbreak(fd, termios.TCSANOW)
+            self.write(data)
+            reply = b''
+            while not reply.endswith(ESC + b'\\'):
+                ready, _, _ = select.select([fd], [], [], timeout)
+                if not ready:
+                    return None
+                reply += os.read(fd, 1024)
+            return reply.decode(errors='replace')
+        finally:
+            termios.tcsetattr(fd, termios.TCSAFLUSH, old)
+            os.close(fd)
+
+    def size(self):
+        # (columns, rows, width in pixels, height in pixels)
+        import shutil
+        cols, rows = shutil.get_terminal_size()
+        w, h = tools.terminal_pixel_size() or (0, 0)
+        return cols, rows, w, h
+
+def command(payload: bytes = b'', **keys):
+    controls = ','.join(f'{k}={v}' for k, v in keys.items())
+    return ESC + b'_G' + controls.encode() + b';' + payload + ESC + b'\\'
+
+def is_remote():
+    return any(os.environ.get(v) for v in ('SSH_CONNECTION', 'SSH_CLIENT', 'SSH_TTY'))
+
+def choose_transmission(preferred: str = 'auto'):
+    if preferred != 'auto':
+        return preferred
+    # Anything but direct transmission needs the terminal to be able to read our files
+    if is_remote():
+        return 'direct'
+    return 'file'
+
+def transmit(terminal, path: Path, image_id: int, transmission: str, **keys):
+    keys = {'a': 'T', 'f': 100, 'i': image_id, 'q': 2, **keys}
+
+    if transmission == 'file':
+        # kitty reads the file itself, nothing but the path goes through the tty
+        terminal.write(command(base64.standard_b64encode(os.fsencode(path)), t='f', **keys))
+        return
+
+    data = Path(path).read_bytes()
+    if transmission == 'temp':
+        # kitty only deletes temporary files whose name contains this marker
+        fd, tmp = tempfile.mkstemp(prefix='tty-graphics-protocol-', suffix='.png')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        terminal.write(command(base64.standard_b64encode(os.fsencode(tmp)), t='t', **keys))
+        return
+
+    if transmission == 'shm':
+        from multiprocessing import shared_memory, resource_tracker
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        shm.buf[:len(data)] = data
+        name = '/' + shm.name
+        shm.close()
+        # kitty unlinks the shared memory once it has read it, so it must not be cleaned up here
+        resource_tracker.unregister(name, 'shared_memory')
+        terminal.write(command(base64.standard_b64encode(name.encode()), t='s', S=len(data), **keys))
+        return
+
+    encoded = base64.standard_b64encode(data)
+    chunks = [encoded[i:i + CHUNK_SIZE] for i in range(0, len(encoded), CHUNK_SIZE)] or [b'']
+    for n, chunk in enumerate(chunks):
+        more = int(n < len(chunks) - 1)
+        if n == 0:
+            terminal.write(command(chunk, t='d', m=more, **keys))
+        else:
+            terminal.write(command(chunk, m=more))
+
+def _registry_path():
+    window = os.environ.get('KITTY_WINDOW_ID')
+    pid = os.environ.get('KITTY_PID')
+    if window is None or pid is None:
+        return None
+    return tools.get_cache_dir('kitty') / f'images-{pid}-{window}.json'
+
+def _load_registry(path: Optional[Path]):
+    if path is None:
+        return {}
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+def _save_registry(path: Optional[Path], registry: dict):
+    if path is None:
+        return
+    # dicts keep insertion order, so the oldest uploads are the first to be forgotten
+    items = list(registry.items())[-MAX_REMEMBERED:]
+    tmp = path.with_name(path.name + f'.{os.getpid()}.tmp')
+    tmp.write_text(json.dumps(dict(items)))
+    os.replace(tmp, path)
+
+def image_key(path: Path):
+    st = os.stat(path)
+    return f'{os.path.realpath(path)}:{st.st_mtime_ns}:{st.st_size}'
+
+def _cursor_offset(terminal, width_px: int, align: str):
+    cols, _, w, _ = terminal.size()
+    if align == 'left' or cols == 0 or w == 0:
+        return 0
+    image_cols = -(-width_px * cols // w)
+    free = max(0, cols - image_cols)
+    return free if align == 'right' else free // 2
+
+def show(path: Path, width_px: int, align: str = 'left', transmission: str = 'auto', terminal=None):
+    terminal = terminal if terminal is not None else Terminal()
+    registry_path = _registry_path()
+    registry = _load_registry(registry_path)
+    key = image_key(path)
+
+    if (offset := _cursor_offset(terminal, width_px, align)) > 0:
+        terminal.write(ESC + f'[{offset}C'.encode())
+
+    if (image_id := registry.get(key)) is not None:
+        # The image is still stored in kitty from an earlier preview, so just place it again.
+        # kitty may have evicted it since, in which case it answers with an error
+        reply = terminal.query(command(a='p', i=image_id, q=0))
+        if reply is not None and ';OK' in reply:
+            terminal.write(b'\n')
+            return image_id
+        registry.pop(key)
+
+    image_id = random.randint(1, MAX_ID)
+    transmit(terminal, path, image_id, choose_transmission(transmission))
+    terminal.write(b'\n')
+
+    registry[key] = image_id
+    _save_registry(registry_path, registry)
+    return image_id
@@ -0,0 +1,152 @@
+import os
+import secrets
+from pathlib import Path
+from typing import Optional
+import beastwick18_kitty_background_manager.config as cfg
+import beastwick18_kitty_background_manager.state as state
+import beastwick18_kitty_background_manager.publish as publish
+import beastwick18_kitty_background_manager.rotation as rotation
+import beastwick18_kitty_background_manager.variants as variants
+import beastwick18_kitty_background_manager.profiling as profiling
+import beastwick18_kitty_background_manager.tags as tags
+import beastwick18_kitty_background_manager.index as index
+
+# The prepared files live next to current.png, so switching to one of them is a single rename
+QUEUE_DIR = '.queue'
+
+# Queue entries are stored in config.json under background.queue as
+# {'file': background, 'signature': [ino, size, mtime], 'artefact': prepared file or None,
+#  'size': the window size the file was prepared for}
+
+def queue_dir():
+    return cfg.current_path / QUEUE_DIR
+
+def _valid(entry: dict):
+    file = Path(entry['file'])
+    # Backgrounds that were disabled, deleted or changed since they were queued are dropped
+    return file.parent.resolve() == cfg.enabled_path.resolve() and state.signature(file) == tuple(entry['signature'])
+
+def _discard(entry: dict):
+    if (artefact := entry.get('artefact')) is not None and os.path.lexists(artefact):
+        os.unlink(artefact)
+
+def entry(file: Path):
+    return {'file': str(file.resolve()), 'signature': list(state.signature(file)), 'artefact': None}
+
+def pop(size: Optional[str] = None):
+    # Returns the next valid queued background as (file, prepared file or None)
+    with cfg.transaction() as data:
+        queue = data.setdefault('background', {}).get('queue', [])
+        while queue:
+            e = queue.pop(0)
+            if _valid(e):
+                artefact = e.get('artefact')
+                if artefact is not None and e.get('size') != size:
+                    # Prepared for another window, the background is still next but gets published anew
+                    _discard(e)
+                    artefact = None
+                elif artefact is not None and not os.path.lexists(artefact):
+                    artefact = None
+                data['background']['queue'] = queue
+                return Path(e['file']), None if artefact is None else Path(artefact)
+            _discard(e)
+        data['background']['queue'] = queue
+    return None
+
+def push_front(file: Path):
+    with cfg.transaction() as data:
+        background = data.setdefault('background', {})
+        background['queue'] = [entry(file)] + background.get('queue', [])
+
+def flush():
+    # Drops every queued background, e.g. after they were drawn from a collection that is no longer active
+    with cfg.transaction() as data:
+        background = data.setdefault('background', {})
+        for e in background.get('queue', []):
+            _discard(e)
+        background['queue'] = []
+
+def _last_name(queue):
+    if queue:
+        return Path(queue[-1]['file']).stem
+    return cfg.get_next()
+
+def refill():
+    length = cfg.get('queue_size')
+    with profiling.span('queue.refill'):
+        # Decide what comes next while holding the lock, but copy the files without it
+        with cfg.transaction() as data:
+            background = data.setdefault('background', {})
+            queue = [e for e in background.get('queue', []) if _valid(e) or _discard(e)]
+            for e in queue[length:]:
+                _discard(e)
+            queue = queue[:length]
+            condition, params = tags.active_condition()
+            while len(queue) < length:
+                # Queued backgrounds only count as drawn once they are popped, until then the
+                # queue itself keeps them from being drawn twice
+                queued = [Path(e['file']).stem for e in queue]
+                taken = (f'images.name NOT IN ({", ".join("?" * len(queued))})', queued) if queued else ('', ())
+                if (bg := rotation.peek(cfg.enabled_path, _last_name(queue), *index.all_of((condition, params), taken))) is None:
+                    break
+                file = cfg.enabled_path / (bg + '.png')
+                if state.signature(file) is None:
+                    break
+                queue.append(entry(file))
+            background['queue'] = queue
+            size = background.get('size')
+
+        todo = [e for e in queue if e.get('artefact') is None]
+        if not todo:
+            _clean(queue)
+            return
+        folder = queue_dir()
+        folder.mkdir(exist_ok=True)
+        prepared = {}
+        for e in todo:
+            artefact = folder / (secrets.token_hex(8) + '.png')
+            src, mode = variants.source(Path(e['file']), size, cfg.get('switch_mode'))
+            publish.stage(src, artefact, mode)
+            prepared[(e['file'], tuple(e['signature']))] = str(artefact)
+            _warm_preview(Path(e['file']))
+
+        with cfg.transaction() as data:
+            queue = data['background'].get('queue', [])
+            for e in queue:
+                if e.get('artefact') is None and (artefact := prepared.pop((e['file'], tuple(e['signature'])), None)) is not None:
+                    e['artefact'] = artefact
+                    e['size'] = size
+        _clean(queue)
+
+def _clean(queue):
+    # Removes prepared files that no queue entry points to anymore, e.g. after a crash or a concurrent refill
+    folder = queue_dir()
+    keep = {os.path.basename(e['artefact']) for e in queue if e.get('artefact') is not None}
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name not in keep:
+            os.unlink(folder / name)
+
+def _warm_preview(file: Path):
+    import beastwick18_kitty_background_manager.thumbnails as thumbnails
+    try:
+        thumbnails.get(file, cfg.get('preview_size'), cfg.get('preview_fill'))
+    except Exception:
+        pass
+
+def step_back(steps: int = 1) -> Optional[Path]:
+    # Takes entries off the end of the history. Backgrounds that no longer exist are skipped
+    with cfg.transaction() as data:
+        background = data.setdefault('background', {})
+        history = background.get('history', [])
+        target = None
+        while history and steps > 0:
+            candidate = Path(history.pop())
+            if candidate.is_file():
+                target = candidate
+                steps -= 1
+        background['history'] = history
+    return target
@@ -1,30 +1,109 @@
 import os
+import re
+import sys
 import json
-import imghdr
-import shutil
-import random
 from typing import Optional, List
 from enum import Enum
 from pathlib import Path
-from PIL import Image, ImageEnhance, ImageOps, ImageColor
-from pixcat import Image as PixImage
+import click
 import typer
 import beastwick18_kitty_background_manager.config as cfg
 import beastwick18_kitty_background_manager.output as out
 import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.rotation as rotation
+import beastwick18_kitty_background_manager.pipeline as pipeline
+import beastwick18_kitty_background_manager.thumbnails as thumbnails
+import beastwick18_kitty_background_manager.contact_sheet as contact_sheet
+import beastwick18_kitty_background_manager.actions as actions
+import beastwick18_kitty_background_manager.daemon as daemon
+import beastwick18_kitty_background_manager.duplicates as duplicates
+import beastwick18_kitty_background_manager.stats as stats
+import beastwick18_kitty_background_manager.originals as originals
+import beastwick18_kitty_background_manager.profiling as profiling
+import beastwick18_kitty_background_manager.bulk as bulk
+import beastwick18_kitty_background_manager.lookahead as lookahead
+import beastwick18_kitty_background_manager.variants as variants
+import beastwick18_kitty_background_manager.archives as archives
+import beastwick18_kitty_background_manager.fuzzy as fuzzy
+import beastwick18_kitty_background_manager.tags as tags
 
 app = typer.Typer(help='A cli background manager for the Kitty terminal')
 
-cfg.load_config()
-cfg.set_paths()
+def run_action(command: str, **args):
+    # Forward the command to the daemon when it is running, otherwise do the work in this process
+    if (response := daemon.request(command, **args)) is not None:
+        if not response['ok']:
+            raise actions.ActionError(response['error'])
+        return response['result']
+    result = actions.run(command, **args)
+    if actions.refills(command, args) and (ctx := click.get_current_context(silent=True)) is not None:
+        # The next background is prepared once the output is shown, so it never delays the switch
+        ctx.call_on_close(refill_queue)
+    return result
+
+def refill_queue():
+    try:
+        lookahead.refill()
+    except OSError as e:
+        out.error(f'Could not prepare the upcoming backgrounds: {e}')
+
+def window_size(size: Optional[str]):
+    # Detected here and not by the daemon, which has no window of its own
+    if size is None:
+        return variants.detect()
+    if (parsed := variants.parse_size(size)) is None:
+        raise actions.ActionError(f'"{size}" is not a valid window size: The string must be of format "WxH" (example: "1920x1080")')
+    return variants.format_size(parsed)
+
+def print_next(result, silent: bool = False):
+    if silent or result['next'] is None:
+        return
+    n = Path(result['next'])
+    typer.secho('Next:', fg=typer.colors.WHITE, bold=True, underline=True)
+    out.to_link_secho(n.stem, n, fg=typer.colors.BLUE)
 
 @app.command('list', short_help='List all enabled and disabled backgrounds, as well as the next background')
 def cli_list(
     next: Optional[bool] = typer.Option(None, '--next', '-n', help='Show the next background'),
     prev: Optional[bool] = typer.Option(None, '--previous', '-p', help='Show the previous background'),
     enabled: Optional[bool] = typer.Option(None, '--enabled', '-e', help='Show the enabled backgrounds'),
-    disabled: Optional[bool] = typer.Option(None, '--disabled', '-d', help='Show the disabled backgrounds')
+    disabled: Optional[bool] = typer.Option(None, '--disabled', '-d', help='Show the disabled backgrounds'),
+    fmt: str = typer.Option('text', '--format', '-f', help='Print the backgrounds as "text", or as "json", "ndjson" or "tsv" for scripts', autocompletion=lambda: list(out.FORMATS)),
+    sort: str = typer.Option('name', '--sort', help=f'Sort the backgrounds by one of ({", ".join(index.ORDERS)}). "luminance" lists the darkest first', autocompletion=lambda: list(index.ORDERS)),
+    reverse: bool = typer.Option(False, '--reverse', help='Reverse the order of the backgrounds'),
+    match: Optional[List[str]] = typer.Option(None, '--match', '-m', help='Only list backgrounds whose name matches this glob pattern. Can be given more than once'),
+    regex: bool = typer.Option(False, '--regex', '-r', help='Treat the --match patterns as regular expressions that have to match the whole name'),
+    limit: Optional[int] = typer.Option(None, '--limit', help='List at most this many backgrounds'),
+    offset: int = typer.Option(0, '--offset', help='Skip this many backgrounds first'),
+    tag: Optional[List[str]] = typer.Option(None, '--tag', '-t', help='Only list backgrounds with this tag. Can be given more than once', autocompletion=lambda: tags.names()),
+    not_tag: Optional[List[str]] = typer.Option(None, '--not-tag', help='Leave out backgrounds with this tag. Can be given more than once', autocompletion=lambda: tags.names())
 ):
+    if fmt not in out.FORMATS:
+        out.error(f'Unknown format "{fmt}". Valid values are ({", ".join(out.FORMATS)})')
+        return
+    if (limit is not None and limit < 0) or offset < 0:
+        out.error('--limit and --offset must be >= 0')
+        return
+    filters = dict(sort=sort, reverse=reverse, match=match, regex=regex, limit=limit, offset=offset, tag=tag, not_tag=not_tag)
+    
+    if fmt != 'text':
+        # Read straight from the index, so the first entries are written before the last ones are read
+        if enabled is None and disabled is None:
+            enabled = disabled = True
+        try:
+            rows = actions.entries(bool(enabled), bool(disabled), **filters)
+            folders = {index.folder_key(cfg.enabled_path): 'enabled', index.folder_key(cfg.disabled_path): 'disabled'}
+            out.write_entries(rows, fmt, sys.stdout, folders)
+            sys.stdout.flush()
+        except actions.ActionError as e:
+            out.error(str(e))
+        except BrokenPipeError:
+            # The reader went away (e.g. head), which is not an error. Python would complain again
+            # when it flushes stdout on exit, so point it somewhere harmless
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    
     # Show all if use does not specify any category
     if next is None and prev is None and enabled is None and disabled is None:
         next = True
@@ -32,158 +111,201 @@ def cli_list(
         enabled = True
         disabled = True
     
-    if next and (n := cfg.get_next()) is not None:
+    try:
+        result = run_action('list', enabled=bool(enabled), disabled=bool(disabled), **filters)
+    except actions.ActionError as e:
+        out.error(str(e))
+        return
+    
+    if next and (n := result['next']) is not None:
         typer.secho('Next:', fg=typer.colors.WHITE, bold=True, underline=True)
-        out.to_link_secho(n, cfg.next, fg=typer.colors.BLUE)
+        out.to_link_secho(Path(n).stem, n, fg=typer.colors.BLUE)
         typer.echo()
         
     
-    if prev and (p := cfg.get_previous()) is not None:
+    if prev and (p := result['previous']) is not None:
         typer.secho('Previous:', fg=typer.colors.WHITE, bold=True, underline=True)
-        out.to_link_secho(p, cfg.previous, fg=typer.colors.MAGENTA)
+        out.to_link_secho(Path(p).stem, p, fg=typer.colors.MAGENTA)
         typer.echo()
     
+    # Each section is written in one go, echoing every line on its own flushes the terminal each time
     if enabled:
         typer.secho(f'Enabled {out.to_link("(📁)", cfg.enabled_path)}:', fg=typer.colors.WHITE, bold=True, underline=True)
-        for name in tools.get_ext_in_path(cfg.enabled_path, '.png'):
-            out.to_link_secho(name, cfg.enabled_path / (name + '.png'), fg=typer.colors.GREEN)
-        typer.echo()
+        typer.echo(''.join(out.to_link_style(name, cfg.enabled_path / (name + '.png'), fg=typer.colors.GREEN) + '\n' for name in result['enabled']))
     
     if disabled:
         typer.secho(f'Disabled {out.to_link("(📁)", cfg.disabled_path)}:', fg=typer.colors.WHITE, bold=True, underline=True)
-        for name in tools.get_ext_in_path(cfg.disabled_path, '.png'):
-            out.to_link_secho(name, cfg.disabled_path / (name + '.png'), fg=typer.colors.RED)
+        typer.echo(''.join(out.to_link_style(name, cfg.disabled_path / (name + '.png'), fg=typer.colors.RED) + '\n' for name in result['disabled']), nl=False)
 
 @app.command('random', short_help='Set next background to a random enabled background')
 def cli_random(
     silent: bool = typer.Option(False, '--silent', '-s', help='If present, there will be no output to stdout'),
-    disabled: bool = typer.Option(False, '--disabled', '-d', help='Select a random background from the disabled folder')
+    disabled: bool = typer.Option(False, '--disabled', '-d', help='Select a random background from the disabled folder'),
+    shuffle: Optional[bool] = typer.Option(None, '--shuffle/--no-shuffle', help='Go through every background once before repeating any of them. Overrides the random_mode set in the config file'),
+    dark: Optional[bool] = typer.Option(None, '--dark/--light', help='Only pick from the darker/lighter half of the backgrounds'),
+    hue: Optional[str] = typer.Option(None, '--hue', help=f'Only pick backgrounds of this colour. Valid values are ({", ".join(stats.HUES)})', autocompletion=lambda: list(stats.HUES)),
+    tag: Optional[List[str]] = typer.Option(None, '--tag', '-t', help='Only pick backgrounds with this tag. Can be given more than once', autocompletion=lambda: tags.names()),
+    not_tag: Optional[List[str]] = typer.Option(None, '--not-tag', help='Never pick backgrounds with this tag. Can be given more than once', autocompletion=lambda: tags.names()),
+    size: Optional[str] = typer.Option(None, '--size', help='Use the variant of the background that fits a window of this size best (WxH). Detected from the terminal by default')
 ):
-    if disabled:
-        path: Path = cfg.disabled_path
-    else:
-        path: Path = cfg.enabled_path
-    files = list(tools.get_ext_in_path(path, '.png'))
-    if len(files) <= 0:
+    try:
+        print_next(run_action('random', disabled=disabled, shuffle=shuffle, size=window_size(size), dark=dark, hue=hue, tag=tag, not_tag=not_tag), silent)
+    except actions.ActionError as e:
+        out.error(str(e))
+
+@app.command('next', short_help='Advance to the next background in the shuffled rotation of enabled backgrounds')
+def cli_next(
+    silent: bool = typer.Option(False, '--silent', '-s', help='If present, there will be no output to stdout'),
+    size: Optional[str] = typer.Option(None, '--size', help='Use the variant of the background that fits a window of this size best (WxH). Detected from the terminal by default')
+):
+    try:
+        print_next(run_action('next', size=window_size(size)), silent)
+    except actions.ActionError as e:
+        out.error(str(e))
+
+@app.command('prev', short_help='Go back to the background that was set before the current one')
+def cli_prev(
+    steps: int = typer.Argument(1, help='How many backgrounds to go back'),
+    silent: bool = typer.Option(False, '--silent', '-s', help='If present, there will be no output to stdout'),
+    size: Optional[str] = typer.Option(None, '--size', help='Use the variant of the background that fits a window of this size best (WxH). Detected from the terminal by default')
+):
+    if steps < 1:
+        out.error(f'The given number of steps {steps} must be >= 1')
         return
-    bg = random.choice(files)
-    file: Path = path / (bg + '.png')
-    if not file.exists() or file.is_dir():
-        out.error('Could not set a random background')
+    try:
+        print_next(run_action('prev', steps=steps, size=window_size(size)), silent)
+    except actions.ActionError as e:
+        out.error(str(e))
+
+app.command('undo', short_help='Undo the last background switch, the same as prev')(cli_prev)
+
+def not_found(message: str, bg: str, folders):
+    out.error(fuzzy.suggest(message, folders, bg))
+
+def move_backgrounds(src: Path, dest: Path, bgs: Optional[List[str]], regex: bool, everything: bool, action: str, verb: str):
+    if not bgs and not everything:
+        out.error(f'Cannot {action} backgrounds: Give at least one name or use --all')
         return
+    try:
+        selected, unmatched = bulk.select([src], bgs or [], regex, everything)
+    except re.error as e:
+        out.error(f'Cannot {action} backgrounds: Invalid regular expression ({e})')
+        return
+    for pattern in unmatched:
+        if bulk.is_pattern(pattern, regex):
+            out.error(f'Cannot {action} backgrounds: Nothing matches "{pattern}"')
+        else:
+            not_found(f'Cannot {action} background: {pattern}.png does not exist', pattern, [src])
     
-    cfg.set_next(file)
-    
-    shutil.copy(file, cfg.current_path / cfg.CURRENT_FILE)
+    moves, failed = bulk.plan_moves(selected, dest)
+    for file in failed:
+        out.error(f'Unable to {action} {file.name}: Cannot find an unused filename')
+    moved, errors = bulk.apply_moves(moves)
+    for file, err in errors:
+        out.error(f'Unable to {action} {file.name}: {err}')
     
-    if not silent:
-        typer.secho('Next:', fg=typer.colors.WHITE, bold=True, underline=True)
-        out.to_link_secho(cfg.next.stem, cfg.next, fg=typer.colors.BLUE)
-
-@app.command(short_help='Enable a background that is currently disabled')
-def enable(bg: str = typer.Argument(..., help='The name of the background to be enabled', autocompletion=(lambda: tools.get_ext_in_path(cfg.disabled_path, '.png')))):
-    file = cfg.disabled_path / (bg + '.png')
-    if not file.exists():
-        out.error(f'Cannot enable background: {bg}.png does not exist')
-    elif file.is_dir():
-        out.error(f'Cannot enable background: {bg}.png is a directory')
-    else:
-        typer.echo(f'Enabled {bg}.png')
-        out_path = cfg.enabled_path / (bg + '.png')
-        if out_path.exists():
-            new_path = tools.resolve_name_conflict(out_path)
-            if new_path is None:
-                out.error('Unable to add image: Cannot find an unused filename')
-                return
-            out_path = new_path
-        
-        file.rename(out_path)
-
-@app.command(short_help='Disable a background that is currently enabled')
-def disable(bg: str = typer.Argument(..., help='The name of the background to be enabled', autocompletion=(lambda: tools.get_ext_in_path(cfg.enabled_path, '.png')))):
-    file = cfg.enabled_path / (bg + '.png')
-    if not file.exists():
-        out.error(f'Cannot disable background: {bg}.png does not exist')
-    elif file.is_dir():
-        out.error(f'Cannot disable background: {bg}.png is a directory')
-    else:
-        typer.echo(f'Disabled {bg}.png')
-        out_path = cfg.disabled_path / (bg + '.png')
-        if out_path.exists():
-            new_path = tools.resolve_name_conflict(out_path)
-            if new_path is None:
-                out.error('Unable to add image: Cannot find an unused filename')
-                return
-            out_path = new_path
-        
-        file.rename(out_path)
+    for file, new_file in moved:
+        if file.stem == new_file.stem:
+            typer.echo(f'{verb} {file.name}')
+        else:
+            typer.echo(f'{verb} {file.name} as {new_file.name}')
+    if len(selected) > 1:
+        typer.echo(f'{verb} {len(moved)} of {len(selected)} backgrounds')
+
+@app.command(short_help='Enable one or more backgrounds that are currently disabled')
+def enable(
+    bgs: Optional[List[str]] = typer.Argument(None, help='The names or glob patterns of the backgrounds to be enabled', autocompletion=(lambda incomplete: fuzzy.complete([cfg.disabled_path], incomplete))),
+    regex: bool = typer.Option(False, '--regex', '-r', help='Treat the names as regular expressions that have to match the whole name'),
+    everything: bool = typer.Option(False, '--all', help='Enable every disabled background')
+):
+    move_backgrounds(cfg.disabled_path, cfg.enabled_path, bgs, regex, everything, 'enable', 'Enabled')
+
+@app.command(short_help='Disable one or more backgrounds that are currently enabled')
+def disable(
+    bgs: Optional[List[str]] = typer.Argument(None, help='The names or glob patterns of the backgrounds to be disabled', autocompletion=(lambda incomplete: fuzzy.complete([cfg.enabled_path], incomplete))),
+    regex: bool = typer.Option(False, '--regex', '-r', help='Treat the names as regular expressions that have to match the whole name'),
+    everything: bool = typer.Option(False, '--all', help='Disable every enabled background')
+):
+    move_backgrounds(cfg.enabled_path, cfg.disabled_path, bgs, regex, everything, 'disable', 'Disabled')
 
 def set_autocomplete(ctx: typer.Context, incomplete: str):
-    enabled = ctx.params.get('enabled')
-    if enabled is None:
-        e = list(tools.get_ext_in_path(cfg.enabled_path, '.png'))
-        d = list(tools.get_ext_in_path(cfg.disabled_path, '.png'))
-        return e + d
-    elif enabled:
-        return [i for i in tools.get_ext_in_path(cfg.enabled_path, '.png')]
-    return tools.get_ext_in_path(cfg.disabled_path, '.png')
+    return fuzzy.complete(tools.search_folders(ctx.params.get('enabled')), incomplete)
 
 @app.command(short_help='Set next background to a specific background (can be an enabled or disabled background)')
 def set(
-    bg: str = typer.Argument(..., help='The name of the background to be set', autocompletion=set_autocomplete),
+    bg: Optional[str] = typer.Argument(None, help='The name of the background to be set. Can be left out with --collection', autocompletion=set_autocomplete),
     enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Only search through the enabled/disabled path for the background'),
-    silent: bool = typer.Option(False, '--silent', '-s', help='If present, there will be no output to stdout')
+    silent: bool = typer.Option(False, '--silent', '-s', help='If present, there will be no output to stdout'),
+    collection: Optional[str] = typer.Option(None, '--collection', '-c', help='Make this the active collection. Without a background the next one is drawn from it', autocompletion=lambda: tags.names(collection=True)),
+    size: Optional[str] = typer.Option(None, '--size', help='Use the variant of the background that fits a window of this size best (WxH). Detected from the terminal by default')
 ):
-    
-    file = tools.search_enabled_disabled(enabled, bg)
-    
-    if file is None:
-        out.error(f'Could not set background {bg}.png')
-        return
-    
-    cfg.set_next(file)
-    
-    shutil.copy(file, cfg.current_path / cfg.CURRENT_FILE)
-    
-    if not silent:
-        typer.secho('Next:', fg=typer.colors.WHITE, bold=True, underline=True)
-        out.to_link_secho(cfg.next.stem, cfg.next, fg=typer.colors.BLUE)
+    try:
+        print_next(run_action('set', bg=bg, enabled=enabled, size=window_size(size), collection=collection), silent)
+    except actions.ActionError as e:
+        out.error(str(e))
 
-@app.command(short_help='Add an image to the background folder')
+@app.command(short_help='Add one or more images to the background folder')
 def add(
-    path_to_file: str = typer.Argument(..., help='The path to the image to be added to the background folder'),
-    brightness: float = typer.Option(cfg.conf['brightness'].value, '--brightness', '-b', help='Overrides the set value for brightness defined in the config file'),
-    contrast: float = typer.Option(cfg.conf['contrast'].value, '--contrast', '-c', help='Overrides the set value for brightness defined in the config file'),
+    paths: List[str] = typer.Argument(..., help='The images, archives (zip or tar), directories or glob patterns to be added to the background folder'),
+    brightness: Optional[float] = typer.Option(None, '--brightness', '-b', help='Overrides the set value for brightness defined in the config file'),
+    contrast: Optional[float] = typer.Option(None, '--contrast', '-c', help='Overrides the set value for brightness defined in the config file'),
     enabled: bool = typer.Option(True, '--enabled/--disabled', '-e/-d', help='Add the new image to the enabled/disabled folder'),
-    preview: bool = typer.Option(cfg.conf['preview_on_add'].value, help='Overrides the set value for showing preview after adding an image'),
-    size: int = typer.Option(cfg.conf['preview_size'].value, '--size', help='Set the size for the outputted preview (value must be > 0 and <= 4096'),
-    fill: bool = typer.Option(cfg.conf['preview_fill'].value, help='Fill the screen with the image'),
-    align: str = typer.Option(cfg.conf['preview_align'].value, '--align', '-a', help='Choose how to align the preview image. Valid values are ("left", "center", "right")'),
-    crop_size: str = typer.Option(cfg.conf['crop_size'].value, '--crop-size', help='Determines the size of the cropped image. Should be in the format "WxH"'),
-    scale_type: str = typer.Option(cfg.conf['scale_type'].value, '--scale-type', help='Determines how the image should be positioned once resized'),
-    out_opt: Optional[str] = typer.Option(None, '--out', '-o', help='Set the output filename'),
+    preview: Optional[bool] = typer.Option(None, '--preview/--no-preview', help='Overrides the set value for showing preview after adding an image'),
+    size: Optional[int] = typer.Option(None, '--size', help='Set the size for the outputted preview (value must be > 0 and <= 4096'),
+    fill: Optional[bool] = typer.Option(None, '--fill/--no-fill', help='Fill the screen with the image'),
+    align: Optional[str] = typer.Option(None, '--align', '-a', help='Choose how to align the preview image. Valid values are ("left", "center", "right")'),
+    crop_size: Optional[str] = typer.Option(None, '--crop-size', help='Determines the size of the cropped image. Should be in the format "WxH"'),
+    scale_type: Optional[str] = typer.Option(None, '--scale-type', help='Determines how the image should be positioned once resized'),
+    out_opt: Optional[str] = typer.Option(None, '--out', '-o', help='Set the output filename (only valid when adding a single image)'),
     force: bool = typer.Option(False, '--force', '-f', help='Overwrite any existing file that has the same name'),
-    background_color: str = typer.Option(cfg.conf['background_color'].value, '--background-color', '-b', help='Overrides the configured color to fill the background with')
+    background_color: Optional[str] = typer.Option(None, '--background-color', '-b', help='Overrides the configured color to fill the background with'),
+    jobs: int = typer.Option(os.cpu_count() or 1, '--jobs', '-j', help='The number of worker processes used to process the images'),
+    on_duplicate: Optional[str] = typer.Option(None, '--duplicates', help='What to do with images that look like a background that already exists. Valid values are ("warn", "skip", "allow")'),
+    auto_brightness: Optional[bool] = typer.Option(None, '--auto-brightness/--no-auto-brightness', help='Darken every image to target_luminance instead of applying the same brightness to all of them')
 ):
+    # A brightness given on the command line wins over the automatic one from the config file
+    if auto_brightness is None and brightness is not None:
+        auto_brightness = False
+    auto_brightness = cfg.get('auto_brightness', auto_brightness)
+    brightness = cfg.get('brightness', brightness)
+    contrast = cfg.get('contrast', contrast)
+    preview = cfg.get('preview_on_add', preview)
+    size = cfg.get('preview_size', size)
+    fill = cfg.get('preview_fill', fill)
+    align = cfg.get('preview_align', align)
+    crop_size = cfg.get('crop_size', crop_size)
+    scale_type = cfg.get('scale_type', scale_type)
+    background_color = cfg.get('background_color', background_color)
+    on_duplicate = cfg.get('on_duplicate', on_duplicate)
+    
     if not cfg.conf['preview_align'].validate(align):
         out.error(f'{align} is not a valid value for align option. Valid values are ("left", "center", "right")')
         return
     if not fill and (size <= 0 or size > 4096):
         out.error(f'The given value of {size} is outside the range of 0<n<=4096')
         return
-        
-    file = Path(path_to_file)
-    if not file.exists():
-        out.error(f'Could not add {path_to_file}: The file does not exist')
+    if not cfg.conf['scale_type'].validate(scale_type):
+        return
+    if jobs <= 0:
+        out.error(f'The given value of {jobs} for --jobs must be > 0')
+        return
+    if not cfg.conf['on_duplicate'].validate(on_duplicate):
         return
-    if file.stem == '':
-        out.error(f'Could not add {path_to_file}: {file.stem} is not a valid filename')
+    
+    crop_props = crop_size.strip().split('x')
+    if len(crop_props) != 2:
+        out.error(f'crop_size\'s value of "{crop_size}" is incorrect. Should be in the format "WxH"')
         return
-    if imghdr.what(path_to_file) is None:
-        out.error(f'Could not add {path_to_file}: The file is not an image')
+    crop_w, crop_h = (int(crop_props[0]), int(crop_props[1]))
+    
+    files = list(tools.expand_paths(paths))
+    if len(files) == 0:
+        out.error('Could not add images: No files matched the given paths')
         return
-    if file.is_dir():
-        out.error(f'Could not add {path_to_file}: The given path points to a directory')
+    # Archives are read member by member, only the images in them are added
+    packs = {file for file in files if file.is_file() and not tools.is_image(file) and archives.is_archive(file)}
+    if out_opt is not None and (len(files) > 1 or len(packs) > 0):
+        out.error('Could not add images: --out can only be used when adding a single image')
         return
     
     if enabled:
@@ -193,98 +315,217 @@ def add(
         col = typer.colors.RED
         path = cfg.disabled_path
     
-    if out_opt is None:
-        out_path = path / file.with_suffix('.png').name
-    else:
-        out_path = path / file.with_stem(out_opt).with_suffix('.png').name
-    
-    if not force and out_path.exists():
-        new_path = tools.resolve_name_conflict(out_path)
-        if new_path is None:
-            out.error('Unable to add image: Cannot find an unused filename')
-            return
-        
-        can_rename = typer.confirm(f'"{out_path.stem}" already exists. Rename "{out_path.stem}" to "{new_path.stem}" instead?')
-        if not can_rename:
-            return
-        out_path = new_path
+    total = 0
+    def sources():
+        # Yields (label, src, name), src being a path or the content of an archive member
+        nonlocal total
+        for file in files:
+            if file in packs:
+                try:
+                    for member, data in archives.members(file):
+                        total += 1
+                        if tools.image_stem(Path(member).name) == '':
+                            out.error(f'Could not add {file}:{member}: "{Path(member).name}" is not a valid filename')
+                            continue
+                        yield f'{file}:{member}', data, Path(member).name
+                except archives.ArchiveError as e:
+                    out.error(f'Could not read {file}: {e}')
+                continue
+            
+            total += 1
+            if not file.exists():
+                out.error(f'Could not add {file}: The file does not exist')
+                continue
+            if tools.image_stem(file.name) == '':
+                out.error(f'Could not add {file}: "{file.name}" is not a valid filename')
+                continue
+            if file.is_dir():
+                out.error(f'Could not add {file}: The given path points to a directory')
+                continue
+            if not tools.is_image(file):
+                out.error(f'Could not add {file}: The file is not an image')
+                continue
+            yield str(file), str(file), file.name
     
-    img = Image.open(path_to_file)
+    def targets():
+        # Output names are decided in the order of the sources, so the results do not depend on which worker finishes first
+        taken = {}
+        for label, src, name in sources():
+            if out_opt is None:
+                out_path = path / (tools.image_stem(name) + '.png')
+            else:
+                out_path = path / Path(name).with_stem(out_opt).with_suffix('.png').name
+            
+            if out_path.name in taken or (not force and out_path.exists()):
+                new_path = tools.resolve_name_conflict(out_path, taken)
+                if new_path is None:
+                    out.error(f'Unable to add {label}: Cannot find an unused filename')
+                    continue
+                
+                if out_path.name in taken:
+                    typer.echo(f'"{out_path.stem}" is already used by {taken[out_path.name]}, adding {label} as "{new_path.stem}"')
+                elif not typer.confirm(f'"{out_path.stem}" already exists. Rename "{out_path.stem}" to "{new_path.stem}" instead?'):
+                    continue
+                out_path = new_path
+            
+            taken[out_path.name] = label
+            # The new file only replaces out_path once it is known not to be a skipped duplicate
+            staged = out_path.with_name(f'.{out_path.name}.{os.getpid()}.tmp')
+            yield (label, out_path, staged), (src, str(out_path.resolve()), settings, name, str(staged))
     
-    crop_props = crop_size.strip().split('x')
-    if len(crop_props) != 2:
-        out.error(f'crop_size\'s value of "{crop_size}" is incorrect. Should be in the format "WxH"')
-        return
-    crop_w, crop_h = (int(crop_props[0]), int(crop_props[1]))
-    img = tools.scale_image(img, scale_type, crop_w, crop_h, background_color)
+    settings = pipeline.Settings(scale_type, crop_w, crop_h, background_color, contrast, brightness, stats=True, profile=profiling.enabled)
+    if cfg.get('keep_originals'):
+        settings.originals = str(originals.store_dir())
+    if auto_brightness:
+        settings.target_luminance = cfg.get('target_luminance')
+    if thumbnails.budget() > 0:
+        settings.thumbnail = (thumbnails.target_size(size, fill), fill)
+    if on_duplicate != 'allow':
+        settings.hashes = True
+        limit = cfg.get('duplicate_distance')
+        tree, exact = duplicates.library([cfg.enabled_path, cfg.disabled_path], jobs)
     
-    if contrast != 1:
-        img = tools.set_contrast(img, contrast)
-    if brightness != 1:
-        img = tools.set_brightness(img, brightness)
+    if len(packs) == 0:
+        jobs = min(jobs, len(files))
+    results = pipeline.run_all(pipeline.process_image, targets(), jobs)
     
-    img.save(str(out_path.resolve()))
+    added = 0
+    try:
+        for (file, out_path, staged), (result, err) in results:
+            if err is not None:
+                staged.unlink(missing_ok=True)
+                out.error(f'Could not add {file}: {err}')
+                continue
+            profiling.merge(result.spans)
+            if settings.hashes and (match := duplicates.find(tree, exact, result.source, result.phash, limit)) is not None:
+                other, distance = match
+                what = f'a copy of "{other.stem}"' if distance is None else f'similar to "{other.stem}" ({distance} bits apart)'
+                if on_duplicate == 'skip':
+                    staged.unlink()
+                    # The source was already kept while it was processed
+                    if result.original is not None:
+                        originals.prune({result.original})
+                    typer.echo(f'Skipped {file}: It is {what}')
+                    continue
+                out.error(f'Warning: {file} is {what}')
+            # The original of a background that is overwritten with --force may not be needed anymore
+            replaced = originals.used_by([out_path])
+            os.replace(staged, out_path)
+            added += 1
+            index.add_file(out_path)
+            if settings.hashes:
+                duplicates.record(out_path, result.sha256, result.source, result.phash)
+                # Images later in the same batch are compared against this one as well
+                tree.add(result.phash, out_path)
+                exact.setdefault(result.source, out_path)
+            stats.record(out_path, result.stats)
+            originals.record(out_path, result.original, result.params, result.sha256)
+            originals.prune(replaced - {result.original})
+            typer.echo(f'Added {out.to_link_style(out_path.name, out_path, fg=col)}')
+            if preview:
+                tools.preview_image(out_path, size, fill, align)
+    finally:
+        results.close()
+        thumbnails.evict()
     
-    typer.echo(f'Added {out.to_link_style(out_path.name, out_path, fg=col)}')
-    if preview:
-        tools.preview_image(out_path, size, fill, align)
+    if total > 1:
+        typer.echo(f'Added {added} of {total} images')
+
+def select_backgrounds(bgs: List[str], enabled: Optional[bool], regex: bool, everything: bool = False):
+    try:
+        selected, unmatched = bulk.select(tools.search_folders(enabled), bgs, regex, everything)
+    except re.error as e:
+        out.error(f'Invalid regular expression ({e})')
+        return []
+    for pattern in unmatched:
+        if bulk.is_pattern(pattern, regex):
+            out.error(f'Unable to find a background matching "{pattern}"')
+        else:
+            not_found(f'Unable to find background "{pattern}.png"', pattern, tools.search_folders(enabled))
+    return selected
 
 @app.command(short_help='Looks for the first occurence of a background in the disabled and enabled folder in that order and deletes it.')
 def delete(
-        bg: str = typer.Argument(..., help='The name of the background to be deleted from either the enabled or disabled folder', autocompletion=set_autocomplete),
+        bgs: Optional[List[str]] = typer.Argument(None, help='The names or glob patterns of the backgrounds to be deleted from either the enabled or disabled folder', autocompletion=set_autocomplete),
         enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Search for the background in the enabled/disabled folder'),
-        force: bool = typer.Option(False, '--force', '-f', help='Force the file to be deleted without asking for confimation')
+        force: bool = typer.Option(False, '--force', '-f', help='Force the file to be deleted without asking for confimation'),
+        regex: bool = typer.Option(False, '--regex', '-r', help='Treat the names as regular expressions that have to match the whole name'),
+        everything: bool = typer.Option(False, '--all', help='Delete every background in the searched folders')
         ):
-    if (file := tools.search_enabled_disabled(enabled, bg)) is not None:
-        if not force:
+    if not bgs and not everything:
+        out.error('Cannot delete backgrounds: Give at least one name or use --all')
+        return
+    if len(selected := select_backgrounds(bgs or [], enabled, regex, everything)) == 0:
+        return
+    files = [folder / (name + '.png') for folder, name, _ in selected]
+    
+    if not force:
+        if len(files) == 1:
+            file = files[0]
             if file.parent.resolve() == cfg.enabled_path.resolve():
                 col = typer.colors.GREEN
                 path_name = 'enabled'
             else:
                 col = typer.colors.RED
                 path_name = 'disabled'
-            can_delete = typer.confirm(f'Are you sure you want to delete {out.to_link_style(bg, file, fg=col)} from the {path_name} folder')
-            if not can_delete:
-                return
-        file.unlink()
+            can_delete = typer.confirm(f'Are you sure you want to delete {out.to_link_style(file.stem, file, fg=col)} from the {path_name} folder')
+        else:
+            can_delete = typer.confirm(f'Are you sure you want to delete {len(files)} backgrounds')
+        if not can_delete:
+            return
+    
+    deleted, errors = bulk.delete(files)
+    for file, err in errors:
+        out.error(f'Unable to delete "{file.name}": {err}')
+    for file in deleted:
         typer.secho(f'Deleted "{file.name}"')
-    else:
-        out.error(f'Unable to find background "{bg}.png"')
+    if len(files) > 1:
+        typer.echo(f'Deleted {len(deleted)} of {len(files)} backgrounds')
 
 @app.command(short_help='Rename a background in the enabled/disabled folder to a new name')
 def rename(
-        bg: str = typer.Argument(..., help='The name of the background to be renamed from either the enabled or disabled folder', autocompletion=set_autocomplete),
-        new_name: str = typer.Argument(..., help='The new name of the background', autocompletion=set_autocomplete),
+        bg: str = typer.Argument(..., help='The name of the background to be renamed from either the enabled or disabled folder. Glob patterns rename every match', autocompletion=set_autocomplete),
+        new_name: str = typer.Argument(..., help='The new name of the background. When renaming several backgrounds, {name} is replaced by the old name and {n} by a counter, with --regex groups can be used as \\1', autocompletion=set_autocomplete),
         enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Search for the background in the enabled/disabled folder'),
         force: bool = typer.Option(False, '--force', '-f', help='Force the file to be renamed (without naming conflicts) without asking for confimation'),
-        overwrite: bool = typer.Option(False, '--overwrite', '-o', help='In the case that the renamed file already exists, it will be overwritten')
+        overwrite: bool = typer.Option(False, '--overwrite', '-o', help='In the case that the renamed file already exists, it will be overwritten'),
+        regex: bool = typer.Option(False, '--regex', '-r', help='Treat the name as a regular expression that has to match the whole name')
         ):
-    if (file := tools.search_enabled_disabled(enabled, bg)) is not None:
-        new_file = file.with_stem(new_name)
-        if not overwrite and new_file.exists():
-            new_file = tools.resolve_name_conflict(new_file)
-            if not force:
-                if new_file is None:
-                    out.error(f'Unable to rename {bg} to {new_name}')
-                    return
-                
-                can_rename = typer.confirm(f'"{new_name}" already exists. Rename "{bg}" to "{new_file.stem}" instead?')
-                if not can_rename:
-                    return
-            
-        file.replace(new_file)
-        typer.secho(f'Renamed "{bg}" to "{new_file.stem}"')
-    else:
-        out.error(f'Unable to find background "{bg}.png"')
+    if len(selected := select_backgrounds([bg], enabled, regex)) == 0:
+        return
+    
+    moves, suffixed, failed = bulk.plan_renames(selected, new_name, regex, overwrite)
+    for file in failed:
+        out.error(f'Unable to rename {file.stem}: Cannot find an unused filename or the new name is not valid')
+    if suffixed and not force:
+        if len(selected) == 1:
+            _, wanted, given = suffixed[0]
+            can_rename = typer.confirm(f'"{wanted}" already exists. Rename "{bg}" to "{given}" instead?')
+        else:
+            can_rename = typer.confirm(f'{len(suffixed)} of the new names are already taken. Add a number to the end of them instead?')
+        if not can_rename:
+            return
+    
+    renamed, errors = bulk.apply_moves(moves)
+    for file, err in errors:
+        out.error(f'Unable to rename {file.stem}: {err}')
+    for file, new_file in renamed:
+        typer.secho(f'Renamed "{file.stem}" to "{new_file.stem}"')
+    if len(selected) > 1:
+        typer.echo(f'Renamed {len(renamed)} of {len(selected)} backgrounds')
 
 @app.command(short_help='Looks for the first occurence of a background in the disabled and enabled folder in that order and shows a preview')
 def preview(
         bg: str = typer.Argument(..., help='The name of the background to be deleted from either the enabled or disabled folder', autocompletion=set_autocomplete),
         enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Search for the background in the enabled folder'),
-        size: int = typer.Option(cfg.conf['preview_size'].value, '--size', '-s', help='Set the size for the outputted preview (value must be > 0 and <= 4096'),
-        fill: bool = typer.Option(cfg.conf['preview_fill'].value, '--fill/--thumbnail', '-f', help='Show the image as a thumbnail or fill the screen'),
-        align: str = typer.Option(cfg.conf['preview_align'].value, '--align', '-a', help='Choose how to align the preview image. Valid values are ("left", "center", "right")')
+        size: Optional[int] = typer.Option(None, '--size', '-s', help='Set the size for the outputted preview (value must be > 0 and <= 4096'),
+        fill: Optional[bool] = typer.Option(None, '--fill/--thumbnail', '-f', help='Show the image as a thumbnail or fill the screen'),
+        align: Optional[str] = typer.Option(None, '--align', '-a', help='Choose how to align the preview image. Valid values are ("left", "center", "right")')
         ):
+    size = cfg.get('preview_size', size)
+    fill = cfg.get('preview_fill', fill)
+    align = cfg.get('preview_align', align)
+    
     if not fill and (size <= 0 or size > 4096):
         out.error(f'The given value of {size} is outside the range of 0<n<=4096')
         return
@@ -292,18 +533,51 @@ def preview(
         out.error(f'{align} is not a valid value for align option. Valid values are ("left", "center", "right")')
         return
     
-    if (file := tools.search_enabled_disabled(enabled, bg)) is not None:
+    # Like set, a name that does not exist is taken as the start of the name of a background, if only one starts with it
+    if (file := tools.search_enabled_disabled(enabled, bg)) is not None or (file := fuzzy.resolve(tools.search_folders(enabled), bg)) is not None:
         typer.echo(f'Previewing {out.to_link_style(file.name, file, fg=typer.colors.BLUE)}:')
         tools.preview_image(file, size, fill, align)
     else:
-        out.error(f'Unable to find background "{bg}.png"')
+        not_found(f'Unable to find background "{bg}.png"', bg, tools.search_folders(enabled))
+
+@app.command(short_help='Show a grid of thumbnails of the enabled and disabled backgrounds')
+def gallery(
+        enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Only show the enabled/disabled backgrounds'),
+        page: int = typer.Option(1, '--page', '-p', help='The page to show when the backgrounds do not fit on one screen'),
+        tile: int = typer.Option(192, '--tile', '-t', help='The size of each thumbnail in pixels (value must be > 0 and <= 4096)'),
+        jobs: int = typer.Option(os.cpu_count() or 1, '--jobs', '-j', help='The number of threads used to create missing thumbnails')
+        ):
+    if tile <= 0 or tile > 4096:
+        out.error(f'The given value of {tile} is outside the range of 0<n<=4096')
+        return
+    
+    folders = []
+    if enabled is None or enabled:
+        folders.append((cfg.enabled_path, (80, 200, 120)))
+    if enabled is None or not enabled:
+        folders.append((cfg.disabled_path, (220, 90, 90)))
+    entries = [(path / (name + '.png'), color) for path, color in folders for name in index.names(path)]
+    if len(entries) == 0:
+        out.error('There are no backgrounds to show')
+        return
+    
+    columns, _, per_page, pages = contact_sheet.layout(tile, len(entries))
+    if page <= 0 or page > pages:
+        out.error(f'Page {page} does not exist, there are {pages} pages')
+        return
+    
+    sheet = contact_sheet.build(entries[(page - 1) * per_page:page * per_page], tile, columns, jobs)
+    typer.secho(f'Page {page}/{pages} ({len(entries)} backgrounds)', fg=typer.colors.WHITE, bold=True)
+    tools.show_image(sheet, 'left')
+    if page < pages:
+        typer.echo(f'Run with --page {page + 1} to see the next page')
 
 def value_completion(ctx: typer.Context):
     property = ctx.params.get('property')
     if property is None or property not in cfg.conf:
         return ['']
     
-    val = cfg.conf[property].value
+    val = cfg.get(property)
     if type(val) == type(True):
         return ['False', 'True']
     else:
@@ -318,6 +592,7 @@ def config(
         out.error(f'Unknown property: "{property}"')
         return
     
+    cfg.ensure_loaded()
     if value is None:
         typer.echo(f'{property} = {cfg.conf[property].value}')
         return
@@ -330,11 +605,305 @@ def config(
         if not cfg.conf[property].validate(new_value):
             out.error(f'Cannot set property "{property}" to value "{value}": The given value is not valid')
             return
-        cfg.conf[property].value = new_value
-        cfg.save_config()
+        cfg.update_property(property, new_value)
         typer.echo(f'Set "{property}" to "{new_value}"')
 
 
+@app.command(short_help='Show or set how likely a background is to be picked early in a shuffled rotation')
+def weight(
+    bg: str = typer.Argument(..., help='The name of the background', autocompletion=set_autocomplete),
+    value: Optional[float] = typer.Argument(None, help='The new weight. Backgrounds start with a weight of 1, a weight of 0 leaves the background out of the shuffle'),
+    enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Search for the background in the enabled/disabled folder')
+):
+    if (file := tools.search_enabled_disabled(enabled, bg)) is None:
+        not_found(f'Unable to find background "{bg}.png"', bg, tools.search_folders(enabled))
+        return
+    
+    if value is None:
+        typer.echo(f'{bg} = {rotation.get_weight(file.parent, bg)}')
+        return
+    if value < 0:
+        out.error(f'The given weight of {value} must be >= 0')
+        return
+    
+    rotation.set_weight(file.parent, bg, value)
+    typer.echo(f'Set the weight of "{bg}" to {value}')
+
+tag_app = typer.Typer(help='Group backgrounds by tags, which random and list can filter by')
+app.add_typer(tag_app, name='tag', short_help='Add, remove and list the tags of backgrounds')
+collection_app = typer.Typer(help='Named sets of backgrounds. While a collection is active, random and next only pick from it')
+app.add_typer(collection_app, name='collection', short_help='Create collections of backgrounds and switch between them')
+
+def valid_tag(name: str):
+    if name.strip() == '' or name != name.strip():
+        out.error(f'"{name}" is not a valid name, it must not be empty or start or end with spaces')
+        return False
+    return True
+
+def change_members(name: str, bgs: Optional[List[str]], enabled: Optional[bool], regex: bool, everything: bool, collection: bool, adding: bool):
+    if not valid_tag(name):
+        return
+    if not bgs and not everything:
+        out.error('Give at least one name or use --all')
+        return
+    if len(selected := select_backgrounds(bgs or [], enabled, regex, everything)) == 0:
+        return
+    backgrounds = [(folder, bg) for folder, bg, _ in selected]
+    what = 'collection' if collection else 'tag'
+    if adding:
+        n = tags.add(name, backgrounds, collection)
+        typer.echo(f'Added {n} backgrounds to {what} "{name}"' + (f', {len(backgrounds) - n} were in it already' if n < len(backgrounds) else ''))
+    else:
+        if collection and tags.active() == name:
+            lookahead.flush()
+        n = tags.remove(name, backgrounds, collection)
+        typer.echo(f'Removed {n} backgrounds from {what} "{name}"')
+
+def print_counts(collection: bool):
+    rows = tags.counts([cfg.enabled_path, cfg.disabled_path], collection)
+    if len(rows) == 0:
+        typer.echo(f'There are no {"collections" if collection else "tags"} yet')
+    for name, count, active in rows:
+        typer.secho(f'{"* " if active else ""}{name} ({count})', fg=typer.colors.GREEN if active else None)
+
+@tag_app.command('add', short_help='Tag one or more backgrounds')
+def tag_add(
+    tag: str = typer.Argument(..., help='The tag, it is created if it does not exist yet', autocompletion=lambda: tags.names()),
+    bgs: Optional[List[str]] = typer.Argument(None, help='The names or glob patterns of the backgrounds', autocompletion=set_autocomplete),
+    enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Only search through the enabled/disabled folder'),
+    regex: bool = typer.Option(False, '--regex', '-r', help='Treat the names as regular expressions that have to match the whole name'),
+    everything: bool = typer.Option(False, '--all', help='Tag every background in the searched folders')
+):
+    change_members(tag, bgs, enabled, regex, everything, False, True)
+
+@tag_app.command('remove', short_help='Take a tag off one or more backgrounds')
+def tag_remove(
+    tag: str = typer.Argument(..., help='The tag', autocompletion=lambda: tags.names()),
+    bgs: Optional[List[str]] = typer.Argument(None, help='The names or glob patterns of the backgrounds', autocompletion=set_autocomplete),
+    enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Only search through the enabled/disabled folder'),
+    regex: bool = typer.Option(False, '--regex', '-r', help='Treat the names as regular expressions that have to match the whole name'),
+    everything: bool = typer.Option(False, '--all', help='Take the tag off every background in the searched folders')
+):
+    change_members(tag, bgs, enabled, regex, everything, False, False)
+
+@tag_app.command('list', short_help='List every tag and how many backgrounds have it, or the tags of one background')
+def tag_list(
+    bg: Optional[str] = typer.Argument(None, help='Only list the tags and collections of this background', autocompletion=set_autocomplete),
+    enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Search for the background in the enabled/disabled folder')
+):
+    if bg is None:
+        print_counts(False)
+        return
+    if (file := tools.search_enabled_disabled(enabled, bg)) is None:
+        not_found(f'Unable to find background "{bg}.png"', bg, tools.search_folders(enabled))
+        return
+    typer.echo(f'Tags: {", ".join(tags.of(file)) or "none"}')
+    typer.echo(f'Collections: {", ".join(tags.of(file, collection=True)) or "none"}')
+
+@tag_app.command('delete', short_help='Delete a tag from every background')
+def tag_delete(tag: str = typer.Argument(..., help='The tag', autocompletion=lambda: tags.names())):
+    if not tags.delete(tag):
+        out.error(f'There is no tag called "{tag}"')
+        return
+    typer.echo(f'Deleted tag "{tag}"')
+
+@collection_app.command('add', short_help='Add one or more backgrounds to a collection')
+def collection_add(
+    collection: str = typer.Argument(..., help='The collection, it is created if it does not exist yet', autocompletion=lambda: tags.names(collection=True)),
+    bgs: Optional[List[str]] = typer.Argument(None, help='The names or glob patterns of the backgrounds', autocompletion=set_autocomplete),
+    enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Only search through the enabled/disabled folder'),
+    regex: bool = typer.Option(False, '--regex', '-r', help='Treat the names as regular expressions that have to match the whole name'),
+    everything: bool = typer.Option(False, '--all', help='Add every background in the searched folders')
+):
+    change_members(collection, bgs, enabled, regex, everything, True, True)
+
+@collection_app.command('remove', short_help='Remove one or more backgrounds from a collection')
+def collection_remove(
+    collection: str = typer.Argument(..., help='The collection', autocompletion=lambda: tags.names(collection=True)),
+    bgs: Optional[List[str]] = typer.Argument(None, help='The names or glob patterns of the backgrounds', autocompletion=set_autocomplete),
+    enabled: Optional[bool] = typer.Option(None, '--enabled/--disabled', '-e/-d', help='Only search through the enabled/disabled folder'),
+    regex: bool = typer.Option(False, '--regex', '-r', help='Treat the names as regular expressions that have to match the whole name'),
+    everything: bool = typer.Option(False, '--all', help='Remove every background in the searched folders')
+):
+    change_members(collection, bgs, enabled, regex, everything, True, False)
+
+@collection_app.command('list', short_help='List every collection and how many backgrounds are in it, the active one is marked with *')
+def collection_list():
+    print_counts(True)
+
+@collection_app.command('use', short_help='Switch to another collection, or back to every enabled background')
+def collection_use(collection: Optional[str] = typer.Argument(None, help='The collection. Leave it out to stop using collections', autocompletion=lambda: tags.names(collection=True))):
+    try:
+        actions.use_collection(collection)
+    except actions.ActionError as e:
+        out.error(str(e))
+        return
+    click.get_current_context().call_on_close(refill_queue)
+    typer.echo('Using every enabled background' if collection is None else f'Using collection "{collection}"')
+
+@collection_app.command('delete', short_help='Delete a collection, the backgrounds in it are kept')
+def collection_delete(collection: str = typer.Argument(..., help='The collection', autocompletion=lambda: tags.names(collection=True))):
+    if tags.active() == collection:
+        lookahead.flush()
+    if not tags.delete(collection, collection=True):
+        out.error(f'There is no collection called "{collection}"')
+        return
+    typer.echo(f'Deleted collection "{collection}"')
+
+@app.command('daemon', short_help='Run a background process that serves set, random, list, next and prev and can rotate backgrounds on a timer')
+def cli_daemon(
+    interval: Optional[float] = typer.Option(None, '--interval', '-i', help='Advance to the next background every INTERVAL seconds'),
+    stop: bool = typer.Option(False, '--stop', help='Stop the running daemon')
+):
+    if stop:
+        if daemon.request('stop') is None:
+            out.error('The daemon is not running')
+        return
+    if interval is not None and interval <= 0:
+        out.error(f'The given interval of {interval} must be > 0')
+        return
+    
+    if (pid := daemon.serve(interval)) is not None:
+        out.error(f'The daemon is already running (pid {pid})')
+
+@app.command(short_help='Find groups of backgrounds that look the same across the enabled and disabled folders')
+def dedupe(
+    distance: Optional[int] = typer.Option(None, '--distance', help='The number of bits two perceptual hashes may differ in to count as duplicates (0-64)'),
+    jobs: int = typer.Option(os.cpu_count() or 1, '--jobs', '-j', help='The number of worker processes used to hash backgrounds that were not hashed yet')
+):
+    distance = cfg.get('duplicate_distance', distance)
+    if not cfg.conf['duplicate_distance'].validate(distance):
+        return
+    if jobs <= 0:
+        out.error(f'The given value of {jobs} for --jobs must be > 0')
+        return
+    
+    groups = duplicates.clusters([cfg.enabled_path, cfg.disabled_path], distance, jobs)
+    if len(groups) == 0:
+        typer.echo('No duplicates found')
+        return
+    
+    disabled = index.folder_key(cfg.disabled_path)
+    for n, group in enumerate(groups, 1):
+        typer.secho(f'Group {n}:', fg=typer.colors.WHITE, bold=True, underline=True)
+        for file in group:
+            out.to_link_secho(file.stem, file, fg=typer.colors.RED if str(file.parent) == disabled else typer.colors.GREEN)
+        typer.echo()
+    typer.echo(f'Found {sum(len(g) for g in groups)} backgrounds in {len(groups)} groups of duplicates')
+
+@app.command(short_help='Watch the inbox and the background folders and process new images as they arrive')
+def watch(
+    jobs: int = typer.Option(os.cpu_count() or 1, '--jobs', '-j', help='The number of worker processes used to process the images'),
+    debounce: float = typer.Option(0.5, '--debounce', help='Seconds a file has to stay unchanged before it is processed')
+):
+    if jobs <= 0:
+        out.error(f'The given value of {jobs} for --jobs must be > 0')
+        return
+    if debounce < 0:
+        out.error(f'The given value of {debounce} for --debounce must be >= 0')
+        return
+    
+    import beastwick18_kitty_background_manager.watch as watcher
+    try:
+        w = watcher.Watcher(cfg.inbox_path, [cfg.enabled_path, cfg.disabled_path], jobs, debounce, typer.echo)
+    except OSError as e:
+        out.error(f'Unable to watch the background folders: {e}')
+        return
+    
+    typer.echo(f'Watching {out.to_link_style(str(cfg.inbox_path), cfg.inbox_path, fg=typer.colors.BLUE)} (press Ctrl+C to stop)')
+    try:
+        w.start()
+        while True:
+            w.poll()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        w.close()
+
+@app.command(short_help='Make the backgrounds again from their originals where the processing settings in the config file changed')
+def reprocess(
+    jobs: int = typer.Option(os.cpu_count() or 1, '--jobs', '-j', help='The number of worker processes used to process the images'),
+    force: bool = typer.Option(False, '--force', '-f', help='Also make the backgrounds again that already match the current settings'),
+    dry_run: bool = typer.Option(False, '--dry-run', '-n', help='Only show which backgrounds would be made again')
+):
+    if jobs <= 0:
+        out.error(f'The given value of {jobs} for --jobs must be > 0')
+        return
+    folders = [cfg.enabled_path, cfg.disabled_path]
+    # Previews of the old files are made again when they are needed, nothing is written for them here
+    settings = pipeline.configured(hashes=True, profile=profiling.enabled)
+    settings.thumbnail = None
+    settings.originals = None
+    params = pipeline.fingerprint(settings)
+    originals.relink(folders)
+    todo, missing = originals.outdated(folders, params, force)
+    if missing > 0:
+        typer.echo(f'{missing} backgrounds were added without keeping the original and are left as they are')
+    if len(todo) == 0:
+        typer.echo('Every background matches the current settings')
+        return
+    if dry_run:
+        for file, _ in todo:
+            out.to_link_secho(file.stem, file)
+        typer.echo(f'{len(todo)} backgrounds would be made again')
+        return
+    
+    originals.clean_temporary(folders)
+    args = [(original, str(file), settings) for file, original in todo]
+    jobs = min(jobs, len(todo))
+    if jobs == 1:
+        results = (pipeline.run_job(pipeline.reprocess_image, *a) for a in args)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        futures = [executor.submit(pipeline.run_job, pipeline.reprocess_image, *a) for a in args]
+        results = (f.result() for f in futures)
+    
+    # Every background is recorded as soon as it is done, so running the command again after an
+    # interruption only picks up the ones that are left
+    done = 0
+    rewritten = []
+    try:
+        for n, ((file, original), (result, err)) in enumerate(zip(todo, results), 1):
+            if err is not None:
+                out.error(f'[{n}/{len(todo)}] Could not process {file.stem}: {err}')
+                continue
+            profiling.merge(result.spans)
+            with index.transaction():
+                index.add_file(file)
+                duplicates.record(file, result.sha256, result.source, result.phash)
+                stats.record(file, result.stats)
+                originals.record(file, None, result.params, result.sha256)
+            done += 1
+            rewritten.append(original)
+            typer.echo(f'[{n}/{len(todo)}] {out.to_link_style(file.stem, file)}')
+    except KeyboardInterrupt:
+        out.error(f'Interrupted after {done} of {len(todo)} backgrounds, run reprocess again to continue')
+        raise typer.Exit(130)
+    finally:
+        if jobs > 1:
+            executor.shutdown(cancel_futures=True)
+        originals.clean_temporary(folders)
+    
+    # Only the originals of this run are looked at, the store can hold files that a concurrent add
+    # kept but has not recorded yet. A background that was deleted in the meantime leaves its original here
+    originals.prune(rewritten)
+    typer.echo(f'Made {done} of {len(todo)} backgrounds again')
+
+@app.command(short_help='Rebuild the index of the enabled and disabled folders from scratch')
+def reindex(
+    jobs: int = typer.Option(os.cpu_count() or 1, '--jobs', '-j', help='The number of worker processes used to compute the colour statistics of the backgrounds')
+):
+    if jobs <= 0:
+        out.error(f'The given value of {jobs} for --jobs must be > 0')
+        return
+    folders = [cfg.enabled_path, cfg.disabled_path]
+    count = index.rebuild(folders)
+    # Statistics survive the rebuild for files that did not change, only the rest is decoded
+    stats.fill_missing(folders, jobs)
+    originals.relink(folders)
+    typer.echo(f'Indexed {count} backgrounds')
+
 @app.command(short_help='Initialize all required directories and create a config.json file if one does not exist')
 def init():
     if not cfg.enabled_path.is_dir():
@@ -345,10 +914,28 @@ def init():
         cfg.current_path.mkdir(parents=True)
 
 @app.callback(invoke_without_command=True)
-def default(ctx: typer.Context):
+def default(
+    ctx: typer.Context,
+    profile: bool = typer.Option(False, '--profile', help=f'Record how long each stage takes and how much memory it uses. Can also be turned on with {profiling.ENV}=1'),
+    profile_output: Optional[Path] = typer.Option(None, '--profile-output', help='Write the profile to this file instead of printing it'),
+    profile_format: Optional[str] = typer.Option(None, '--profile-format', help='The format of the profile. Valid values are ("summary", "json", "chrome"), defaults to "chrome" when writing to a file')
+):
+    if profile_format is not None and profile_format not in profiling.FORMATS:
+        out.error(f'{profile_format} is not a valid value for --profile-format. Valid values are ("summary", "json", "chrome")')
+        raise typer.Exit(1)
+    if profile or profile_output is not None:
+        profiling.enable(profile_output, profile_format)
+    else:
+        profiling.from_environment()
+    if profiling.enabled:
+        root = profiling.span(f'command {ctx.invoked_subcommand or "list"}')
+        root.__enter__()
+        ctx.call_on_close(lambda: (root.__exit__(None, None, None), profiling.report()))
+    
     init()
     
     if ctx.invoked_subcommand is not None:
         return
     
-    cli_list()
+    # Invoked through click so every option gets its default, not the typer.Option() it is declared with
+    ctx.invoke(ctx.command.get_command(ctx, 'list'))
@@ -0,0 +1,104 @@
+import os
+from pathlib import Path
+from typing import Optional, Union
+import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.publish as publish
+
+# Sources are stored under the sha256 of their content, so adding the same image twice keeps one copy
+
+def store_dir():
+    return tools.get_data_dir('originals')
+
+def keep(src: Union[str, bytes], sha256: str, folder: Path, suffix: str):
+    dest = folder / (sha256 + suffix.lower())
+    if dest.exists():
+        return str(dest)
+    tmp = dest.with_name(f'.{dest.name}.{os.getpid()}.tmp')
+    if isinstance(src, bytes):
+        tmp.write_bytes(src)
+    else:
+        # A clone where the filesystem supports it, otherwise a copy. Never a hard link, the source
+        # could be edited in place after it was added
+        publish.stage(Path(src), tmp, 'reflink')
+    publish.replace(tmp, dest)
+    return str(dest)
+
+def record(file: Path, original: Optional[str], params: Optional[str], sha256: Optional[str] = None):
+    # sha256 is the hash of the stored background. The original is also kept under it, so a background
+    # whose row was lost (a copy made by hand, a row the index had to drop) can find it again
+    key = index.folder_key(file.parent)
+    with index.transaction() as db:
+        db.execute('UPDATE images SET original = coalesce(?, original), params = ? WHERE folder = ? AND name = ?',
+                   (original, params, key, file.stem))
+        if sha256 is not None:
+            db.execute('''INSERT OR REPLACE INTO originals (sha256, path, params)
+                          SELECT ?, original, params FROM images WHERE folder = ? AND name = ? AND original IS NOT NULL''', (sha256, key, file.stem))
+
+def relink(folders):
+    # Gives the backgrounds that have no original the one that was kept for a file with the same
+    # content. Returns how many were linked again
+    import beastwick18_kitty_background_manager.duplicates as duplicates
+    db = index.connect()
+    keys = [index.refresh(f) for f in folders]
+    if db.execute('SELECT 1 FROM originals LIMIT 1').fetchone() is None:
+        return 0
+    placeholders = ', '.join('?' * len(keys))
+    linked = 0
+    for image_id, folder, name, sha256 in db.execute(f'SELECT id, folder, name, sha256 FROM images WHERE folder IN ({placeholders}) AND original IS NULL', keys).fetchall():
+        if sha256 is None:
+            try:
+                sha256 = duplicates.file_hash(os.path.join(folder, name + '.png'))
+            except FileNotFoundError:
+                continue
+        row = db.execute('SELECT path, params FROM originals WHERE sha256 = ?', (sha256,)).fetchone()
+        with index.transaction():
+            if row is not None and os.path.exists(row[0]):
+                db.execute('UPDATE images SET sha256 = ?, original = ?, params = ? WHERE id = ?', (sha256, *row, image_id))
+                linked += 1
+            else:
+                db.execute('UPDATE images SET sha256 = ? WHERE id = ?', (sha256, image_id))
+    return linked
+
+def outdated(folders, params: str, force: bool = False):
+    # Returns the backgrounds that were made with other settings as (file, original), and the number
+    # of backgrounds that have no original to be made again from
+    db = index.connect()
+    keys = [index.refresh(f) for f in folders]
+    placeholders = ', '.join('?' * len(keys))
+    rows = db.execute(f'''SELECT folder, name, original FROM images WHERE folder IN ({placeholders}) AND original IS NOT NULL
+                          AND (params IS NOT ? OR ?) ORDER BY folder, name''', (*keys, params, force)).fetchall()
+    missing = db.execute(f'SELECT count(*) FROM images WHERE folder IN ({placeholders}) AND original IS NULL', keys).fetchone()[0]
+    return [(Path(folder) / (name + '.png'), original) for folder, name, original in rows], missing
+
+def used_by(files):
+    db = index.connect()
+    found = set()
+    for file in files:
+        row = db.execute('SELECT original FROM images WHERE folder = ? AND name = ?', (index.folder_key(file.parent), file.stem)).fetchone()
+        if row is not None and row[0] is not None:
+            found.add(row[0])
+    return found
+
+def prune(candidates):
+    # Removes the originals that no background refers to anymore
+    db = index.connect()
+    for original in candidates:
+        if db.execute('SELECT 1 FROM images WHERE original = ?', (original,)).fetchone() is None:
+            with index.transaction():
+                db.execute('DELETE FROM originals WHERE path = ?', (original,))
+            try:
+                os.unlink(original)
+            except FileNotFoundError:
+                pass
+
+def clean_temporary(folders):
+    # Leftovers of a reprocess run that was killed before it could move its file into place
+    for folder in folders:
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            continue
+        for name in names:
+            if name.startswith('.') and name.endswith('.reprocess.tmp'):
+                os.unlink(os.path.join(folder, name))
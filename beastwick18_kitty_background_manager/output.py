@@ -1,7 +1,15 @@
+import json
 from pathlib import Path
 import beastwick18_kitty_background_manager.config as cfg
 import typer
 
+FORMATS = ('text', 'json', 'ndjson', 'tsv')
+# Quotes and escapes a str the way json.dumps(ensure_ascii=False) does, in C
+_quote = json.encoder.encode_basestring
+TSV_FIELDS = ('name', 'folder', 'path', 'size', 'mtime', 'width', 'height')
+# Backslash escapes, so a name can never break a line or a column apart
+TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
 def to_link(label: str, path: Path):
     return f'\u001b]8;;file://{path}\a{label}\u001b]8;;\a'
 
@@ -16,3 +24,38 @@ def error(msg: str):
 
 def readable_type(o):
     return str(type(o)).split("'")[1]
+
+def _null(value):
+    return 'null' if value is None else value
+
+def _json(row, folders: dict):
+    # The same text json.dumps would give for the entry, only several times faster
+    folder, name, size, mtime, width, height = row
+    label, key = folders[folder]
+    return f'{{"name": {_quote(name)}, "folder": {label}, "path": {_quote(f"{folder}/{name}.png")}, "size": {size}, "mtime": {mtime / 1e9}, "width": {_null(width)}, "height": {_null(height)}}}'
+
+def _tsv(row, folders: dict):
+    # Built straight from the row, going through a dict per entry costs more than the query itself
+    folder, name, size, mtime, width, height = row
+    if '\\' in name or '\t' in name or '\n' in name or '\r' in name:
+        name = name.translate(TSV_ESCAPES)
+    label, key = folders[folder]
+    return f'{name}\t{label}\t{key}/{name}.png\t{size}\t{mtime / 1e9}\t{"" if width is None else width}\t{"" if height is None else height}\n'
+
+def write_entries(rows, fmt: str, stream, folders: dict):
+    # Every entry is written as soon as the index hands it over. The stream is only flushed by its own
+    # buffering, not once per line like typer.echo does
+    if fmt in ('json', 'ndjson'):
+        quoted = {key: (_quote(label), key) for key, label in folders.items()}
+    if fmt == 'json':
+        stream.write('[')
+        for n, row in enumerate(rows):
+            stream.write((',\n' if n else '\n') + _json(row, quoted))
+        stream.write('\n]\n')
+    elif fmt == 'ndjson':
+        for row in rows:
+            stream.write(_json(row, quoted) + '\n')
+    elif fmt == 'tsv':
+        escaped = {key: (label.translate(TSV_ESCAPES), key.translate(TSV_ESCAPES)) for key, label in folders.items()}
+        for row in rows:
+            stream.write(_tsv(row, escaped))
@@ -0,0 +1,282 @@
+import io
+import os
+import math
+import json
+import hashlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple, Union
+import beastwick18_kitty_background_manager.config as cfg
+import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.thumbnails as thumbnails
+import beastwick18_kitty_background_manager.duplicates as duplicates
+import beastwick18_kitty_background_manager.stats as stats
+import beastwick18_kitty_background_manager.originals as originals
+import beastwick18_kitty_background_manager.profiling as profiling
+
+# Sources are only decoded at a reduced size once they are at least this many times
+# larger than the crop size, below that the quality of the final resample would suffer
+MIN_REDUCE_FACTOR = 2
+# Rough number of bytes decoded at once when a huge image is read in bands
+BAND_BYTES = 16 * 1024 * 1024
+# Sources that are handed to the workers as bytes (members of an archive) are only read ahead
+# of the workers until this much is waiting, so importing a huge archive takes bounded memory
+MAX_IN_FLIGHT_BYTES = 256 * 1024 * 1024
+
+@dataclass
+class Settings:
+    scale_type: str
+    crop_w: int
+    crop_h: int
+    background_color: str
+    contrast: float
+    brightness: float
+    thumbnail: Optional[Tuple[Tuple[int, int], bool]] = None
+    hashes: bool = False
+    stats: bool = False
+    # The mean luminance to bring each image to instead of applying the same brightness to all of them
+    target_luminance: Optional[float] = None
+    # Where a copy of every source is kept, so the background can be made again with other settings
+    originals: Optional[str] = None
+    profile: bool = False
+
+@dataclass
+class Processed:
+    dest: str
+    source: Optional[str] = None
+    sha256: Optional[str] = None
+    phash: Optional[int] = None
+    stats: Optional['stats.Stats'] = None
+    original: Optional[str] = None
+    params: Optional[str] = None
+    spans: Optional[list] = None
+
+def configured(**overrides):
+    # Settings for processing images as the config file describes them
+    crop_w, crop_h = (int(v) for v in cfg.get('crop_size').strip().split('x'))
+    s = Settings(cfg.get('scale_type'), crop_w, crop_h, cfg.get('background_color'), cfg.get('contrast'), cfg.get('brightness'), stats=True, **overrides)
+    if cfg.get('auto_brightness'):
+        s.target_luminance = cfg.get('target_luminance')
+    if cfg.get('keep_originals'):
+        s.originals = str(originals.store_dir())
+    if thumbnails.budget() > 0:
+        s.thumbnail = (thumbnails.target_size(cfg.get('preview_size'), cfg.get('preview_fill')), cfg.get('preview_fill'))
+    return s
+
+def fingerprint(settings: Settings):
+    # Everything that decides what the stored file looks like, in a form that compares as text
+    return json.dumps({
+        'crop_size': f'{settings.crop_w}x{settings.crop_h}',
+        'scale_type': settings.scale_type,
+        'background_color': settings.background_color,
+        'contrast': settings.contrast,
+        'brightness': settings.brightness if settings.target_luminance is None else None,
+        'target_luminance': settings.target_luminance,
+    }, sort_keys=True)
+
+def run_job(func, *args):
+    # Errors are handed back as values so a single bad image does not abort the rest of the batch
+    try:
+        return func(*args), None
+    except Exception as e:
+        return None, e
+
+def _held(args):
+    return sum(len(a) for a in args if isinstance(a, bytes))
+
+def run_all(func, work, jobs: int):
+    # work yields (key, args). Yields (key, (result, error)) in the same order, running func on up
+    # to jobs worker processes. work is only pulled as far ahead as the workers can use
+    if jobs == 1:
+        for key, args in work:
+            yield key, run_job(func, *args)
+        return
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    executor = ProcessPoolExecutor(max_workers=jobs)
+    pending = deque()
+    in_flight = 0
+    try:
+        for key, args in work:
+            size = _held(args)
+            while pending and (len(pending) >= 2 * jobs or in_flight + size > MAX_IN_FLIGHT_BYTES):
+                done_key, future, done_size = pending.popleft()
+                in_flight -= done_size
+                yield done_key, future.result()
+            pending.append((key, executor.submit(run_job, func, *args), size))
+            in_flight += size
+            del args
+        while pending:
+            done_key, future, _ = pending.popleft()
+            yield done_key, future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+def source_hash(src: Union[str, bytes]):
+    if isinstance(src, bytes):
+        return hashlib.sha256(src).hexdigest()
+    return duplicates.file_hash(src)
+
+@contextmanager
+def _unlimited():
+    # Image.open() refuses anything above twice MAX_IMAGE_PIXELS from the full size alone, which
+    # says nothing about how much memory decoding at a reduced size will take. The limit is only
+    # lifted to read the header, open_reduced() enforces it itself with the limit yielded here
+    from PIL import Image
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        yield limit
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+def _row_bytes(mode: str, rawmode: str, width: int):
+    from PIL import Image
+    if rawmode != mode:
+        return None
+    return len(Image.new(mode, (width, 1)).tobytes())
+
+def _bands(img, factor: int):
+    # Splits the tiles of the image into pieces that can be decoded on their own. Uncompressed
+    # data is cut into bands of rows, anything else is only split where the file already is
+    regions = []
+    for decoder, (x0, y0, x1, y1), offset, args in img.tile:
+        w, h = x1 - x0, y1 - y0
+        stride = None
+        if decoder == 'raw' and isinstance(args, tuple) and len(args) == 3:
+            rawmode, stride, orientation = args
+            if stride == 0:
+                stride = _row_bytes(img.mode, rawmode, w)
+        if not stride:
+            regions.append((decoder, (x0, y0, x1, y1), offset, args))
+            continue
+
+        rows = max(factor, BAND_BYTES // stride // factor * factor)
+        for top in range(0, h, rows):
+            bottom = min(h, top + rows)
+            # Bottom-up files (BMP) store the last row first
+            start = top if orientation > 0 else h - bottom
+            regions.append((decoder, (x0, y0 + top, x1, y0 + bottom), offset + start * stride, (rawmode, stride, orientation)))
+    return regions
+
+def _decode_banded(src, img, regions, factor: int):
+    from PIL import Image
+    w, h = img.size
+    out_w, out_h = math.ceil(w / factor), math.ceil(h / factor)
+    mode = 'RGBA' if img.mode in ('P', 'PA', 'LA', 'RGBA') else 'RGB' if img.mode not in ('L', 'RGB') else img.mode
+    out = Image.new(mode, (out_w, out_h))
+    palette = img.palette.getdata() if img.mode in ('P', 'PA') and img.palette is not None else None
+    # Compressed tiles run up to where the next one starts
+    starts = sorted({offset for _, _, offset, _ in regions})
+
+    with io.BytesIO(src) if isinstance(src, bytes) else open(src, 'rb') as fp:
+        end = fp.seek(0, os.SEEK_END)
+        for decoder, (x0, y0, x1, y1), offset, args in regions:
+            if decoder == 'raw' and isinstance(args, tuple) and len(args) == 3:
+                length = args[1] * (y1 - y0)
+            else:
+                length = next((start for start in starts if start > offset), end) - offset
+            fp.seek(offset)
+            part = Image.frombytes(img.mode, (x1 - x0, y1 - y0), fp.read(length), decoder, args)
+            if palette is not None:
+                part.putpalette(palette[1], palette[0])
+            left, top = x0 // factor, y0 // factor
+            size = (max(1, math.ceil(x1 / factor) - left), max(1, math.ceil(y1 / factor) - top))
+            out.paste(part.convert(mode).resize(size, Image.BOX), (left, top))
+    return out
+
+# The scale types that resize the image to the crop size, only those can be decoded at a reduced size
+RESIZED = ('fit', 'fill')
+
+def open_reduced(src: Union[str, bytes], target_w: int, target_h: int, scale_type: str):
+    from PIL import Image
+    with _unlimited() as limit:
+        img = Image.open(io.BytesIO(src) if isinstance(src, bytes) else src)
+    w, h = img.size
+    # Without resizing the stored file has the full size of the source
+    factor = min(w // target_w, h // target_h) if scale_type in RESIZED else 1
+
+    if img.format == 'JPEG' and factor >= MIN_REDUCE_FACTOR:
+        # libjpeg can skip most of the work by decoding at 1/2, 1/4 or 1/8 of the size directly
+        img.draft(img.mode, (target_w, target_h))
+        w, h = img.size
+        factor = min(w // target_w, h // target_h)
+    # A drafted JPEG is at most 8 times smaller, which can still be too large to decode at once
+    if limit is not None and w * h > limit:
+        regions = _bands(img, factor) if factor >= MIN_REDUCE_FACTOR else []
+        if len(regions) > 1:
+            # Never hold the full image in memory, only one band and the reduced result
+            img = _decode_banded(src, img, regions, factor)
+            w, h = img.size
+            factor = min(w // target_w, h // target_h)
+        elif w * h > 2 * limit:
+            raise Image.DecompressionBombError(f'The image has {w * h} pixels, too many to decode at full size')
+
+    if factor >= MIN_REDUCE_FACTOR:
+        # Palette images can not be averaged without expanding the palette first
+        if img.mode in ('1', 'P', 'PA'):
+            img = img.convert('L' if img.mode == '1' else 'RGBA')
+        img = img.reduce(factor)
+    return img
+
+def process_image(src: Union[str, bytes], dest: str, settings: Settings, name: Optional[str] = None, staged: Optional[str] = None):
+    # src is a path or the whole content of an image file. name is the file name the content had,
+    # the suffix of the kept original is taken from it. When staged is given the file is written
+    # there instead, for the caller to move over dest once it has decided to keep it
+    written = staged or dest
+    if settings.profile:
+        # Workers that were spawned instead of forked do not inherit the flag
+        profiling.enabled = True
+    start = profiling.mark()
+    
+    with profiling.span('decode'):
+        img = open_reduced(src, settings.crop_w, settings.crop_h, settings.scale_type)
+        img.load()
+    with profiling.span('scale'):
+        img = tools.scale_image(img, settings.scale_type, settings.crop_w, settings.crop_h, settings.background_color)
+    with profiling.span('tone'):
+        brightness = settings.brightness
+        if settings.target_luminance is not None:
+            # Contrast is stretched around the mean, so the mean is the same before and after it
+            brightness = stats.auto_brightness(tools.mean_luma(img) / 255, settings.target_luminance)
+        img = tools.adjust_tone(img, settings.contrast, brightness)
+    
+    with profiling.span('encode'):
+        img.save(written, format='PNG')
+    result = Processed(dest, params=fingerprint(settings))
+    
+    if settings.thumbnail is not None:
+        # The image is still decoded, so writing its preview thumbnail now is almost free
+        target, fill = settings.thumbnail
+        with profiling.span('thumbnail'):
+            thumbnails.store(img, Path(dest), target, fill, Path(written))
+    if settings.hashes:
+        # The perceptual hash is taken from the processed image, so it compares equal to the
+        # hashes of the backgrounds that are already in the library
+        with profiling.span('hash'):
+            result.source = source_hash(src)
+            result.sha256 = duplicates.file_hash(written)
+            result.phash = duplicates.dhash(img)
+    if settings.stats:
+        with profiling.span('stats'):
+            result.stats = stats.compute(img)
+    if settings.originals is not None:
+        with profiling.span('original'):
+            result.source = result.source or source_hash(src)
+            # The stored file is found by its content as well, see originals.relink()
+            result.sha256 = result.sha256 or duplicates.file_hash(written)
+            result.original = originals.keep(src, result.source, Path(settings.originals), Path(name or src).suffix)
+    
+    if settings.profile:
+        result.spans = profiling.take(start)
+    return result
+
+def reprocess_image(src: str, dest: str, settings: Settings):
+    # The new file is only moved over the old one once it is complete, so an interrupted run
+    # leaves every background either as it was or finished
+    tmp = os.path.join(os.path.dirname(dest), f'.{os.path.basename(dest)}.reprocess.tmp')
+    result = process_image(src, dest, settings, staged=tmp)
+    os.replace(tmp, dest)
+    return result
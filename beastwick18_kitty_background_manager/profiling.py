@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Optional
+
+ENV = 'KITTYBG_PROFILE'
+ENV_OUTPUT = 'KITTYBG_PROFILE_OUTPUT'
+ENV_FORMAT = 'KITTYBG_PROFILE_FORMAT'
+FORMATS = ('summary', 'json', 'chrome')
+
+enabled = False
+output: Optional[Path] = None
+output_format = 'summary'
+
+# Finished spans as (name, start ns, duration ns, pid, peak rss bytes), in the order they ended
+_spans = []
+_stack = []
+_NOOP = nullcontext()
+
+def _peak_rss():
+    try:
+        with open('/proc/self/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _reset_peak_rss():
+    # Linux starts counting the high water mark again from the current size. Elsewhere the
+    # peak can only grow, so a span reports the peak of the whole process up to its end
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+class Span:
+    __slots__ = ('name', 'start', 'peak')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        if _stack:
+            # Resetting the peak for this span would lose what the parent has used so far
+            parent = _stack[-1]
+            parent.peak = max(parent.peak, _peak_rss())
+        _reset_peak_rss()
+        self.peak = 0
+        _stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _stack.pop()
+        self.peak = max(self.peak, _peak_rss())
+        if _stack:
+            _stack[-1].peak = max(_stack[-1].peak, self.peak)
+        _spans.append((self.name, self.start, end - self.start, os.getpid(), self.peak))
+        return False
+
+def span(name: str):
+    # Costs one global lookup when profiling is off
+    if not enabled:
+        return _NOOP
+    return Span(name)
+
+def enable(path: Optional[Path] = None, fmt: Optional[str] = None):
+    global enabled, output, output_format
+    enabled = True
+    output = path
+    output_format = fmt or ('chrome' if path is not None else 'summary')
+
+def from_environment():
+    if os.environ.get(ENV, '') in ('', '0'):
+        return
+    path = os.environ.get(ENV_OUTPUT)
+    fmt = os.environ.get(ENV_FORMAT)
+    enable(Path(path) if path else None, fmt if fmt in FORMATS else None)
+
+def mark():
+    return len(_spans)
+
+def take(start: int):
+    # Hands the spans recorded since mark() to the parent process, which merges them into its own
+    spans = _spans[start:]
+    del _spans[start:]
+    return spans
+
+def merge(spans):
+    if spans:
+        _spans.extend(spans)
+
+def summary():
+    totals = {}
+    for name, _, duration, _, peak in _spans:
+        count, total, longest, high = totals.get(name, (0, 0, 0, 0))
+        totals[name] = (count + 1, total + duration, max(longest, duration), max(high, peak))
+
+    lines = [f'{"span":<24}{"count":>7}{"total ms":>12}{"mean ms":>12}{"max ms":>12}{"peak MB":>10}']
+    for name, (count, total, longest, high) in sorted(totals.items(), key=lambda t: -t[1][1]):
+        lines.append(f'{name:<24}{count:>7}{total / 1e6:>12.2f}{total / count / 1e6:>12.2f}{longest / 1e6:>12.2f}{high / 2 ** 20:>10.1f}')
+    return '\n'.join(lines)
+
+def chrome_trace():
+    # Complete events ("ph": "X") in microseconds, loadable in chrome://tracing and Perfetto
+    origin = min((s[1] for s in _spans), default=0)
+    events = [{
+        'name': name,
+        'ph': 'X',
+        'ts': (start - origin) / 1000,
+        'dur': duration / 1000,
+        'pid': pid,
+        'tid': pid,
+        'args': {'peak_rss': peak},
+    } for name, start, duration, pid, peak in _spans]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def report():
+    if not enabled or not _spans:
+        return
+    if output_format == 'summary':
+        text = summary()
+    else:
+        import json
+        if output_format == 'chrome':
+            data = chrome_trace()
+        else:
+            data = {'spans': [{'name': name, 'start_ns': start, 'duration_ns': duration, 'pid': pid, 'peak_rss': peak}
+                              for name, start, duration, pid, peak in _spans]}
+        text = json.dumps(data)
+
+    if output is None:
+        print(text, file=sys.stderr)
+    else:
+        output.write_text(text + '\n')
@@ -0,0 +1,71 @@
+import os
+import fcntl
+import shutil
+from pathlib import Path
+
+SWITCH_MODES = ('copy', 'hardlink', 'symlink', 'reflink')
+
+# ioctl(2) request for FICLONE from linux/fs.h, supported by btrfs, XFS and others
+FICLONE = 0x40049409
+
+def reflink(src: Path, dest: Path):
+    with open(src, 'rb') as s, open(dest, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dest)
+            raise
+
+def copy(src: Path, dest: Path):
+    shutil.copyfile(src, dest)
+    # Flush the data before the rename publishes it, so kitty never sees a partially written file
+    fd = os.open(dest, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def prepare(src: Path, dest: Path, mode: str):
+    return stage(src, dest.with_name(f'.{dest.name}.{os.getpid()}.tmp'), mode)
+
+def stage(src: Path, tmp: Path, mode: str):
+    # Builds the file that is later moved over the destination, tmp has to be on the same filesystem
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+
+    if mode == 'symlink':
+        os.symlink(src.resolve(), tmp)
+        return tmp
+
+    if mode == 'hardlink':
+        try:
+            os.link(src, tmp)
+            return tmp
+        except OSError:
+            # Most likely a different filesystem, fall through to the cheapest kind of copy
+            pass
+
+    if mode in ('hardlink', 'reflink'):
+        try:
+            reflink(src, tmp)
+            return tmp
+        except OSError:
+            pass
+
+    copy(src, tmp)
+    return tmp
+
+def publish(src: Path, dest: Path, mode: str = 'copy'):
+    # rename(2) does nothing if both names already point to the same inode, so skip that case
+    if mode == 'hardlink' and os.path.exists(dest) and os.path.samefile(src, dest) and not os.path.islink(dest):
+        return
+
+    replace(prepare(src, dest, mode), dest)
+
+def replace(tmp: Path, dest: Path):
+    try:
+        os.replace(tmp, dest)
+    except BaseException:
+        os.unlink(tmp)
+        raise
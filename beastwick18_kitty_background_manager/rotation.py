@@ -0,0 +1,103 @@
+import random
+from pathlib import Path
+from typing import Optional
+import beastwick18_kitty_background_manager.index as index
+
+def reservoir_choice(items):
+    # Picks uniformly from an iterable of unknown length while only holding one item in memory
+    choice = None
+    for n, item in enumerate(items, 1):
+        if random.randrange(n) == 0:
+            choice = item
+    return choice
+
+def _weighted_choice(rows):
+    # Efraimidis-Spirakis: the row with the largest random() ** (1 / weight) wins, which is a
+    # weighted draw that can be done in one streaming pass
+    best = None
+    best_key = -1.0
+    for row in rows:
+        weight = row[-1]
+        if weight <= 0:
+            continue
+        key = random.random() ** (1 / weight)
+        if key > best_key:
+            best, best_key = row, key
+    return best
+
+# rotation.drawn of a background that was left at the end of its cycle because it was the one on
+# screen. It is drawn first in the next cycle, as soon as something else is shown
+OWED = -1
+
+def _candidates(db, key: str, avoid: Optional[str], condition: str, params, drawn: int = 0):
+    return db.execute(f'''
+        SELECT images.id, images.name, coalesce(rotation.weight, 1.0) FROM images
+        LEFT JOIN rotation ON rotation.image_id = images.id
+        WHERE images.folder = ? AND coalesce(rotation.drawn, 0) = ? AND images.name IS NOT ? AND ({condition or 1})
+    ''', (key, drawn, avoid, *params))
+
+def _choose(db, key: str, avoid: Optional[str], condition: str, params):
+    # Returns the chosen row and whether it was owed from the last cycle
+    if (row := _weighted_choice(_candidates(db, key, avoid, condition, params, OWED))) is not None:
+        return row, True
+    return _weighted_choice(_candidates(db, key, avoid, condition, params)), False
+
+def draw(folder: Path, avoid: Optional[str] = None, condition: str = '', params=()):
+    # Every image in the folder is drawn once before any of them repeats. Images added since the
+    # start of the cycle have no rotation row yet, so they simply count as not drawn.
+    # With a condition only the matching images are drawn from, and only their cycle starts over
+    key = index.refresh(folder)
+    with index.transaction() as db:
+        row, owed = _choose(db, key, avoid, condition, params)
+        if row is None:
+            # The bag is empty, start a new cycle. The background that was just shown is left out
+            # of the first draw so the same one never comes up twice in a row. If it was the last
+            # one that was not drawn yet, it still gets that turn at the start of the new cycle
+            left = _weighted_choice(_candidates(db, key, None, condition, params))
+            db.execute(f'UPDATE rotation SET drawn = 0 WHERE image_id IN (SELECT id FROM images WHERE folder = ? AND ({condition or 1}))', (key, *params))
+            if left is not None:
+                db.execute('INSERT INTO rotation (image_id, drawn) VALUES (?, ?) ON CONFLICT (image_id) DO UPDATE SET drawn = excluded.drawn', (left[0], OWED))
+            row, owed = _choose(db, key, avoid, condition, params)
+            if row is None:
+                row, owed = _choose(db, key, None, condition, params)
+            if row is None:
+                return None
+
+        # A turn that was owed from the last cycle does not use up the one in this cycle
+        db.execute('INSERT INTO rotation (image_id, drawn) VALUES (?, ?) ON CONFLICT (image_id) DO UPDATE SET drawn = excluded.drawn', (row[0], 0 if owed else 1))
+    return row[1]
+
+def peek(folder: Path, avoid: Optional[str] = None, condition: str = '', params=()):
+    # What draw() would pick without taking its turn, which is left to mark_drawn() once the
+    # background is actually shown. Returns None at the end of a cycle instead of starting the next one
+    key = index.refresh(folder)
+    row, _ = _choose(index.connect(), key, avoid, condition, params)
+    return None if row is None else row[1]
+
+def mark_drawn(folder: Path, name: str):
+    with index.transaction() as db:
+        if (image_id := _image_id(db, folder, name)) is None:
+            return
+        db.execute('''
+            INSERT INTO rotation (image_id, drawn) VALUES (?, 1)
+            ON CONFLICT (image_id) DO UPDATE SET drawn = CASE WHEN rotation.drawn = ? THEN 0 ELSE 1 END
+        ''', (image_id, OWED))
+
+def _image_id(db, folder: Path, name: str):
+    key = index.refresh(folder)
+    row = db.execute('SELECT id FROM images WHERE folder = ? AND name = ?', (key, name)).fetchone()
+    return None if row is None else row[0]
+
+def get_weight(folder: Path, name: str):
+    db = index.connect()
+    if (image_id := _image_id(db, folder, name)) is None:
+        return None
+    row = db.execute('SELECT weight FROM rotation WHERE image_id = ?', (image_id,)).fetchone()
+    return 1.0 if row is None else row[0]
+
+def set_weight(folder: Path, name: str, weight: float):
+    with index.transaction() as db:
+        if (image_id := _image_id(db, folder, name)) is None:
+            return False
+        db.execute('INSERT INTO rotation (image_id, weight) VALUES (?, ?) ON CONFLICT (image_id) DO UPDATE SET weight = excluded.weight', (image_id, weight))
+    return True
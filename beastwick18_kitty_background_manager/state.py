@@ -0,0 +1,102 @@
+import os
+import json
+import fcntl
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# The parsed document is cached for the lifetime of the process and only re-read
+# when the file on disk no longer matches the signature it was read with
+_cache = {}
+_depth = {}
+
+def signature(path: Path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def _load(path: Path):
+    current = signature(path)
+    if current is None:
+        return None
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == current:
+        return cached[1]
+
+    with path.open('r') as f:
+        data = json.load(f)
+    _cache[path] = (current, data)
+    return data
+
+def read(path: Path):
+    return _load(path)
+
+def exists(path: Path):
+    return signature(path) is not None
+
+def atomic_write(path: Path, data):
+    json_str = json.dumps(data, indent=4)
+
+    fd, tmp = tempfile.mkstemp(prefix=f'.{path.name}.', suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(json_str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    # Make the rename itself durable
+    dir_fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+    _cache[path] = (signature(path), data)
+
+@contextmanager
+def lock(path: Path):
+    # The lock lives in a separate file, since os.replace swaps out the inode of the document itself
+    with open(path.with_name(path.name + '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+@contextmanager
+def transaction(path: Path, default=dict):
+    depth = _depth.get(path, 0)
+    if depth > 0:
+        # Nested transactions share the outer document and are written once when it finishes
+        _depth[path] = depth + 1
+        try:
+            yield _cache[path][1]
+        finally:
+            _depth[path] = depth
+        return
+
+    with lock(path):
+        data = _load(path)
+        if data is None:
+            data = default()
+            _cache[path] = (None, data)
+        before = json.dumps(data, sort_keys=True)
+
+        _depth[path] = 1
+        try:
+            yield data
+        except BaseException:
+            # Throw away the partial changes so the next read sees what is on disk
+            _cache.pop(path, None)
+            raise
+        finally:
+            _depth[path] = 0
+
+        if json.dumps(data, sort_keys=True) != before or not exists(path):
+            atomic_write(path, data)
@@ -0,0 +1,142 @@
+import os
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.profiling as profiling
+
+# The statistics are taken from a copy at most this large on its longer side
+SAMPLE_SIZE = 64
+PALETTE_SIZE = 5
+# Pixels with less saturation than this do not count towards the hue, greys have none
+MIN_SATURATION = 0.15
+# Images with less saturation than this on average have no hue at all
+GREY_SATURATION = 0.08
+
+# Centres of the named hues in degrees. A hue belongs to the name whose centre is closest
+HUES = {
+    'red': 0,
+    'orange': 30,
+    'yellow': 60,
+    'green': 120,
+    'cyan': 180,
+    'blue': 230,
+    'purple': 275,
+    'magenta': 320,
+}
+
+@dataclass
+class Stats:
+    luminance: float
+    contrast: float
+    saturation: float
+    hue: Optional[float]
+    palette: str
+
+def _sample(img):
+    from PIL import Image
+    small = img.convert('RGB') if img.mode != 'RGB' else img.copy()
+    small.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE), Image.BOX)
+    return small
+
+def _circular_mean(hist):
+    # The 256 bins of PIL's hue channel cover the whole circle
+    x = sum(n * math.cos(2 * math.pi * i / 256) for i, n in enumerate(hist) if n)
+    y = sum(n * math.sin(2 * math.pi * i / 256) for i, n in enumerate(hist) if n)
+    if x == 0 and y == 0:
+        return None
+    return math.degrees(math.atan2(y, x)) % 360
+
+def compute(img):
+    from PIL import Image, ImageStat
+    # Every step works on whole bands in C, only the 256 bin histograms are looped over here
+    small = _sample(img)
+    luma = ImageStat.Stat(small.convert('L'))
+    h, s, _ = small.convert('HSV').split()
+    saturation = ImageStat.Stat(s).mean[0] / 255
+
+    hue = None
+    if saturation >= GREY_SATURATION:
+        mask = s.point(lambda v: 255 if v >= MIN_SATURATION * 255 else 0)
+        hue = _circular_mean(h.histogram(mask=mask))
+
+    quantized = small.quantize(PALETTE_SIZE, method=Image.Quantize.MEDIANCUT)
+    palette = quantized.getpalette()
+    colors = sorted(quantized.getcolors(), reverse=True)
+    hex_colors = ['#{:02x}{:02x}{:02x}'.format(*palette[i * 3:i * 3 + 3]) for _, i in colors]
+    return Stats(luma.mean[0] / 255, luma.stddev[0] / 255, saturation, hue, ','.join(hex_colors))
+
+def auto_brightness(luminance: float, target: float):
+    # The brightness factor that takes an image of the given mean luminance to the target. Images
+    # that are already darker are left alone, brightening them would only wash them out
+    if luminance <= 0:
+        return 1.0
+    return min(1.0, target / luminance)
+
+def stats_image(path: str):
+    from PIL import Image, UnidentifiedImageError
+    try:
+        with Image.open(path) as img:
+            img.draft('RGB', (SAMPLE_SIZE, SAMPLE_SIZE))
+            return compute(img)
+    except (OSError, UnidentifiedImageError):
+        return None
+
+def _row(s: Stats):
+    return s.luminance, s.contrast, s.saturation, s.hue, s.palette
+
+def record(file: Path, s: Stats):
+    with index.transaction() as db:
+        db.execute('UPDATE images SET luminance = ?, contrast = ?, saturation = ?, hue = ?, palette = ? WHERE folder = ? AND name = ?',
+                   (*_row(s), index.folder_key(file.parent), file.stem))
+
+def fill_missing(folders, jobs: int = 1):
+    # Images that were copied into the folders by hand, or indexed before the statistics existed
+    db = index.connect()
+    keys = [index.refresh(f) for f in folders]
+    placeholders = ', '.join('?' * len(keys))
+    rows = db.execute(f'SELECT folder, name FROM images WHERE folder IN ({placeholders}) AND luminance IS NULL', keys).fetchall()
+    if len(rows) == 0:
+        return 0
+
+    paths = [os.path.join(folder, name + '.png') for folder, name in rows]
+    jobs = min(jobs, len(paths))
+    with profiling.span('stats.fill'):
+        if jobs == 1:
+            results = [stats_image(p) for p in paths]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(stats_image, paths, chunksize=16))
+
+    with index.transaction():
+        db.executemany('UPDATE images SET luminance = ?, contrast = ?, saturation = ?, hue = ?, palette = ? WHERE folder = ? AND name = ?',
+                       ((*_row(s), folder, name) for (folder, name), s in zip(rows, results) if s is not None))
+    return len(rows)
+
+def hue_range(name: str):
+    # Halfway to the neighbouring centres on either side
+    centres = sorted(HUES.values())
+    i = centres.index(HUES[name])
+    low = (centres[i] + (centres[i - 1] - 360 if i == 0 else centres[i - 1])) / 2
+    high = (centres[i] + (centres[i + 1] if i + 1 < len(centres) else centres[0] + 360)) / 2
+    return low % 360, high % 360
+
+def condition(key: str, dark: Optional[bool] = None, hue: Optional[str] = None):
+    # Returns an SQL condition on the images table and its parameters, to be appended with AND.
+    # Backgrounds are darkened when they are added, so dark and light are relative to the median
+    # of the folder instead of fixed levels
+    parts = []
+    params = []
+    if dark is not None:
+        median = '''(SELECT luminance FROM images WHERE folder = ? AND luminance IS NOT NULL ORDER BY luminance
+                     LIMIT 1 OFFSET (SELECT count(luminance) FROM images WHERE folder = ?) / 2)'''
+        parts.append(f'luminance {"<" if dark else ">="} {median}')
+        params += [key, key]
+    if hue is not None:
+        # Greys have no hue, so they never match. Red wraps around 0
+        low, high = hue_range(hue)
+        parts.append('hue >= ? AND hue < ?' if low < high else '(hue >= ? OR hue < ?)')
+        params += [low, high]
+    return ' AND '.join(parts), tuple(params)
@@ -0,0 +1,94 @@
+from pathlib import Path
+from typing import List, Optional
+import beastwick18_kitty_background_manager.index as index
+
+# Tags and collections are both named sets of image ids in the index. image_tags is keyed by
+# (tag_id, image_id) without a rowid, so the members of a tag are stored as one sorted run of ids
+# and every filter below is a lookup in it instead of a look at the files. An image keeps its
+# id when it is enabled, disabled or renamed by kittybg, and so keeps its tags as well.
+# At most one collection is active, it limits what random and next draw from
+
+MEMBERS = 'SELECT image_tags.image_id FROM image_tags JOIN tags ON tags.id = image_tags.tag_id WHERE tags.name = ? AND tags.collection = ?'
+
+def _tag_id(db, name: str, collection: bool, create: bool = False):
+    if create:
+        db.execute('INSERT INTO tags (name, collection) VALUES (?, ?) ON CONFLICT (collection, name) DO NOTHING', (name, collection))
+    row = db.execute('SELECT id FROM tags WHERE name = ? AND collection = ?', (name, collection)).fetchone()
+    return None if row is None else row[0]
+
+def _rows(tag_id: int, backgrounds):
+    return ((tag_id, index.folder_key(folder), name) for folder, name in backgrounds)
+
+def add(name: str, backgrounds, collection: bool = False):
+    # backgrounds are (folder, name). Returns how many of them did not have the tag yet
+    with index.transaction() as db:
+        tag_id = _tag_id(db, name, collection, create=True)
+        before = db.total_changes
+        db.executemany('INSERT OR IGNORE INTO image_tags (tag_id, image_id) SELECT ?, id FROM images WHERE folder = ? AND name = ?', _rows(tag_id, backgrounds))
+        return db.total_changes - before
+
+def remove(name: str, backgrounds, collection: bool = False):
+    with index.transaction() as db:
+        if (tag_id := _tag_id(db, name, collection)) is None:
+            return 0
+        before = db.total_changes
+        db.executemany('DELETE FROM image_tags WHERE tag_id = ? AND image_id = (SELECT id FROM images WHERE folder = ? AND name = ?)', _rows(tag_id, backgrounds))
+        return db.total_changes - before
+
+def delete(name: str, collection: bool = False):
+    with index.transaction() as db:
+        return db.execute('DELETE FROM tags WHERE name = ? AND collection = ?', (name, collection)).rowcount > 0
+
+def names(collection: bool = False):
+    return [name for name, in index.connect().execute('SELECT name FROM tags WHERE collection = ? ORDER BY name', (collection,))]
+
+def counts(folders, collection: bool = False):
+    # Returns (name, number of backgrounds in the folders, active) for every tag or collection
+    keys = [index.refresh(f) for f in folders]
+    placeholders = ', '.join('?' * len(keys))
+    return index.connect().execute(f'''SELECT tags.name, count(images.id), tags.active FROM tags
+                                           LEFT JOIN image_tags ON image_tags.tag_id = tags.id
+                                           LEFT JOIN images ON images.id = image_tags.image_id AND images.folder IN ({placeholders})
+                                           WHERE tags.collection = ? GROUP BY tags.id ORDER BY tags.name''', (*keys, collection)).fetchall()
+
+def of(file: Path, collection: bool = False):
+    key = index.refresh(file.parent)
+    return [name for name, in index.connect().execute('''SELECT tags.name FROM images JOIN image_tags ON image_tags.image_id = images.id
+                                                             JOIN tags ON tags.id = image_tags.tag_id
+                                                             WHERE images.folder = ? AND images.name = ? AND tags.collection = ? ORDER BY tags.name''',
+                                                          (key, file.stem, collection))]
+
+def missing(tags: List[str], collection: bool = False):
+    known = set(names(collection))
+    return [tag for tag in tags if tag not in known]
+
+def active():
+    row = index.connect().execute('SELECT name FROM tags WHERE collection AND active').fetchone()
+    return None if row is None else row[0]
+
+def use(name: Optional[str]):
+    # Switching collections only flips a flag, no file is moved. Returns False if there is no such collection
+    with index.transaction() as db:
+        if name is not None and _tag_id(db, name, True) is None:
+            return False
+        db.execute('UPDATE tags SET active = (name IS ?) WHERE collection', (name,))
+    return True
+
+def condition(tags: List[str] = (), not_tags: List[str] = (), collection: Optional[str] = None):
+    # Returns an SQL condition on the images table and its parameters, like stats.condition(). Every
+    # tag has to be there and none of the excluded ones
+    parts = []
+    params = []
+    for tag in tags:
+        parts.append(f'images.id IN ({MEMBERS})')
+        params += [tag, False]
+    for tag in not_tags:
+        parts.append(f'images.id NOT IN ({MEMBERS})')
+        params += [tag, False]
+    if collection is not None:
+        parts.append(f'images.id IN ({MEMBERS})')
+        params += [collection, True]
+    return ' AND '.join(parts), tuple(params)
+
+def active_condition():
+    return condition(collection=active())
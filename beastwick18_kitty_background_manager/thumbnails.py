@@ -0,0 +1,105 @@
+import os
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Optional, Tuple
+import beastwick18_kitty_background_manager.config as cfg
+import beastwick18_kitty_background_manager.tools as tools
+
+def cache_dir():
+    return tools.get_cache_dir('thumbnails')
+
+def budget():
+    return cfg.get('thumbnail_cache_size') * 1024 * 1024
+
+def target_size(size: int, fill: bool):
+    if fill and (px := tools.terminal_pixel_size()) is not None:
+        return px
+    return size, size
+
+def cache_path(src: Path, target: Tuple[int, int], fill: bool, written: Optional[Path] = None):
+    # written is where src is while it is being made, a rename keeps the mtime and size it has there
+    st = os.stat(written or src)
+    ident = f'{os.path.realpath(src)}\0{st.st_mtime_ns}\0{st.st_size}\0{target[0]}x{target[1]}\0{int(fill)}'
+    return cache_dir() / (hashlib.sha1(ident.encode()).hexdigest() + '.png')
+
+def render(img, target: Tuple[int, int]):
+    from PIL import Image
+    # Scale up or down until the image touches the edges of the target, like pixcat does
+    w, h = img.size
+    scale = min(target[0] / w, target[1] / h)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    if size == img.size:
+        return img
+    return img.resize(size, Image.LANCZOS)
+
+def store(img, src: Path, target: Tuple[int, int], fill: bool, written: Optional[Path] = None):
+    path = cache_path(src, target, fill, written)
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            render(img, target).save(f, format='PNG', compress_level=1)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
+
+def make(src: Path, target: Tuple[int, int], fill: bool):
+    # Returns the thumbnail at exactly target and whether it had to be made. Does not read the config
+    path = cache_path(src, target, fill)
+    try:
+        # Bumping the mtime marks the thumbnail as recently used for the LRU eviction
+        os.utime(path)
+        return path, False
+    except FileNotFoundError:
+        pass
+    
+    from PIL import Image
+    with Image.open(src) as img:
+        img.draft('RGB', target)
+        return store(img, src, target, fill), True
+
+def get(src: Path, size: int, fill: bool, evict_after: bool = True):
+    # evict_after=False leaves the eviction to the caller, which has to list the whole cache. Callers
+    # that get many thumbnails at once evict once they are done instead
+    if budget() <= 0:
+        return None
+    
+    path, made = make(src, target_size(size, fill), fill)
+    if made and evict_after:
+        evict()
+    return path
+
+def evict(limit: int = None):
+    if limit is None:
+        limit = budget()
+    evict_folder(cache_dir(), limit)
+
+def evict_folder(folder: Path, limit: int):
+    # Removes the least recently used files until the folder fits in limit bytes
+    entries = []
+    total = 0
+    with os.scandir(folder) as it:
+        for entry in it:
+            if not entry.name.endswith('.png'):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+            total += st.st_size
+    
+    if total <= limit:
+        return
+    
+    entries.sort()
+    for _, size, path in entries:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        if total <= limit:
+            break
@@ -1,10 +1,14 @@
+import os
 import re
+import glob
 from pathlib import Path
-from pixcat import Image as PixImage
-from PIL import ImageColor, Image, ImageEnhance, ImageOps
+from typing import List, Iterable, Optional
 import typer
 import beastwick18_kitty_background_manager.config as cfg
 import beastwick18_kitty_background_manager.output as out
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.thumbnails as thumbnails
+import beastwick18_kitty_background_manager.profiling as profiling
 
 def get_app_file(file: str):
     app_dir = typer.get_app_dir(cfg.APP_NAME)
@@ -14,6 +18,30 @@ def get_app_file(file: str):
     path: Path = app_path / file
     return path.resolve()
 
+def get_cache_dir(name: str):
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    path = Path(cache_home) / cfg.APP_NAME / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def get_data_dir(name: str):
+    data_home = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    path = Path(data_home) / cfg.APP_NAME / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def terminal_pixel_size():
+    import fcntl
+    import struct
+    import termios
+    try:
+        rows, cols, w, h = struct.unpack('HHHH', fcntl.ioctl(1, termios.TIOCGWINSZ, b'\0' * 8))
+    except OSError:
+        return None
+    if w == 0 or h == 0:
+        return None
+    return w, h
+
 def get_ext_in_path(path: Path, ext: str):
     if not path.is_dir():
         return
@@ -22,6 +50,11 @@ def get_ext_in_path(path: Path, ext: str):
         if f.is_file() and f.suffix == ext and not f.stem == '':
             yield f.stem
 
+def search_folders(enabled: Optional[bool]):
+    if enabled is None:
+        return [cfg.enabled_path, cfg.disabled_path]
+    return [cfg.enabled_path] if enabled else [cfg.disabled_path]
+
 def search_enabled_disabled(enabled, bg):
     if enabled or enabled is None:
         path1 = cfg.enabled_path
@@ -30,31 +63,114 @@ def search_enabled_disabled(enabled, bg):
         path1 = cfg.disabled_path
         path2 = cfg.enabled_path
     
-    file = (path1 / (bg + '.png'))
-    if file.exists():
-        return file
+    if index.contains(path1, bg):
+        return path1 / (bg + '.png')
 
-    if enabled is None:
-        file = (path2 / (bg + '.png'))
-        if file.exists():
-            return file
+    if enabled is None and index.contains(path2, bg):
+        return path2 / (bg + '.png')
+
+def show_image(img: Path, a: str = 'center'):
+    if cfg.get('preview_backend') == 'kitty':
+        import beastwick18_kitty_background_manager.kitty as kitty
+        w, _ = index.png_size(img)
+        kitty.show(img, w or 0, a, cfg.get('preview_transmission'))
+        return
+    
+    from pixcat import Image as PixImage
+    PixImage(str(img)).show(align=a)
 
 def preview_image(img: Path, size: int, fill: bool, a: str):
+    with profiling.span('preview'):
+        _preview_image(img, size, fill, a)
+
+def _preview_image(img: Path, size: int, fill: bool, a: str):
+    if (thumb := thumbnails.get(img, size, fill)) is not None:
+        # The cached thumbnail already has the final size, so pixcat does not need to resize it
+        show_image(thumb, 'center' if fill else a)
+        return
+    if cfg.get('preview_backend') == 'kitty':
+        # Without a cached thumbnail kitty is sent the background itself
+        show_image(img, 'center' if fill else a)
+        return
+    
+    from pixcat import Image as PixImage
     file = str(img.resolve())
     if fill:
         PixImage(file).fit_screen(enlarge=True).show()
     else:
         PixImage(file).thumbnail(size).show(align=a)
 
-def resolve_name_conflict(file: Path):
+def expand_paths(paths: List[str]):
+    for p in paths:
+        if glob.has_magic(p):
+            yield from (Path(f) for f in sorted(glob.glob(os.path.expanduser(p), recursive=True)))
+            continue
+        
+        path = Path(p).expanduser()
+        if path.is_dir():
+            # Only pick up the images in a directory, anything else would just be reported as an error
+            yield from (f for f in sorted(path.iterdir()) if f.is_file() and is_image(f))
+        else:
+            yield path
+
+# The formats that are taken for images, by the bytes they start with as (offset, bytes) pairs that
+# all have to match. imghdr did this before it was removed from the standard library in Python 3.13
+IMAGE_SIGNATURES = [
+    ('jpeg', ((0, b'\xff\xd8\xff'),)),
+    ('png', ((0, b'\x89PNG\r\n\x1a\n'),)),
+    ('gif', ((0, b'GIF87a'),)),
+    ('gif', ((0, b'GIF89a'),)),
+    ('webp', ((0, b'RIFF'), (8, b'WEBP'))),
+    ('bmp', ((0, b'BM'),)),
+    ('tiff', ((0, b'II*\x00'),)),
+    ('tiff', ((0, b'MM\x00*'),)),
+    ('sgi', ((0, b'\x01\xda'),)),
+    ('rast', ((0, b'\x59\xa6\x6a\x95'),)),
+    *(('pnm', ((0, b'P' + kind + space),)) for kind in (b'1', b'2', b'3', b'4', b'5', b'6') for space in (b' ', b'\t', b'\n', b'\r')),
+]
+# Enough of the start of a file to tell all of them apart
+SNIFF_BYTES = 16
+
+def image_type(head: bytes):
+    for name, parts in IMAGE_SIGNATURES:
+        if all(head[offset:offset + len(magic)] == magic for offset, magic in parts):
+            return name
+    return None
+
+def is_image(file: Path):
+    with open(file, 'rb') as f:
+        return image_type(f.read(SNIFF_BYTES)) is not None
+
+def image_stem(name: str):
+    # The name without its extension. Unlike Path.stem, ".png" is taken for an extension without a
+    # name, not for a hidden file that is called ".png"
+    return name.rpartition('.')[0] if '.' in name else name
+
+MAX_SUFFIX = 1000
+
+def resolve_name_conflict(file: Path, taken: Iterable[str] = ()):
     n = 1
-    while (file.with_stem(f'{file.stem}_{n}')).exists() and n < 1000:
+    while ((f := file.with_stem(f'{file.stem}_{n}')).exists() or f.name in taken) and n < MAX_SUFFIX:
         n += 1
-    if n == 1000:
+    if n == MAX_SUFFIX:
         return None
     return file.with_stem(f'{file.stem}_{n}')
 
+def unused_name(stem: str, taken: set):
+    # Like resolve_name_conflict, but against names that are already known instead of stat calls
+    for n in range(1, MAX_SUFFIX):
+        if (name := f'{stem}_{n}') not in taken:
+            return name
+    return None
+
+HEX_COLOR = re.compile(r'#([0-9a-fA-F]{3,4}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})')
+
 def valid_color(property_name: str, hex: str):
+    # Plain hex colors are checked here so loading the config does not have to import PIL
+    if isinstance(hex, str) and HEX_COLOR.fullmatch(hex):
+        return True
+    
+    from PIL import ImageColor
     try:
         ImageColor.getrgb(hex)
     except ValueError:
@@ -106,24 +222,47 @@ def assert_in(property_name: str, value, values):
         return False
     return True
 
-def set_brightness(img: Image, brightness: float):
-    enhancer = ImageEnhance.Brightness(img)
-    return enhancer.enhance(brightness)
+# Luma weights of PIL's RGB to L conversion, which ImageEnhance.Contrast takes its mean from
+LUMA = (299, 587, 114)
+
+def mean_luma(img):
+    # Taken from the histogram instead of a converted copy of the image
+    hist = img.histogram()
+    if img.mode in ('L', 'LA'):
+        return sum(i * n for i, n in enumerate(hist[:256])) / max(1, sum(hist[:256]))
+    means = [sum(i * n for i, n in enumerate(hist[b * 256:(b + 1) * 256])) / max(1, sum(hist[b * 256:(b + 1) * 256])) for b in range(3)]
+    return sum(w * m for w, m in zip(LUMA, means)) / 1000
 
-def set_contrast(img: Image, contrast: float):
-    enhancer = ImageEnhance.Contrast(img)
-    return enhancer.enhance(contrast)
+def tone_table(contrast: float, brightness: float, mean: int):
+    # Both steps of ImageEnhance blend towards a degenerate image and truncate the result to 8 bits,
+    # contrast towards the mean grey and brightness towards black
+    table = []
+    for x in range(256):
+        t = min(255, max(0, int(mean + contrast * (x - mean))))
+        table.append(min(255, max(0, int(brightness * t))))
+    return table
 
-def scale_image(img: Image, scale_type: str, crop_w: int, crop_h: int, background_color: str):
+def adjust_tone(img, contrast: float, brightness: float):
+    if contrast == 1 and brightness == 1:
+        return img
+    if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+    mean = int(mean_luma(img) + 0.5) if contrast != 1 else 0
+    table = tone_table(contrast, brightness, mean)
+    # Alpha is left alone, as it is by ImageEnhance
+    colors = 1 if img.mode in ('L', 'LA') else 3
+    alpha = list(range(256)) if 'A' in img.mode else []
+    return img.point(table * colors + alpha)
+
+def scale_image(img, scale_type: str, crop_w: int, crop_h: int, background_color: str):
+    from PIL import ImageColor, ImageOps
     if not cfg.conf['scale_type'].validate(scale_type):
         out.error(f'{scale_type} is not a valid value for property "scale_type"')
         return
     elif scale_type == 'fit':
         bgcol = ImageColor.getrgb(background_color)
         img = ImageOps.pad(img, (crop_w, crop_h), color=bgcol)
-        img = img.resize((crop_w, crop_h))
     elif scale_type == 'fill':
         img = ImageOps.fit(img, (crop_w, crop_h))
-        img = img.resize((crop_w, crop_h))
     return img
-
@@ -0,0 +1,139 @@
+import os
+import math
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Optional, Tuple
+import beastwick18_kitty_background_manager.config as cfg
+import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.thumbnails as thumbnails
+import beastwick18_kitty_background_manager.profiling as profiling
+
+# Overrides the detected window size, e.g. KITTYBG_WINDOW_SIZE=2560x1440
+ENV_WINDOW_SIZE = 'KITTYBG_WINDOW_SIZE'
+
+def cache_dir():
+    return tools.get_cache_dir('variants')
+
+def budget():
+    return cfg.get('variant_cache_size') * 1024 * 1024
+
+def parse_size(size: Optional[str]):
+    if not size:
+        return None
+    try:
+        w, h = (int(v) for v in size.strip().lower().split('x'))
+    except ValueError:
+        return None
+    if w <= 0 or h <= 0:
+        return None
+    return w, h
+
+def format_size(size: Tuple[int, int]):
+    return f'{size[0]}x{size[1]}'
+
+def detect():
+    # The size of the window the command runs in, as "WxH"
+    if (size := parse_size(os.environ.get(ENV_WINDOW_SIZE))) is not None:
+        return format_size(size)
+    if (size := tools.terminal_pixel_size()) is not None:
+        return format_size(size)
+    return None
+
+def remembered():
+    return cfg.read().get('background', {}).get('size')
+
+def geometries():
+    # The stored file comes first, it is what every background has without any extra work
+    stored = parse_size(cfg.get('crop_size'))
+    sizes = [stored]
+    for d in cfg.get('variant_sizes').split(','):
+        if (size := parse_size(d)) is not None and size not in sizes:
+            sizes.append(size)
+    return sizes
+
+def best_geometry(window: Tuple[int, int]):
+    # Matching the shape of the window matters most, since anything else gets cropped or padded.
+    # Among those, the smallest one that still covers the window wins, or else the largest one
+    def key(size):
+        aspect = round(abs(math.log((size[0] / size[1]) / (window[0] / window[1]))), 2)
+        covers = size[0] >= window[0] and size[1] >= window[1]
+        area = size[0] * size[1]
+        return aspect, not covers, area if covers else -area
+    return min(geometries(), key=key)
+
+def cache_path(src: Path, size: Tuple[int, int]):
+    st = os.stat(src)
+    ident = f'{os.path.realpath(src)}\0{st.st_mtime_ns}\0{st.st_size}\0{format_size(size)}\0{cfg.get("scale_type")}\0{cfg.get("background_color")}'
+    return cache_dir() / (hashlib.sha1(ident.encode()).hexdigest() + '.png')
+
+def _original(src: Path):
+    # The kept original of a background, as long as the background was made with the settings that
+    # are used now. Otherwise the variant would not look like the background it stands in for
+    import beastwick18_kitty_background_manager.index as index
+    import beastwick18_kitty_background_manager.pipeline as pipeline
+    row = index.connect().execute('SELECT original, params FROM images WHERE folder = ? AND name = ?',
+                                  (index.folder_key(src.parent), src.stem)).fetchone()
+    if row is None or row[0] is None or not os.path.exists(row[0]):
+        return None
+    settings = pipeline.configured()
+    if row[1] != pipeline.fingerprint(settings):
+        return None
+    settings.stats = False
+    settings.thumbnail = settings.originals = None
+    return row[0], settings
+
+def render(src: Path, size: Tuple[int, int]):
+    from PIL import Image
+    path = cache_path(src, size)
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=path.parent)
+    os.close(fd)
+    try:
+        if (found := _original(src)) is not None:
+            # Made from the full resolution source, the stored file is only as large as crop_size
+            import beastwick18_kitty_background_manager.pipeline as pipeline
+            original, settings = found
+            settings.crop_w, settings.crop_h = size
+            pipeline.process_image(original, str(path), settings, staged=tmp)
+        else:
+            with Image.open(src) as img:
+                img = tools.scale_image(img, cfg.get('scale_type'), size[0], size[1], cfg.get('background_color'))
+                img.save(tmp, format='PNG', compress_level=1)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
+
+def pick(src: Path, size: Optional[str]):
+    # Returns the file that fits a window of the given size best: the background itself or a
+    # variant of it, which is made the first time it is needed
+    if (window := parse_size(size)) is None or cfg.get('scale_type') == 'none' or budget() <= 0:
+        return src
+    if (geometry := best_geometry(window)) == geometries()[0]:
+        return src
+
+    path = cache_path(src, geometry)
+    try:
+        # Bumping the mtime marks the variant as recently used for the LRU eviction
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+    with profiling.span('variant'):
+        path = render(src, geometry)
+    evict()
+    # A cache that is too small to hold even this one variant
+    return path if path.exists() else src
+
+def source(file: Path, size: Optional[str], mode: str):
+    # What to publish for a background and how
+    if (src := pick(file, size)) != file and mode == 'symlink':
+        # Variants can be evicted from the cache at any time, so current.png gets its own copy
+        mode = 'copy'
+    return src, mode
+
+def evict(limit: int = None):
+    if limit is None:
+        limit = budget()
+    thumbnails.evict_folder(cache_dir(), limit)
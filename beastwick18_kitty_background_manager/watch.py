@@ -0,0 +1,221 @@
+import os
+import time
+import struct
+import select
+from pathlib import Path
+from typing import Callable
+import beastwick18_kitty_background_manager.config as cfg
+import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.state as state
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.pipeline as pipeline
+import beastwick18_kitty_background_manager.thumbnails as thumbnails
+import beastwick18_kitty_background_manager.duplicates as duplicates
+import beastwick18_kitty_background_manager.stats as stats
+import beastwick18_kitty_background_manager.originals as originals
+
+# Flags from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+# Files are only looked at once they are completely written or moved in, creation alone says nothing
+MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+EVENT = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+DEBOUNCE = 0.5
+# How often finished jobs are collected while the pool is busy
+POLL_INTERVAL = 0.1
+
+class Inotify:
+    def __init__(self):
+        import ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not available on this system')
+        self.get_errno = ctypes.get_errno
+        if (fd := self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)) < 0:
+            raise OSError(self.get_errno(), os.strerror(self.get_errno()))
+        self.fd = fd
+        self.watches = {}
+
+    def add(self, folder: Path):
+        if (wd := self.libc.inotify_add_watch(self.fd, os.fsencode(folder), MASK)) < 0:
+            raise OSError(self.get_errno(), os.strerror(self.get_errno()), str(folder))
+        self.watches[wd] = folder
+
+    def read(self):
+        # Yields (folder, mask, name) for every queued event
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            yield self.watches.get(wd), mask, os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher:
+    def __init__(self, inbox: Path, folders, jobs: int = 1, debounce: float = DEBOUNCE, log: Callable = print):
+        self.inbox = inbox
+        self.folders = list(folders)
+        self.jobs = jobs
+        self.debounce = debounce
+        self.log = log
+        self.settings = pipeline.configured(hashes=True)
+        self.inotify = Inotify()
+        self.executor = None
+        # Path -> time at which it has been quiet for long enough to be handled
+        self.pending = {}
+        # Future -> (source, output), outputs are reserved until their job is done
+        self.running = {}
+        # Sources that could not be processed, with the signature they had, so they are only tried again once changed
+        self.failed = {}
+
+        for folder in [inbox, *self.folders]:
+            folder.mkdir(parents=True, exist_ok=True)
+            self.inotify.add(folder)
+
+    def start(self):
+        # Catch up on whatever happened while nothing was watching. After this, only events are used
+        for folder in self.folders:
+            index.refresh(folder)
+        self.sweep()
+
+    def sweep(self):
+        for folder in [self.inbox, *self.folders]:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_file() and (folder == self.inbox or not entry.name.endswith('.png')):
+                        self.note(Path(entry.path))
+
+    def note(self, path: Path):
+        self.pending[path] = time.monotonic() + self.debounce
+
+    def _events(self):
+        for folder, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # The kernel dropped events, so look at everything once more
+                for f in self.folders:
+                    index.refresh(f)
+                self.sweep()
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self.log(f'Stopped watching {folder}: The folder was removed or moved')
+            elif folder is not None and name and not mask & IN_IGNORED:
+                self.note(folder / name)
+
+    def _reserved(self, folder: Path):
+        return {dest.stem for _, dest in self.running.values() if dest.parent == folder}
+
+    def _output_path(self, src: Path, folder: Path):
+        taken = set(index.stored_names(folder)) | self._reserved(folder)
+        name = src.stem
+        while name in taken or (folder / (name + '.png')).exists():
+            taken.add(name)
+            if (name := tools.unused_name(src.stem, taken)) is None:
+                return None
+        return folder / (name + '.png')
+
+    def _submit(self, src: Path, folder: Path):
+        if self.failed.get(src) == state.signature(src) or any(s == src for s, _ in self.running.values()):
+            return
+        if (dest := self._output_path(src, folder)) is None:
+            self.log(f'Could not add {src}: Cannot find an unused filename')
+            return
+        if self.executor is None:
+            import signal
+            from concurrent.futures import ProcessPoolExecutor
+            # Ctrl+C reaches the whole process group, only the watcher itself should handle it
+            self.executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=signal.signal, initargs=(signal.SIGINT, signal.SIG_IGN))
+        future = self.executor.submit(pipeline.run_job, pipeline.process_image, str(src), str(dest), self.settings)
+        self.running[future] = (src, dest)
+
+    def handle(self, path: Path):
+        if path.name.startswith('.'):
+            return
+        if path.parent == self.inbox:
+            if path.is_file() and tools.is_image(path):
+                self._submit(path, self.folders[0])
+            return
+
+        if path.suffix == '.png':
+            # PNGs in the library are kept as they are and only indexed. Whatever happened to the
+            # file, the index is set to what is on disk now
+            if path.is_file():
+                index.add_file(path)
+            else:
+                index.remove_file(path)
+        elif path.is_file() and tools.is_image(path):
+            self._submit(path, path.parent)
+
+    def _finish(self, future):
+        src, dest = self.running.pop(future)
+        result, err = future.result()
+        if err is not None:
+            self.failed[src] = state.signature(src)
+            self.log(f'Could not add {src}: {err}')
+            if dest.exists():
+                dest.unlink()
+            return
+
+        index.add_file(dest)
+        duplicates.record(dest, result.sha256, result.source, result.phash)
+        stats.record(dest, result.stats)
+        originals.record(dest, result.original, result.params, result.sha256)
+        # The processed copy replaces the original
+        try:
+            src.unlink()
+        except FileNotFoundError:
+            pass
+        self.log(f'Added {src} as {dest.name}')
+
+    def poll(self, timeout=None):
+        now = time.monotonic()
+        if self.pending:
+            wait = max(0.0, min(self.pending.values()) - now)
+            timeout = wait if timeout is None else min(timeout, wait)
+        if self.running:
+            timeout = POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL)
+
+        ready, _, _ = select.select([self.inotify.fd], [], [], timeout)
+        if ready:
+            self._events()
+
+        now = time.monotonic()
+        due = [p for p, at in self.pending.items() if at <= now]
+        if due and cfg.refresh():
+            # kittybg config was run since the last batch, its files are made with the new settings
+            self.settings = pipeline.configured(hashes=True)
+        for path in due:
+            del self.pending[path]
+            self.handle(path)
+
+        done = [f for f in self.running if f.done()]
+        for future in done:
+            self._finish(future)
+        if done and not self.running:
+            thumbnails.evict()
+        if (due or done) and self.idle():
+            # Every change to the folders came in as an event and has been handled, so the index is only
+            # missing their new mtimes. The scan that records them finds nothing new and only lists the folders
+            for folder in self.folders:
+                index.refresh(folder)
+
+    def idle(self):
+        return not self.pending and not self.running
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        self.inotify.close()
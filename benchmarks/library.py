@@ -0,0 +1,83 @@
+import os
+import json
+import random
+from pathlib import Path
+from typing import List, Tuple
+
+FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'webp': 'WEBP', 'bmp': 'BMP'}
+
+def parse_size(size: str):
+    w, h = size.lower().split('x')
+    return int(w), int(h)
+
+def make_image(size: Tuple[int, int], rng: random.Random):
+    from PIL import Image
+    # A gradient with some noise on top compresses roughly like a photo, unlike a flat colour
+    w, h = size
+    a = tuple(rng.randrange(256) for _ in range(3))
+    b = tuple(rng.randrange(256) for _ in range(3))
+    gradient = Image.linear_gradient('L').resize((w, h))
+    img = Image.composite(Image.new('RGB', (w, h), a), Image.new('RGB', (w, h), b), gradient)
+    noise = Image.effect_noise((w, h), 24).convert('RGB')
+    return Image.blend(img, noise, 0.15)
+
+def write_config(root: Path):
+    app_dir = root / 'config' / 'kittybg'
+    app_dir.mkdir(parents=True, exist_ok=True)
+    options = {
+        'enabled_path': str(root / 'library'),
+        'disabled_path': str(root / 'library' / 'disabled'),
+        'current_path': str(root / 'library' / 'current'),
+        'preview_on_add': False,
+    }
+    (app_dir / 'config.json').write_text(json.dumps({'options': options, 'background': {'next': '', 'previous': ''}}, indent=4))
+    for path in options.values():
+        if isinstance(path, str):
+            Path(path).mkdir(parents=True, exist_ok=True)
+    return options
+
+def environment(root: Path):
+    return {
+        'XDG_CONFIG_HOME': str(root / 'config'),
+        'XDG_CACHE_HOME': str(root / 'cache'),
+        'XDG_DATA_HOME': str(root / 'data'),
+        'XDG_RUNTIME_DIR': str(root / 'run'),
+        'KITTYBG_NO_DAEMON': '1',
+    }
+
+def generate(root: Path, count: int, sizes: List[Tuple[int, int]], formats: List[str], disabled_ratio: float = 0.2, seed: int = 0):
+    # Writes a config pointing into root and count images split between the enabled and disabled
+    # folders. Images of the same size and format are reused, since only their number matters
+    # for listing and selection
+    rng = random.Random(seed)
+    options = write_config(root)
+    enabled = Path(options['enabled_path'])
+    disabled = Path(options['disabled_path'])
+    
+    templates = {}
+    files = []
+    for n in range(count):
+        size = sizes[n % len(sizes)]
+        ext = formats[n % len(formats)]
+        if (size, ext) not in templates:
+            template = root / f'template_{size[0]}x{size[1]}.{ext}'
+            make_image(size, rng).save(template, FORMATS[ext])
+            templates[size, ext] = template.read_bytes()
+        
+        folder = disabled if rng.random() < disabled_ratio else enabled
+        file = folder / f'wallpaper_{n:06d}.{ext}'
+        file.write_bytes(templates[size, ext])
+        files.append(file)
+    return files
+
+def sources(root: Path, count: int, size: Tuple[int, int], fmt: str, seed: int = 0):
+    # Distinct source images for the ingest pipeline, outside of the library folders
+    rng = random.Random(seed)
+    folder = root / 'sources'
+    folder.mkdir(parents=True, exist_ok=True)
+    files = []
+    for n in range(count):
+        file = folder / f'source_{n:03d}.{fmt}'
+        make_image(size, rng).save(file, FORMATS[fmt])
+        files.append(file)
+    return files
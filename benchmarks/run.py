@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from benchmarks import library
+
+ROOT = Path(__file__).resolve().parent.parent
+RUN_APP = "from beastwick18_kitty_background_manager.main import app; app(prog_name='kittybg')"
+
+def measure(func, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def result(name: str, samples, **extra):
+    return {
+        'name': name,
+        **extra,
+        'repeat': len(samples),
+        'mean': statistics.fmean(samples),
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'max': max(samples),
+    }
+
+def child_env(root: Path):
+    return {**os.environ, **library.environment(root), 'PYTHONPATH': str(ROOT)}
+
+def run_child(kind: str, args, extra=()):
+    # Every measurement runs in a fresh interpreter, so module state and caches from one
+    # library size do not leak into the next
+    cmd = [sys.executable, '-m', 'benchmarks.run', '--child', kind, '--repeat', str(args.repeat),
+           '--resolutions', ','.join(f'{w}x{h}' for w, h in args.resolutions), '--formats', ','.join(args.formats),
+           '--source-size', '{}x{}'.format(*args.source_size), '--source-format', args.source_format,
+           '--sources', str(args.sources), *extra]
+    proc = subprocess.run(cmd, cwd=ROOT, env={**os.environ, 'PYTHONPATH': str(ROOT)}, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit(f'Benchmark "{kind}" failed:\n{proc.stderr}')
+    return json.loads(proc.stdout)
+
+def bench_startup(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        library.generate(root, 10, args.resolutions, ['png'])
+        env = child_env(root)
+        import_app = measure(lambda: subprocess.run([sys.executable, '-c', 'import beastwick18_kitty_background_manager.main'], env=env, check=True), args.repeat)
+        list_cmd = measure(lambda: subprocess.run([sys.executable, '-c', RUN_APP, 'list'], env=env, check=True, stdout=subprocess.DEVNULL), args.repeat)
+        bare = measure(lambda: subprocess.run([sys.executable, '-c', 'pass'], env=env, check=True), args.repeat)
+    return [
+        result('startup.interpreter', bare),
+        result('startup.import', import_app),
+        result('startup.list', list_cmd),
+    ]
+
+def bench_library(size: int, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        library.generate(root, size, args.resolutions, args.formats)
+        os.environ.update(library.environment(root))
+
+        import beastwick18_kitty_background_manager.config as cfg
+        import beastwick18_kitty_background_manager.tools as tools
+        import beastwick18_kitty_background_manager.index as index
+        import beastwick18_kitty_background_manager.actions as actions
+        folders = (cfg.enabled_path, cfg.disabled_path)
+
+        def list_index():
+            for folder in folders:
+                for _ in index.names(folder):
+                    pass
+
+        def list_scan():
+            for folder in folders:
+                for _ in tools.get_ext_in_path(folder, '.png'):
+                    pass
+
+        results = [result('list.cold', measure(list_index, 1), library_size=size)]
+        results.append(result('list.index', measure(list_index, args.repeat), library_size=size))
+        results.append(result('list.scan', measure(list_scan, args.repeat), library_size=size))
+        results.append(result('random.plain', measure(lambda: actions.random_background(shuffle=False), args.repeat), library_size=size))
+        results.append(result('random.shuffle', measure(lambda: actions.random_background(shuffle=True), args.repeat), library_size=size))
+
+        file = cfg.enabled_path / (next(index.names(cfg.enabled_path)) + '.png')
+        results.append(result('config.set_next', measure(lambda: cfg.set_next(file), args.repeat), library_size=size))
+    return results
+
+def bench_pipeline(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        library.write_config(root)
+        os.environ.update(library.environment(root))
+        sources = library.sources(root, args.sources, args.source_size, args.source_format)
+
+        import beastwick18_kitty_background_manager.config as cfg
+        import beastwick18_kitty_background_manager.pipeline as pipeline
+        crop_w, crop_h = library.parse_size(cfg.get('crop_size'))
+        settings = pipeline.Settings(cfg.get('scale_type'), crop_w, crop_h, cfg.get('background_color'), 1.2, cfg.get('brightness'))
+
+        samples = []
+        for _ in range(args.repeat):
+            for n, src in enumerate(sources):
+                dest = root / f'out_{n}.png'
+                start = time.perf_counter()
+                pipeline.process_image(str(src), str(dest), settings)
+                samples.append(time.perf_counter() - start)
+    return [result('pipeline.process_image', samples, source_size='{}x{}'.format(*args.source_size), source_format=args.source_format)]
+
+def compare(old_file: Path, new):
+    old = {(r['name'], r.get('library_size')): r for r in json.loads(old_file.read_text())['results']}
+    print(f'{"benchmark":<28}{"size":>8}{"old (ms)":>12}{"new (ms)":>12}{"ratio":>8}', file=sys.stderr)
+    for r in new['results']:
+        key = (r['name'], r.get('library_size'))
+        if key not in old:
+            continue
+        before, after = old[key]['median'] * 1000, r['median'] * 1000
+        ratio = after / before if before else float('nan')
+        print(f'{r["name"]:<28}{str(key[1] or ""):>8}{before:>12.3f}{after:>12.3f}{ratio:>8.2f}', file=sys.stderr)
+
+def metadata():
+    from beastwick18_kitty_background_manager import __version__
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'version': __version__,
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark kittybg against synthetic wallpaper libraries')
+    parser.add_argument('--sizes', default='100,1000,10000', help='Comma separated library sizes')
+    parser.add_argument('--resolutions', default='192x108', help='Comma separated WxH sizes of the library images')
+    parser.add_argument('--formats', default='png', help='Comma separated formats of the library images')
+    parser.add_argument('--sources', type=int, default=4, help='Number of images pushed through the ingest pipeline')
+    parser.add_argument('--source-size', default='3840x2160', help='WxH size of the pipeline source images')
+    parser.add_argument('--source-format', default='jpg', help='Format of the pipeline source images')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of times each measurement is repeated')
+    parser.add_argument('--skip', default='', help='Comma separated groups to skip (startup, library, pipeline)')
+    parser.add_argument('--output', '-o', type=Path, help='Write the results to this JSON file instead of stdout')
+    parser.add_argument('--compare', type=Path, help='Print a comparison against an earlier results file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.resolutions = [library.parse_size(s) for s in args.resolutions.split(',')]
+    args.formats = args.formats.split(',')
+    args.source_size = library.parse_size(args.source_size)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.child == 'library':
+        json.dump(bench_library(args.size, args), sys.stdout)
+        return
+    if args.child == 'pipeline':
+        json.dump(bench_pipeline(args), sys.stdout)
+        return
+
+    skip = set(filter(None, args.skip.split(',')))
+    results = []
+    if 'startup' not in skip:
+        results += bench_startup(args)
+    if 'library' not in skip:
+        for size in (int(s) for s in args.sizes.split(',')):
+            results += run_child('library', args, ['--size', str(size)])
+    if 'pipeline' not in skip:
+        results += run_child('pipeline', args)
+
+    report = {**metadata(), 'results': results}
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=4))
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+    if args.compare is not None:
+        compare(args.compare, report)
+
+if __name__ == '__main__':
+    main()
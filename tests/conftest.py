@@ -0,0 +1,38 @@
+import json
+from pathlib import Path
+import pytest
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.config as cfg
+
+@pytest.fixture
+def app_dirs(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path / 'data'))
+    monkeypatch.setattr(index, '_db', None)
+    yield tmp_path
+    if index._db is not None:
+        index._db.close()
+
+@pytest.fixture
+def folder(app_dirs: Path):
+    folder = app_dirs / 'bg'
+    folder.mkdir()
+    for n in range(10):
+        (folder / f'bg{n}.png').write_bytes(b'')
+    return folder
+
+@pytest.fixture
+def library(app_dirs: Path, monkeypatch):
+    bg = app_dirs / 'bg'
+    options = {'enabled_path': str(bg), 'disabled_path': str(bg / 'disabled'), 'current_path': str(bg / 'current'), 'queue_size': 2}
+    (app_dirs / 'config' / 'kittybg').mkdir(parents=True)
+    (app_dirs / 'config' / 'kittybg' / 'config.json').write_text(json.dumps({'options': options, 'background': {'next': '', 'previous': ''}}))
+    for path in options.values():
+        if isinstance(path, str):
+            Path(path).mkdir(parents=True)
+    for name in ('a', 'b', 'c', 'd'):
+        (bg / f'{name}.png').write_bytes(name.encode())
+    monkeypatch.setattr(cfg, 'loaded', False)
+    cfg.ensure_loaded()
+    return bg
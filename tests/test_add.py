@@ -0,0 +1,88 @@
+import os
+import re
+from pathlib import Path
+from PIL import Image
+from typer.testing import CliRunner
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.tools as tools
+
+COLOURS = ('red', 'green', 'blue', 'yellow', 'purple', 'orange')
+
+def add(monkeypatch, *args, input=None):
+    import beastwick18_kitty_background_manager.main as main
+    monkeypatch.setenv('KITTYBG_NO_DAEMON', '1')
+    return CliRunner(mix_stderr=False).invoke(main.app, ['add', '--no-preview', '--crop-size', '32x18', *args], input=input)
+
+def image(path: Path, colour: str = 'red'):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new('RGB', (64, 36), colour).save(path)
+    return path
+
+def added(output: str):
+    # The names are printed as terminal hyperlinks to the new files
+    return re.findall(r'^Added \x1b]8;;[^\a]*\a(.*?)\x1b]8;;\a', output, re.M)
+
+def test_expand_paths(tmp_path: Path):
+    image(tmp_path / 'pics' / 'b.png')
+    image(tmp_path / 'pics' / 'a.jpg')
+    (tmp_path / 'pics' / 'notes.txt').write_text('not an image')
+    image(tmp_path / 'pics' / 'deep' / 'c.jpg')
+
+    # Directories only give their images, globs give every match and anything else is passed on as it is
+    assert list(tools.expand_paths([str(tmp_path / 'pics')])) == [tmp_path / 'pics' / 'a.jpg', tmp_path / 'pics' / 'b.png']
+    assert list(tools.expand_paths([str(tmp_path / '**' / '*.jpg')])) == [tmp_path / 'pics' / 'a.jpg', tmp_path / 'pics' / 'deep' / 'c.jpg']
+    assert list(tools.expand_paths([str(tmp_path / 'missing.png'), str(tmp_path / 'pics' / 'notes.txt')])) == [tmp_path / 'missing.png', tmp_path / 'pics' / 'notes.txt']
+
+def test_names_taken_in_the_same_batch(library: Path, tmp_path: Path, monkeypatch):
+    image(tmp_path / 'one' / 'sun.jpg', 'red')
+    image(tmp_path / 'two' / 'sun.png', 'blue')
+    image(tmp_path / 'two' / 'a.png', 'green')
+
+    result = add(monkeypatch, '--duplicates', 'allow', str(tmp_path / 'one'), str(tmp_path / 'two'), input='y\n')
+    assert result.exit_code == 0
+    assert f'"sun" is already used by {tmp_path / "one" / "sun.jpg"}' in result.stdout
+    # a.png is taken by a background that was there before, which is only renamed after asking
+    assert '"a" already exists' in result.stdout
+    assert added(result.stdout) == ['sun.png', 'a_1.png', 'sun_1.png']
+    # The first one in the order of the arguments keeps the name
+    r, g, b = Image.open(library / 'sun.png').getpixel((0, 0))
+    assert r > b
+    r, g, b = Image.open(library / 'sun_1.png').getpixel((0, 0))
+    assert b > r
+
+def test_jobs_keep_the_input_order(library: Path, tmp_path: Path, monkeypatch):
+    files = [str(image(tmp_path / f'{n}_{colour}.png', colour)) for n, colour in enumerate(COLOURS)]
+
+    assert 'must be > 0' in add(monkeypatch, '--jobs', '0', *files).stderr
+    result = add(monkeypatch, '--duplicates', 'allow', '--jobs', '3', *files)
+    assert result.exit_code == 0
+    assert added(result.stdout) == [Path(f).name for f in files]
+    assert f'Added {len(files)} of {len(files)} images' in result.stdout
+    assert all(index.contains(library, Path(f).stem) for f in files)
+
+def test_skipped_duplicate_leaves_the_library_alone(library: Path, tmp_path: Path, monkeypatch):
+    src = image(tmp_path / 'sun.png', 'red')
+    assert added(add(monkeypatch, str(src)).stdout) == ['sun.png']
+    before = (library / 'sun.png').read_bytes()
+
+    # Overwriting with --force is only done once the new file is kept
+    result = add(monkeypatch, '--duplicates', 'skip', '--force', str(src))
+    assert result.exit_code == 0
+    assert 'Skipped' in result.stdout and added(result.stdout) == []
+    assert (library / 'sun.png').read_bytes() == before
+    assert index.contains(library, 'sun')
+    assert not [name for name in os.listdir(library) if name.endswith('.tmp')]
+
+def test_skipped_duplicate_leaves_no_original(library: Path, tmp_path: Path, monkeypatch):
+    import beastwick18_kitty_background_manager.config as cfg
+    import beastwick18_kitty_background_manager.originals as originals
+    monkeypatch.setattr(cfg.conf['keep_originals'], 'value', True)
+    assert added(add(monkeypatch, str(image(tmp_path / 'sun.png'))).stdout) == ['sun.png']
+    kept = list(originals.store_dir().iterdir())
+
+    # Differs from sun.png in its content, not in what it looks like
+    similar = image(tmp_path / 'similar.png')
+    Image.open(similar).save(tmp_path / 'similar.jpg', quality=95)
+    result = add(monkeypatch, '--duplicates', 'skip', str(tmp_path / 'similar.jpg'))
+    assert 'Skipped' in result.stdout
+    assert list(originals.store_dir().iterdir()) == kept
@@ -0,0 +1,73 @@
+import io
+import tarfile
+import zipfile
+from pathlib import Path
+import pytest
+from PIL import Image
+import beastwick18_kitty_background_manager.archives as archives
+import beastwick18_kitty_background_manager.tools as tools
+import beastwick18_kitty_background_manager.pipeline as pipeline
+
+def png(colour: str):
+    data = io.BytesIO()
+    Image.new('RGB', (64, 36), colour).save(data, format='PNG')
+    return data.getvalue()
+
+def test_members_are_sniffed(tmp_path: Path):
+    with zipfile.ZipFile(tmp_path / 'pack.zip', 'w') as z:
+        z.writestr('red.png', png('red'))
+        z.writestr('sub/blue.jpg', png('blue'))
+        z.writestr('readme.txt', 'not an image')
+    with tarfile.open(tmp_path / 'pack.tar.gz', 'w:gz') as t:
+        for name, data in (('notes.png', b'text that only looks like an image by name'), ('green.png', png('green'))):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            t.addfile(info, io.BytesIO(data))
+
+    assert archives.is_archive(tmp_path / 'pack.zip') and archives.is_archive(tmp_path / 'pack.tar.gz')
+    assert [name for name, _ in archives.members(tmp_path / 'pack.zip')] == ['red.png', 'sub/blue.jpg']
+    assert [(name, data) for name, data in archives.members(tmp_path / 'pack.tar.gz')] == [('green.png', png('green'))]
+
+    (tmp_path / 'cut.tar.gz').write_bytes((tmp_path / 'pack.tar.gz').read_bytes()[:60])
+    with pytest.raises(archives.ArchiveError):
+        list(archives.members(tmp_path / 'cut.tar.gz'))
+
+def test_process_image_from_bytes(tmp_path: Path):
+    settings = pipeline.Settings('fill', 32, 18, '#000000', 1.0, 1.0, hashes=True, originals=str(tmp_path))
+    result = pipeline.process_image(png('white'), str(tmp_path / 'out.png'), settings, 'white.PNG')
+    assert Image.open(tmp_path / 'out.png').size == (32, 18)
+    assert Path(result.original).read_bytes() == png('white')
+    assert result.original.endswith('.png')
+
+def test_run_all_keeps_order_and_reads_ahead_little(monkeypatch):
+    monkeypatch.setattr(pipeline, 'MAX_IN_FLIGHT_BYTES', 10)
+    pulled = []
+    def work():
+        for n in range(8):
+            pulled.append(n)
+            yield n, (b'x' * (n + 1),)
+
+    results = pipeline.run_all(len, work(), 2)
+    for n, (result, err) in results:
+        assert err is None and result == n + 1
+        # At most 2 per worker are submitted, plus the one waiting to be
+        assert len(pulled) - n <= 5
+    assert pulled == list(range(8))
+
+@pytest.mark.parametrize('format, kind', [('JPEG', 'jpeg'), ('PNG', 'png'), ('GIF', 'gif'), ('WEBP', 'webp'), ('BMP', 'bmp'), ('TIFF', 'tiff'), ('PPM', 'pnm'), ('SGI', 'sgi')])
+def test_image_types_are_sniffed(format: str, kind: str):
+    data = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(data, format=format)
+    assert tools.image_type(data.getvalue()[:tools.SNIFF_BYTES]) == kind
+    assert tools.image_type(b'RIFF\x00\x00\x00\x00WAVEfmt ') is None
+
+def test_members_without_a_name_are_refused(library: Path, tmp_path: Path, monkeypatch):
+    from typer.testing import CliRunner
+    import beastwick18_kitty_background_manager.main as main
+    with zipfile.ZipFile(tmp_path / 'pack.zip', 'w') as z:
+        z.writestr('sub/.png', png('red'))
+        z.writestr('sun.jpg', png('red'))
+    monkeypatch.setenv('KITTYBG_NO_DAEMON', '1')
+    result = CliRunner(mix_stderr=False).invoke(main.app, ['add', '--no-preview', '--duplicates', 'allow', str(tmp_path / 'pack.zip')])
+    assert '".png" is not a valid filename' in result.stderr
+    assert (library / 'sun.png').exists() and not (library / '.png.png').exists()
@@ -0,0 +1,15 @@
+from pathlib import Path
+from PIL import Image
+from benchmarks import library
+
+def test_generate_splits_library(tmp_path: Path):
+    files = library.generate(tmp_path, 40, [(32, 18), (18, 32)], ['png', 'jpg'], disabled_ratio=0.5)
+    
+    assert len(files) == 40
+    enabled = [f for f in files if f.parent == tmp_path / 'library']
+    disabled = [f for f in files if f.parent == tmp_path / 'library' / 'disabled']
+    assert len(enabled) + len(disabled) == 40
+    assert enabled and disabled
+    assert {f.suffix for f in files} == {'.png', '.jpg'}
+    assert {Image.open(f).size for f in files} == {(32, 18), (18, 32)}
+    assert (tmp_path / 'config' / 'kittybg' / 'config.json').is_file()
@@ -0,0 +1,48 @@
+import beastwick18_kitty_background_manager.bulk as bulk
+import beastwick18_kitty_background_manager.index as index
+
+def ids(folder):
+    key = index.refresh(folder)
+    return dict(index.connect().execute('SELECT name, id FROM images WHERE folder = ?', (key,)))
+
+def test_select_names_globs_and_regexes(folder):
+    selected, unmatched = bulk.select([folder], ['bg1', 'bg[23]', 'missing', 'x*'])
+    assert [name for _, name, _ in selected] == ['bg1', 'bg2', 'bg3']
+    assert unmatched == ['missing', 'x*']
+
+    selected, _ = bulk.select([folder], [r'bg[0-9]+'], regex=True)
+    assert len(selected) == 10
+    assert bulk.select([folder], [], everything=True)[0] == [(folder, f'bg{n}', None) for n in range(10)]
+
+def test_moves_resolve_conflicts_without_touching_the_disk(folder):
+    dest = folder / 'disabled'
+    dest.mkdir()
+    for name in ('bg1', 'bg1_1'):
+        (dest / f'{name}.png').write_bytes(b'')
+    before = ids(folder)
+
+    selected, _ = bulk.select([folder], ['bg1', 'bg2'])
+    moves, failed = bulk.plan_moves(selected, dest)
+    assert [d.name for _, d in moves] == ['bg1_2.png', 'bg2.png'] and failed == []
+
+    moved, errors = bulk.apply_moves(moves)
+    assert len(moved) == 2 and errors == []
+    assert set(ids(dest)) == {'bg1', 'bg1_1', 'bg1_2', 'bg2'}
+    assert ids(dest)['bg1_2'] == before['bg1']
+
+def test_swapping_names_keeps_files_and_ids(folder):
+    (folder / 'bg0.png').write_bytes(b'zero')
+    (folder / 'bg1.png').write_bytes(b'one')
+    before = ids(folder)
+
+    selected, _ = bulk.select([folder], [r'bg([01])'], regex=True)
+    moves, suffixed, failed = bulk.plan_renames(selected, 'tmp', regex=True)
+    assert [d.stem for _, d in moves] == ['tmp', 'tmp_1'] and suffixed == [('bg1', 'tmp', 'tmp_1')]
+
+    swap = [(folder / 'bg0.png', folder / 'bg1.png'), (folder / 'bg1.png', folder / 'bg0.png')]
+    renamed, errors = bulk.apply_moves(swap)
+    assert len(renamed) == 2 and errors == []
+    assert (folder / 'bg0.png').read_bytes() == b'one' and (folder / 'bg1.png').read_bytes() == b'zero'
+    after = ids(folder)
+    assert (after['bg0'], after['bg1']) == (before['bg1'], before['bg0'])
+    assert set(after) == set(before)
@@ -0,0 +1,41 @@
+import os
+from pathlib import Path
+import pytest
+from PIL import Image
+import beastwick18_kitty_background_manager.thumbnails as thumbnails
+import beastwick18_kitty_background_manager.contact_sheet as contact_sheet
+
+COLOURS = ('red', 'green', 'blue', 'white')
+
+def test_sheet_with_and_without_the_cache(library: Path, monkeypatch):
+    entries = []
+    for colour in COLOURS:
+        Image.new('RGB', (320, 180), colour).save(library / f'{colour}.png')
+        entries.append((library / f'{colour}.png', (255, 255, 255)))
+
+    evictions = []
+    evict = thumbnails.evict
+    monkeypatch.setattr(thumbnails, 'evict', lambda: evictions.append(1) or evict())
+    sheet = Image.open(contact_sheet.build(entries, 64, 2, jobs=2)).copy()
+    assert evictions == [1]
+    assert len(list(thumbnails.cache_dir().iterdir())) == len(COLOURS)
+
+    # Without a cache the tiles are made in memory, the sheet looks the same
+    monkeypatch.setattr(thumbnails, 'budget', lambda: 0)
+    uncached = Image.open(contact_sheet.build(entries, 64, 2, jobs=2))
+    assert evictions == [1]
+    assert list(sheet.getdata()) == list(uncached.getdata())
+
+@pytest.mark.parametrize('cached', [True, False])
+def test_unreadable_backgrounds_get_a_placeholder(library: Path, monkeypatch, cached):
+    if not cached:
+        monkeypatch.setattr(thumbnails, 'budget', lambda: 0)
+    Image.new('RGB', (320, 180), 'red').save(library / 'red.png')
+    (library / 'broken.png').write_bytes(b'not an image')
+    sheet = Image.open(contact_sheet.build([(library / 'red.png', (255, 255, 255)), (library / 'broken.png', (255, 255, 255))], 64, 2))
+    x = contact_sheet.PADDING + 64 + contact_sheet.PADDING
+    y = contact_sheet.PADDING
+    assert sheet.getpixel((contact_sheet.PADDING + 32, y + 32)) == (255, 0, 0)
+    assert sheet.getpixel((x, y)) == contact_sheet.PLACEHOLDER
+    assert sheet.getpixel((x + 32, y + 32)) == contact_sheet.BACKGROUND
+    assert os.listdir(Path(sheet.filename).parent) == ['sheet.png']
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import json
+import subprocess
+from pathlib import Path
+import beastwick18_kitty_background_manager.daemon as daemon
+
+RUN_APP = "from beastwick18_kitty_background_manager.main import app; app(prog_name='kittybg')"
+
+def test_daemon_serves_and_cli_forwards(app_dirs: Path, monkeypatch):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(app_dirs))
+    monkeypatch.delenv('KITTYBG_NO_DAEMON', raising=False)
+    bg = app_dirs / 'bg'
+    options = {'enabled_path': str(bg), 'disabled_path': str(bg / 'disabled'), 'current_path': str(bg / 'current')}
+    (app_dirs / 'config' / 'kittybg').mkdir(parents=True)
+    (app_dirs / 'config' / 'kittybg' / 'config.json').write_text(json.dumps({'options': options}))
+    for path in options.values():
+        Path(path).mkdir(parents=True)
+    (bg / 'one.png').write_bytes(b'one')
+    (bg / 'two.png').write_bytes(b'two')
+    
+    env = {**os.environ, 'PYTHONPATH': str(Path(__file__).parent.parent)}
+    proc = subprocess.Popen([sys.executable, '-c', RUN_APP, 'daemon'], env=env)
+    try:
+        for _ in range(100):
+            if (response := daemon.request('ping')) is not None:
+                break
+            time.sleep(0.05)
+        assert response == {'ok': True, 'result': proc.pid}
+        
+        assert daemon.request('list')['result']['enabled'] == ['one', 'two']
+        assert daemon.request('set', bg='nope')['ok'] is False
+        
+        cli = subprocess.run([sys.executable, '-c', RUN_APP, 'set', 'two'], env=env, capture_output=True, text=True)
+        assert 'two' in cli.stdout
+        assert (bg / 'current' / 'current.png').read_bytes() == b'two'
+        
+        assert daemon.request('next')['result']['next'] == str(bg / 'one.png')
+        assert (bg / 'current' / 'current.png').read_bytes() == b'one'
+        
+        assert daemon.request('stop') == {'ok': True, 'result': None}
+        proc.wait(5)
+    finally:
+        proc.kill()
+    
+    assert not daemon.socket_path().exists()
+    assert daemon.request('list') is None
+
+def test_failures_are_answered_and_keep_the_timer_running(library: Path, monkeypatch):
+    import asyncio
+    import sqlite3
+    import beastwick18_kitty_background_manager.actions as actions
+    calls = []
+    def locked(*args, **kwargs):
+        calls.append(args)
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(actions, 'run', locked)
+    assert daemon.handle({'command': 'list'}) == {'ok': False, 'error': 'The daemon could not run list: database is locked'}
+
+    monkeypatch.setattr(actions, 'next_background', locked)
+    async def rotate_for_a_while():
+        task = asyncio.create_task(daemon._rotate(0.01))
+        await asyncio.sleep(0.2)
+        assert not task.done()
+        task.cancel()
+    asyncio.run(rotate_for_a_while())
+    assert len(calls) > 3
@@ -0,0 +1,50 @@
+import random
+from PIL import Image
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.duplicates as duplicates
+
+def test_bk_tree_finds_the_same_matches_as_a_linear_scan():
+    rng = random.Random(4)
+    hashes = [rng.getrandbits(64) - (1 << 63) for _ in range(500)]
+    tree = duplicates.BKTree()
+    for n, h in enumerate(hashes):
+        tree.add(h, n)
+
+    for query in hashes[:50] + [rng.getrandbits(64) for _ in range(50)]:
+        expected = sorted((duplicates.distance(query, h), n) for n, h in enumerate(hashes) if duplicates.distance(query, h) <= 24)
+        assert sorted(tree.find(query, 24)) == expected
+
+def test_perceptual_hash_survives_resizing_and_reencoding(tmp_path):
+    img = Image.effect_mandelbrot((640, 360), (-2, -1, 1, 1), 60).convert('RGB')
+    img.resize((1920, 1080)).save(tmp_path / 'big.jpg', quality=70)
+    other = Image.effect_mandelbrot((640, 360), (-1, -1, 1, 1), 60).convert('RGB')
+
+    h = duplicates.dhash(img)
+    assert duplicates.distance(h, duplicates.dhash(Image.open(tmp_path / 'big.jpg'))) <= 4
+    assert duplicates.distance(h, duplicates.dhash(other)) > 10
+
+def test_clusters_group_duplicates_across_folders(app_dirs):
+    enabled, disabled = app_dirs / 'bg', app_dirs / 'bg' / 'disabled'
+    disabled.mkdir(parents=True)
+    for n, x in enumerate((-2.0, -1.0, 0.0)):
+        img = Image.effect_mandelbrot((320, 180), (x, -1, x + 1.5, 1), 60).convert('RGB')
+        img.save(enabled / f'a{n}.png')
+        img.resize((160, 90)).save(disabled / f'b{n}.png')
+    img.save(enabled / 'c.png')
+
+    groups = duplicates.clusters([enabled, disabled], 6)
+    assert sorted(sorted(f.name for f in g) for g in groups) == [['a0.png', 'b0.png'], ['a1.png', 'b1.png'], ['a2.png', 'b2.png', 'c.png']]
+
+def test_unreadable_images_are_only_hashed_again_once_changed(app_dirs):
+    folder = app_dirs / 'bg'
+    folder.mkdir()
+    Image.new('RGB', (64, 36), 'red').save(folder / 'red.png')
+    (folder / 'broken.png').write_bytes(b'not an image')
+    assert duplicates.fill_missing([folder]) == 2
+    assert duplicates.fill_missing([folder]) == 0
+    tree, _ = duplicates.library([folder])
+    assert [file.name for _, file in tree.find(duplicates.dhash(Image.new('RGB', (64, 36), 'red')), 64)] == ['red.png']
+
+    (folder / 'broken.png').write_bytes(b'still not an image')
+    index.add_file(folder / 'broken.png')
+    assert duplicates.fill_missing([folder]) == 1
@@ -0,0 +1,62 @@
+from pathlib import Path
+import pytest
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.fuzzy as fuzzy
+import beastwick18_kitty_background_manager.actions as actions
+
+NAMES = ('sunset', 'sunset_beach', 'Sunrise', 'midnight_sun', 'forest_rain', 'ocean')
+
+@pytest.fixture
+def named(library: Path):
+    for name in ('a', 'b', 'c', 'd'):
+        (library / f'{name}.png').unlink()
+    for name in NAMES:
+        (library / f'{name}.png').write_bytes(b'')
+    (library / 'disabled' / 'sunset.png').write_bytes(b'')
+    return library
+
+def names(folders, text, limit=10):
+    return [name for _, name in fuzzy.search(folders, text, limit)]
+
+def test_ranking(named: Path):
+    folders = [named, named / 'disabled']
+    assert names(folders, 'sunset') == ['sunset', 'sunset', 'sunset_beach', 'Sunrise']
+    assert fuzzy.search(folders, 'sunset', 1) == [(index.folder_key(named), 'sunset')]
+    assert names(folders, 'sun') == ['sunset', 'sunset', 'Sunrise', 'sunset_beach', 'midnight_sun']
+    assert names(folders, 'su', 2) == ['sunset', 'sunset']
+    # Typos
+    assert names([named], 'frest_ran') == ['forest_rain']
+    assert names([named], 'ocaen') == []
+    assert names([named], 'oceann') == ['ocean']
+
+def test_completion(named: Path):
+    folders = [named, named / 'disabled']
+    assert fuzzy.complete(folders, 'sun') == ['sunset', 'Sunrise', 'sunset_beach']
+    assert fuzzy.complete(folders, 'sun', 2) == ['sunset']
+    assert fuzzy.complete(folders, 'night') == ['midnight_sun']
+    assert len(fuzzy.complete(folders, '')) == len(NAMES)
+
+def test_the_index_follows_the_folders(named: Path):
+    (named / 'ocean.png').rename(named / 'deep_sea.png')
+    index.move_files([(named / 'ocean.png', named / 'deep_sea.png')])
+    assert names([named], 'ocean') == []
+    assert names([named], 'deep') == ['deep_sea']
+    (named / 'sunset_beach.png').unlink()
+    (named / 'lagoon.png').write_bytes(b'')
+    assert 'sunset_beach' not in names([named], 'sunset_')
+    assert names([named], 'lagon') == ['lagoon']
+    index.rebuild([named])
+    assert names([named], 'lagoon') == ['lagoon']
+
+def test_set_only_takes_a_name_it_can_be_sure_of(named: Path):
+    assert Path(actions.set_background('forest')['next']).stem == 'forest_rain'
+    assert Path(actions.set_background('sunrise')['next']).stem == 'Sunrise'
+    assert Path(actions.set_background('sunset_')['next']).stem == 'sunset_beach'
+    assert Path(actions.set_background('sunset', enabled=False)['next']).parent.name == 'disabled'
+    # Several names start with it, or it is only alike, so the user picks
+    with pytest.raises(actions.ActionError, match='Did you mean "sunset", "Sunrise", "sunset_beach"'):
+        actions.set_background('sun')
+    with pytest.raises(actions.ActionError, match='Did you mean "forest_rain"'):
+        actions.set_background('frest_ran')
+    with pytest.raises(actions.ActionError):
+        actions.set_background('xyz')
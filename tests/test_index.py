@@ -0,0 +1,114 @@
+import os
+from pathlib import Path
+from PIL import Image
+import beastwick18_kitty_background_manager.index as index
+
+def stored_mtime(folder: Path):
+    row = index.connect().execute('SELECT mtime FROM folders WHERE path = ?', (index.folder_key(folder),)).fetchone()
+    return None if row is None else row[0]
+
+def set_mtime(folder: Path, seconds: int):
+    # Folder mtimes are only as fine as the clock tick, so the tests set them instead of relying on it
+    os.utime(folder, ns=(seconds * 10**9, seconds * 10**9))
+
+def ids(folder: Path):
+    return dict(index.connect().execute('SELECT name, id FROM images WHERE folder = ?', (index.refresh(folder),)))
+
+def test_add_remove_and_move(folder: Path):
+    other = folder / 'other'
+    other.mkdir()
+    index.refresh(other)
+    before = ids(folder)
+
+    Image.new('RGB', (32, 18)).save(folder / 'new.png')
+    index.add_file(folder / 'new.png')
+    size, width, height = index.connect().execute("SELECT size, width, height FROM images WHERE name = 'new'").fetchone()
+    assert (size, width, height) == (os.path.getsize(folder / 'new.png'), 32, 18)
+
+    (folder / 'bg0.png').unlink()
+    index.remove_file(folder / 'bg0.png')
+    assert 'bg0' not in index.stored_names(folder)
+
+    # A move keeps the id, also across folders and onto a name that was taken
+    (other / 'bg2.png').write_bytes(b'')
+    index.refresh(other)
+    os.replace(folder / 'bg1.png', other / 'moved.png')
+    os.replace(folder / 'bg2.png', other / 'bg2.png')
+    index.move_files([(folder / 'bg1.png', other / 'moved.png'), (folder / 'bg2.png', other / 'bg2.png')])
+    assert ids(other) == {'moved': before['bg1'], 'bg2': before['bg2']}
+    assert set(ids(folder)) == {f'bg{n}' for n in range(3, 10)} | {'new'}
+
+def test_own_changes_keep_the_folder_fresh(folder: Path):
+    set_mtime(folder, 1000)
+    index.refresh(folder)
+
+    before = index.stamp([folder])
+    (folder / 'bg0.png').unlink()
+    set_mtime(folder, 1001)
+    index.remove_file(folder / 'bg0.png', before)
+    assert stored_mtime(folder) == os.stat(folder).st_mtime_ns
+
+def test_changes_by_others_are_still_scanned(folder: Path):
+    set_mtime(folder, 1000)
+    index.refresh(folder)
+
+    # Someone else adds a file, then we add one before anything looked at the folder again
+    (folder / 'theirs.png').write_bytes(b'')
+    set_mtime(folder, 1001)
+    before = index.stamp([folder])
+    (folder / 'ours.png').write_bytes(b'')
+    set_mtime(folder, 1002)
+    index.add_file(folder / 'ours.png', before)
+
+    assert stored_mtime(folder) == 1000 * 10**9
+    assert 'theirs' not in index.stored_names(folder)
+    assert {'theirs', 'ours'} <= set(index.names(folder))
+
+    # Without knowing what the folder looked like before, a change never marks it as scanned
+    (folder / 'more.png').write_bytes(b'')
+    set_mtime(folder, 1003)
+    index.add_file(folder / 'more.png')
+    assert stored_mtime(folder) == 1002 * 10**9
+
+def distinct(folder: Path):
+    # Renames are recognised by size and mtime, which the empty files of the fixture share too easily
+    for n, file in enumerate(sorted(folder.glob('*.png'))):
+        file.write_bytes(b'x' * n)
+        os.utime(file, ns=(n * 10**9, n * 10**9))
+
+def test_a_missing_folder_keeps_its_rows(folder: Path):
+    before = ids(folder)
+    folder.rename(folder.with_name('away'))
+    assert index.refresh(folder) is None
+    assert list(index.names(folder)) == []
+
+    # Whatever happened while it was gone is picked up once it is back
+    folder.with_name('away').rename(folder)
+    (folder / 'bg0.png').unlink()
+    assert ids(folder) == {name: i for name, i in before.items() if name != 'bg0'}
+
+def test_files_moved_by_hand_keep_their_rows(folder: Path):
+    other = folder / 'other'
+    other.mkdir()
+    distinct(folder)
+    index.refresh(other)
+    before = ids(folder)
+
+    os.replace(folder / 'bg1.png', folder / 'renamed.png')
+    os.replace(folder / 'bg2.png', other / 'bg2.png')
+    os.replace(folder / 'bg3.png', other / 'elsewhere.png')
+    # Either folder can be looked at first
+    assert ids(folder)['renamed'] == before['bg1']
+    assert ids(other) == {'bg2': before['bg2'], 'elsewhere': before['bg3']}
+
+    os.replace(folder / 'bg4.png', other / 'bg4.png')
+    assert ids(other)['bg4'] == before['bg4']
+    assert 'bg4' not in ids(folder)
+
+def test_reindex_of_a_moved_library_keeps_the_rows(folder: Path):
+    distinct(folder)
+    before = ids(folder)
+    moved = folder.with_name('moved')
+    folder.rename(moved)
+    assert index.rebuild([moved]) == 10
+    assert ids(moved) == before
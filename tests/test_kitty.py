@@ -0,0 +1,95 @@
+import base64
+import re
+from pathlib import Path
+import pytest
+import beastwick18_kitty_background_manager.kitty as kitty
+
+COMMAND = re.compile(rb'\x1b_G([^;]*);(.*?)\x1b\\', re.S)
+
+class RecordingTerminal:
+    # Stands in for kitty: records every escape sequence and answers queries from a script
+    def __init__(self, replies=(), size=(100, 40, 1000, 800)):
+        self.written = b''
+        self.replies = list(replies)
+        self.queries = []
+        self._size = size
+
+    def write(self, data: bytes):
+        self.written += data
+
+    def query(self, data: bytes, timeout: float = 0):
+        self.write(data)
+        self.queries.append(data)
+        return self.replies.pop(0) if self.replies else None
+
+    def size(self):
+        return self._size
+
+    def commands(self):
+        return [(dict(kv.split('=') for kv in keys.decode().split(',') if kv), payload) for keys, payload in COMMAND.findall(self.written)]
+
+@pytest.fixture
+def image(tmp_path: Path, app_dirs, monkeypatch):
+    monkeypatch.setenv('KITTY_WINDOW_ID', '1')
+    monkeypatch.setenv('KITTY_PID', '42')
+    path = tmp_path / 'image.png'
+    path.write_bytes(b'\x89PNG' + bytes(range(256)) * 40)
+    return path
+
+def test_file_transmission_sends_only_the_path(image):
+    terminal = RecordingTerminal()
+    kitty.show(image, 100, transmission='file', terminal=terminal)
+    
+    [(keys, payload)] = terminal.commands()
+    assert keys['a'] == 'T' and keys['t'] == 'f' and keys['f'] == '100'
+    assert base64.b64decode(payload) == str(image).encode()
+
+def test_direct_transmission_is_chunked(image):
+    terminal = RecordingTerminal()
+    kitty.show(image, 100, transmission='direct', terminal=terminal)
+    
+    commands = terminal.commands()
+    assert len(commands) > 1
+    assert commands[0][0]['t'] == 'd'
+    assert [keys['m'] for keys, _ in commands] == ['1'] * (len(commands) - 1) + ['0']
+    assert all(len(payload) <= kitty.CHUNK_SIZE for _, payload in commands)
+    assert base64.b64decode(b''.join(payload for _, payload in commands)) == image.read_bytes()
+
+def test_repeated_preview_reuses_uploaded_image(image):
+    first = RecordingTerminal()
+    image_id = kitty.show(image, 100, transmission='direct', terminal=first)
+    
+    second = RecordingTerminal(replies=[f'\x1b_Gi={image_id};OK\x1b\\'])
+    assert kitty.show(image, 100, transmission='direct', terminal=second) == image_id
+    [(keys, payload)] = second.commands()
+    assert keys == {'a': 'p', 'i': str(image_id), 'q': '0'}
+    assert payload == b''
+
+def test_evicted_image_is_transmitted_again(image):
+    image_id = kitty.show(image, 100, transmission='file', terminal=RecordingTerminal())
+    
+    terminal = RecordingTerminal(replies=[f'\x1b_Gi={image_id};ENOENT:No such image\x1b\\'])
+    new_id = kitty.show(image, 100, transmission='file', terminal=terminal)
+    assert [keys['a'] for keys, _ in terminal.commands()] == ['p', 'T']
+    assert kitty.show(image, 100, terminal=RecordingTerminal(replies=[f'\x1b_Gi={new_id};OK\x1b\\'])) == new_id
+
+def test_remote_sessions_use_direct_transmission(monkeypatch):
+    monkeypatch.setenv('SSH_CONNECTION', '1.2.3.4 5 6.7.8.9 22')
+    assert kitty.choose_transmission() == 'direct'
+    assert kitty.choose_transmission('shm') == 'shm'
+
+def test_alignment_moves_the_cursor(image):
+    terminal = RecordingTerminal(size=(100, 40, 1000, 800))
+    kitty.show(image, 200, align='center', terminal=terminal)
+    assert terminal.written.startswith(b'\x1b[40C')
+
+def test_preview_uses_kitty_without_the_cache(library: Path, monkeypatch):
+    import beastwick18_kitty_background_manager.config as cfg
+    import beastwick18_kitty_background_manager.tools as tools
+    import beastwick18_kitty_background_manager.thumbnails as thumbnails
+    shown = []
+    monkeypatch.setattr(cfg.conf['preview_backend'], 'value', 'kitty')
+    monkeypatch.setattr(thumbnails, 'budget', lambda: 0)
+    monkeypatch.setattr(kitty, 'show', lambda path, *args: shown.append(path))
+    tools.preview_image(library / 'a.png', 64, False, 'left')
+    assert shown == [library / 'a.png']
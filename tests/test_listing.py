@@ -0,0 +1,51 @@
+import io
+import json
+from pathlib import Path
+import pytest
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.actions as actions
+import beastwick18_kitty_background_manager.output as output
+
+def names(**args):
+    return [name for _, name, *_ in actions.entries(**args)]
+
+def test_sort_filter_and_page(library: Path):
+    (library / 'd.png').write_bytes(b'a much larger file')
+    (library / 'disabled' / 'e.png').write_bytes(b'e')
+    assert names() == ['a', 'b', 'c', 'd', 'e']
+    assert names(disabled=False, sort='size', reverse=True)[0] == 'd'
+    assert names(reverse=True, limit=2, offset=1) == ['d', 'c']
+    assert names(match=['a*', '?']) == ['a', 'b', 'c', 'd', 'e']
+    assert names(match=['[bd]', 'e']) == ['b', 'd', 'e']
+    assert names(match=['a|b'], regex=True) == ['a', 'b']
+    assert names(match=['[ab].'], regex=True) == []
+    with pytest.raises(actions.ActionError):
+        names(match=['('], regex=True)
+    with pytest.raises(actions.ActionError):
+        names(sort='colour')
+
+def test_formats(library: Path):
+    (library / 'tab\there.png').write_bytes(b'')
+    folders = {index.folder_key(library): 'enabled'}
+
+    def write(fmt):
+        stream = io.StringIO()
+        output.write_entries(actions.entries(match=['tab*', 'a']), fmt, stream, folders)
+        return stream.getvalue()
+
+    listing = json.loads(write('json'))
+    assert [e['name'] for e in listing] == ['a', 'tab\there']
+    assert listing[0]['folder'] == 'enabled' and listing[0]['path'] == str(library / 'a.png') and listing[0]['size'] == 1
+    assert [json.loads(line) for line in write('ndjson').splitlines()] == listing
+    lines = write('tsv').splitlines()
+    assert len(lines) == 2
+    assert lines[1].split('\t')[:2] == ['tab\\there', 'enabled']
+
+def test_no_command_lists_everything(library: Path, monkeypatch):
+    from typer.testing import CliRunner
+    import beastwick18_kitty_background_manager.main as main
+    monkeypatch.setenv('KITTYBG_NO_DAEMON', '1')
+    result = CliRunner().invoke(main.app, [])
+    assert result.exit_code == 0
+    assert 'Enabled' in result.output and 'Disabled' in result.output
+    assert all(str(library / f'{name}.png') in result.output for name in 'abcd')
@@ -0,0 +1,74 @@
+from pathlib import Path
+import pytest
+import beastwick18_kitty_background_manager.config as cfg
+import beastwick18_kitty_background_manager.actions as actions
+import beastwick18_kitty_background_manager.lookahead as lookahead
+import beastwick18_kitty_background_manager.index as index
+
+def current(bg: Path):
+    return (bg / 'current' / 'current.png').read_bytes().decode()
+
+def queued():
+    with cfg.transaction() as data:
+        return [Path(e['file']).stem for e in data['background']['queue']]
+
+def test_next_uses_the_prepared_queue(library: Path):
+    actions.next_background()
+    lookahead.refill()
+    upcoming = queued()
+    assert len(upcoming) == 2 and cfg.get_next() not in upcoming
+    assert len(list((library / 'current' / lookahead.QUEUE_DIR).iterdir())) == 2
+
+    actions.next_background()
+    assert current(library) == upcoming[0]
+    lookahead.refill()
+    assert queued()[0] == upcoming[1]
+    assert len(list((library / 'current' / lookahead.QUEUE_DIR).iterdir())) == 2
+
+def test_stale_entries_are_skipped(library: Path):
+    actions.set_background('a')
+    lookahead.refill()
+    first, second = queued()
+    (library / f'{first}.png').rename(library / 'disabled' / f'{first}.png')
+
+    actions.next_background()
+    assert current(library) == second
+
+def test_prev_walks_back_through_the_history(library: Path):
+    for name in ('a', 'b', 'c'):
+        actions.set_background(name)
+    lookahead.refill()
+
+    actions.previous_background()
+    assert current(library) == 'b'
+    # The background that was undone comes up again next
+    assert queued()[0] == 'c'
+    actions.previous_background()
+    assert current(library) == 'a'
+    with pytest.raises(actions.ActionError):
+        actions.previous_background()
+
+def test_queued_backgrounds_keep_their_turn_until_popped(library: Path):
+    actions.next_background()
+    lookahead.refill()
+    upcoming = queued()
+    assert set(index.names(library, 'id IN (SELECT image_id FROM rotation WHERE drawn = 1)')) == {cfg.get_next()}
+
+    # They still come up in the order they were queued, once each in the cycle
+    shown = [cfg.get_next()]
+    for _ in range(3):
+        actions.next_background()
+        shown.append(cfg.get_next())
+        lookahead.refill()
+    assert shown[1:3] == upcoming and sorted(shown) == ['a', 'b', 'c', 'd']
+
+def test_the_cli_only_refills_when_shuffling(library: Path, monkeypatch):
+    from typer.testing import CliRunner
+    import beastwick18_kitty_background_manager.main as main
+    monkeypatch.setenv('KITTYBG_NO_DAEMON', '1')
+    assert CliRunner().invoke(main.app, ['set', 'a']).exit_code == 0
+    assert CliRunner().invoke(main.app, ['random']).exit_code == 0
+    assert queued() == []
+
+    assert CliRunner().invoke(main.app, ['random', '--shuffle']).exit_code == 0
+    assert len(queued()) == 2
@@ -0,0 +1,72 @@
+import shutil
+from pathlib import Path
+from PIL import Image
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.bulk as bulk
+import beastwick18_kitty_background_manager.pipeline as pipeline
+import beastwick18_kitty_background_manager.originals as originals
+
+def add(src: Path, dest: Path, settings: pipeline.Settings):
+    result = pipeline.process_image(str(src), str(dest), settings)
+    index.add_file(dest)
+    originals.record(dest, result.original, result.params)
+    return result
+
+def test_originals_are_kept_once_and_reprocessed(library: Path, tmp_path: Path):
+    store = originals.store_dir()
+    settings = pipeline.Settings('fill', 64, 36, '#000000', 1.0, 0.5, originals=str(store))
+    Image.new('RGB', (128, 72), 'white').save(tmp_path / 'white.jpg')
+    first = add(tmp_path / 'white.jpg', library / 'a.png', settings)
+    second = add(tmp_path / 'white.jpg', library / 'b.png', settings)
+    assert first.original == second.original
+    assert len(list(store.iterdir())) == 1
+
+    todo, missing = originals.outdated([library], first.params)
+    assert todo == [] and missing == 2
+
+    brighter = pipeline.Settings('fill', 64, 36, '#000000', 1.0, 1.0)
+    todo, _ = originals.outdated([library], pipeline.fingerprint(brighter))
+    assert [file.stem for file, _ in todo] == ['a', 'b']
+    for file, original in todo:
+        result = pipeline.reprocess_image(original, str(file), brighter)
+        originals.record(file, None, result.params)
+    assert Image.open(library / 'a.png').getpixel((0, 0)) == (255, 255, 255)
+    assert not any(p.name.endswith('.tmp') for p in library.iterdir())
+    assert originals.outdated([library], pipeline.fingerprint(brighter))[0] == []
+
+    # The original goes once nothing refers to it anymore
+    bulk.delete([library / 'a.png'])
+    assert len(list(store.iterdir())) == 1
+    bulk.delete([library / 'b.png'])
+    assert list(store.iterdir()) == []
+
+def test_copies_find_their_original_by_content(library: Path, tmp_path: Path):
+    settings = pipeline.Settings('fill', 64, 36, '#000000', 1.0, 0.5, originals=str(originals.store_dir()))
+    Image.new('RGB', (128, 72), 'white').save(tmp_path / 'white.jpg')
+    result = add(tmp_path / 'white.jpg', library / 'a.png', settings)
+    originals.record(library / 'a.png', result.original, result.params, result.sha256)
+
+    # A copy made by hand has a row of its own, which starts without an original
+    shutil.copy(library / 'a.png', library / 'copy.png')
+    todo, missing = originals.outdated([library], '{}')
+    assert [file.stem for file, _ in todo] == ['a'] and missing == 4
+    assert originals.relink([library]) == 1
+    todo, _ = originals.outdated([library], '{}')
+    assert [(file.stem, original) for file, original in todo] == [('a', result.original), ('copy', result.original)]
+
+def test_reprocess_only_prunes_its_own_originals(library: Path, tmp_path: Path, monkeypatch):
+    from typer.testing import CliRunner
+    import beastwick18_kitty_background_manager.main as main
+    import beastwick18_kitty_background_manager.config as cfg
+    settings = pipeline.configured(originals=str(originals.store_dir()))
+    Image.new('RGB', (128, 72), 'white').save(tmp_path / 'white.jpg')
+    result = add(tmp_path / 'white.jpg', library / 'a.png', settings)
+    # Kept by an add that has not recorded it yet
+    pending = originals.store_dir() / ('0' * 64 + '.jpg')
+    pending.write_bytes(b'')
+
+    monkeypatch.setenv('KITTYBG_NO_DAEMON', '1')
+    monkeypatch.setattr(cfg.conf['brightness'], 'value', 0.9)
+    output = CliRunner().invoke(main.app, ['reprocess', '--jobs', '1']).stdout
+    assert 'Made 1 of 1 backgrounds again' in output
+    assert pending.exists() and Path(result.original).exists()
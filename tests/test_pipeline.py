@@ -0,0 +1,67 @@
+from pathlib import Path
+import pytest
+from PIL import Image, ImageChops
+import beastwick18_kitty_background_manager.pipeline as pipeline
+
+def max_difference(a, b):
+    extrema = ImageChops.difference(a, b).getextrema()
+    if a.mode == 'L':
+        extrema = [extrema]
+    return max(high for _, high in extrema)
+
+@pytest.fixture
+def source(tmp_path: Path):
+    img = Image.radial_gradient('L').resize((1280, 720)).convert('RGB')
+    for ext in ('jpg', 'bmp', 'ppm', 'png'):
+        img.save(tmp_path / f'src.{ext}')
+    return tmp_path
+
+def test_jpeg_is_decoded_at_reduced_size(source):
+    img = pipeline.open_reduced(str(source / 'src.jpg'), 160, 90, 'fill')
+    assert img.size == (160, 90)
+
+def test_small_reduction_keeps_full_size(source):
+    assert pipeline.open_reduced(str(source / 'src.png'), 1000, 600, 'fill').size == (1280, 720)
+
+@pytest.mark.parametrize('ext', ['jpg', 'png'])
+def test_unscaled_images_keep_the_source_size(source, tmp_path, ext):
+    assert pipeline.open_reduced(str(source / f'src.{ext}'), 160, 90, 'none').size == (1280, 720)
+    settings = pipeline.Settings('none', 160, 90, 'black', 1, 1)
+    pipeline.process_image(str(source / f'src.{ext}'), str(tmp_path / 'out.png'), settings)
+    assert Image.open(tmp_path / 'out.png').size == (1280, 720)
+
+@pytest.mark.parametrize('ext', ['bmp', 'ppm', 'palette.bmp'])
+def test_banded_decoding_matches_full_decoding(source, monkeypatch, ext):
+    Image.open(source / 'src.png').quantize(64).save(source / 'src.palette.bmp')
+    full = pipeline.open_reduced(str(source / f'src.{ext}'), 160, 90, 'fill')
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    monkeypatch.setattr(pipeline, 'BAND_BYTES', 1280 * 3 * 50)
+    # The limit is shared by every thread, it is never lifted to decode the bands
+    limits = []
+    frombytes = Image.frombytes
+    monkeypatch.setattr(Image, 'frombytes', lambda *args: limits.append(Image.MAX_IMAGE_PIXELS) or frombytes(*args))
+    banded = pipeline.open_reduced(str(source / f'src.{ext}'), 160, 90, 'fill')
+    assert banded.size == full.size == (160, 90)
+    assert max_difference(full.convert(banded.mode), banded) <= 2
+    assert len(limits) > 1 and set(limits) == {1000}
+
+@pytest.mark.parametrize('ext', ['png', 'jpg'])
+def test_huge_image_without_bands_is_refused(source, monkeypatch, ext):
+    # A JPEG is also refused when it is still too large after decoding it at the reduced size
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    with pytest.raises(Image.DecompressionBombError):
+        pipeline.open_reduced(str(source / f'src.{ext}'), 160, 90, 'fill')
+    assert Image.MAX_IMAGE_PIXELS == 1000
+
+@pytest.mark.parametrize('mode', ['L', 'RGB', 'RGBA'])
+@pytest.mark.parametrize('contrast, brightness', [(1.2, 1), (1, 0.8), (0.7, 1.3), (1.5, 0.6)])
+def test_tone_matches_image_enhance(mode, contrast, brightness):
+    from PIL import ImageEnhance
+    import beastwick18_kitty_background_manager.tools as tools
+    img = Image.merge('RGBA', [Image.effect_mandelbrot((64, 48), (-2, -1, 1, 1), n) for n in (20, 60, 100, 140)]).convert(mode)
+
+    expected = ImageEnhance.Brightness(ImageEnhance.Contrast(img).enhance(contrast)).enhance(brightness)
+    fused = tools.adjust_tone(img, contrast, brightness)
+    assert fused.mode == mode
+    # Only the contrast mean can differ, since it is taken from channel histograms instead of per-pixel luma
+    assert max_difference(expected, fused) <= 2
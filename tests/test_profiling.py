@@ -0,0 +1,34 @@
+import json
+import pytest
+import beastwick18_kitty_background_manager.profiling as profiling
+
+@pytest.fixture
+def profile(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, '_spans', [])
+    monkeypatch.setattr(profiling, '_stack', [])
+    monkeypatch.setattr(profiling, 'enabled', False)
+    return tmp_path / 'trace.json'
+
+def test_spans_are_not_recorded_when_off(profile):
+    with profiling.span('stage'):
+        pass
+    assert profiling._spans == []
+    assert profiling.span('a') is profiling.span('b')
+
+def test_nested_spans_and_worker_spans_end_up_in_the_trace(profile):
+    profiling.enable(profile)
+    with profiling.span('outer'):
+        start = profiling.mark()
+        with profiling.span('inner'):
+            data = b'x' * (32 * 1024 * 1024)
+        worker_spans = profiling.take(start)
+    del data
+    assert [s[0] for s in profiling._spans] == ['outer']
+
+    profiling.merge(worker_spans)
+    profiling.report()
+    events = {e['name']: e for e in json.loads(profile.read_text())['traceEvents']}
+    assert set(events) == {'outer', 'inner'}
+    assert events['inner']['dur'] <= events['outer']['dur']
+    # The parent's peak includes everything its children used
+    assert events['outer']['args']['peak_rss'] >= events['inner']['args']['peak_rss'] >= 32 * 1024 * 1024
@@ -0,0 +1,55 @@
+import os
+from pathlib import Path
+import pytest
+import beastwick18_kitty_background_manager.publish as publish
+
+@pytest.fixture
+def src(tmp_path: Path):
+    (tmp_path / 'library').mkdir()
+    (tmp_path / 'current').mkdir()
+    src = tmp_path / 'library' / 'a.png'
+    src.write_bytes(b'background')
+    return src
+
+def failing(*args):
+    raise OSError('not supported here')
+
+def test_copy_and_hardlink(src: Path):
+    dest = src.parent.parent / 'current' / 'current.png'
+    publish.publish(src, dest, 'copy')
+    assert dest.read_bytes() == b'background' and not os.path.samefile(src, dest)
+
+    publish.publish(src, dest, 'hardlink')
+    assert os.path.samefile(src, dest) and os.stat(src).st_nlink == 2
+    assert os.listdir(dest.parent) == ['current.png']
+
+def test_hardlink_falls_back_to_reflink_then_copy(src: Path, monkeypatch):
+    dest = src.parent.parent / 'current' / 'current.png'
+    cloned = []
+    monkeypatch.setattr(os, 'link', failing)
+    monkeypatch.setattr(publish, 'reflink', lambda s, d: cloned.append(s) or publish.copy(s, d))
+    publish.publish(src, dest, 'hardlink')
+    assert cloned == [src] and dest.read_bytes() == b'background'
+
+    monkeypatch.setattr(publish, 'reflink', failing)
+    src.write_bytes(b'changed')
+    publish.publish(src, dest, 'hardlink')
+    assert dest.read_bytes() == b'changed' and not os.path.samefile(src, dest)
+    assert os.listdir(dest.parent) == ['current.png']
+
+def test_symlinks_point_to_the_absolute_path(src: Path, monkeypatch):
+    dest = src.parent.parent / 'current' / 'current.png'
+    monkeypatch.chdir(src.parent)
+    publish.publish(Path('a.png'), dest, 'symlink')
+    assert dest.is_symlink() and os.readlink(dest) == str(src)
+
+    # A symlink is never taken for the hard link that was asked for
+    publish.publish(src, dest, 'hardlink')
+    assert not dest.is_symlink() and os.path.samefile(src, dest)
+
+def test_hardlink_to_the_same_file_is_left_alone(src: Path, monkeypatch):
+    dest = src.parent.parent / 'current' / 'current.png'
+    publish.publish(src, dest, 'hardlink')
+    monkeypatch.setattr(publish, 'prepare', failing)
+    publish.publish(src, dest, 'hardlink')
+    assert os.path.samefile(src, dest)
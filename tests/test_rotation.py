@@ -0,0 +1,47 @@
+from collections import Counter
+import beastwick18_kitty_background_manager.rotation as rotation
+
+def test_reservoir_choice_is_uniform():
+    counts = Counter(rotation.reservoir_choice(iter(range(5))) for _ in range(5000))
+    assert set(counts) == set(range(5))
+    assert min(counts.values()) > 800
+    assert rotation.reservoir_choice(iter([])) is None
+
+def test_shuffle_draws_every_background_before_repeating(folder):
+    previous = None
+    for _ in range(5):
+        cycle = []
+        for _ in range(10):
+            cycle.append(bg := rotation.draw(folder, previous))
+            assert bg != previous
+            previous = bg
+        assert sorted(cycle) == [f'bg{n}' for n in range(10)]
+
+def test_shuffle_picks_up_added_and_removed_backgrounds(folder):
+    drawn = {rotation.draw(folder) for _ in range(5)}
+    (folder / 'new.png').write_bytes(b'')
+    removed = next(f'bg{n}' for n in range(10) if f'bg{n}' not in drawn)
+    (folder / f'{removed}.png').unlink()
+    
+    rest = {rotation.draw(folder) for _ in range(6)}
+    assert drawn | rest == {f'bg{n}' for n in range(10)} - {removed} | {'new'}
+
+def test_zero_weight_is_never_drawn(folder):
+    assert rotation.set_weight(folder, 'bg3', 0)
+    assert rotation.get_weight(folder, 'bg3') == 0
+    assert 'bg3' not in {rotation.draw(folder) for _ in range(30)}
+
+def test_the_background_on_screen_keeps_its_turn(folder):
+    # bg0 was set by hand, so it is on screen but was never drawn
+    drawn = [rotation.draw(folder, 'bg0', 'name != ?', ('bg0',)) for _ in range(9)]
+    assert sorted(drawn) == [f'bg{n}' for n in range(1, 10)]
+
+    first = rotation.draw(folder, 'bg0')
+    assert first != 'bg0'
+    assert rotation.draw(folder, first) == 'bg0'
+    # Its turn from the last cycle did not use up the one in this cycle
+    previous = 'bg0'
+    rest = []
+    for _ in range(9):
+        rest.append(previous := rotation.draw(folder, previous))
+    assert sorted([first] + rest) == [f'bg{n}' for n in range(10)]
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+import pytest
+
+# Modules that only some commands need. Which ones get imported is checked instead of how long the
+# imports take, timings depend too much on the machine the tests run on
+HEAVY_MODULES = ('PIL', 'pixcat', 'asyncio', 'multiprocessing', 'concurrent')
+# Only commands that look at the backgrounds open the index
+INDEX_MODULES = ('sqlite3',)
+RUN_APP = "from beastwick18_kitty_background_manager.main import app; app(prog_name='kittybg')"
+
+@pytest.fixture
+def env(tmp_path: Path):
+    app_dir = tmp_path / 'config' / 'kittybg'
+    app_dir.mkdir(parents=True)
+    options = {
+        'enabled_path': str(tmp_path / 'bg'),
+        'disabled_path': str(tmp_path / 'bg' / 'disabled'),
+        'current_path': str(tmp_path / 'bg' / 'current'),
+    }
+    (app_dir / 'config.json').write_text(json.dumps({'options': options, 'background': {'next': '', 'previous': ''}}))
+    for path in options.values():
+        Path(path).mkdir(parents=True)
+        (Path(path) / 'wallpaper.png').write_bytes(b'')
+
+    env = dict(os.environ)
+    env['XDG_CONFIG_HOME'] = str(tmp_path / 'config')
+    env['PYTHONPATH'] = str(Path(__file__).parent.parent)
+    env['PYTHONWARNINGS'] = 'ignore'
+    return env
+
+def imported_modules(code: str, args, env):
+    # -X importtime lists every module the first time it is imported
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code, *args], env=env, capture_output=True, text=True)
+    names = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        names.add(line.split('|')[-1].strip())
+    return proc, names
+
+def assert_not_imported(args, env, modules, extra_env={}):
+    proc, names = imported_modules(RUN_APP, args, {**env, **extra_env})
+    assert proc.returncode == 0, proc.stderr
+    unwanted = sorted(name for name in names if name.split('.')[0] in modules)
+    assert unwanted == [], f'Imported modules the command does not need: {unwanted}'
+    return proc
+
+def test_list_imports(env):
+    proc = assert_not_imported(['list'], env, HEAVY_MODULES)
+    assert 'wallpaper' in proc.stdout
+
+def test_help_imports(env):
+    proc = assert_not_imported(['--help'], env, HEAVY_MODULES + INDEX_MODULES)
+    assert 'Usage' in proc.stdout
+
+def test_completion_imports(env):
+    proc = assert_not_imported([], env, HEAVY_MODULES, {
+        '_KITTYBG_COMPLETE': 'complete_bash',
+        'COMP_WORDS': 'kittybg set wall',
+        'COMP_CWORD': '2',
+    })
+    assert 'wallpaper' in proc.stdout
@@ -0,0 +1,51 @@
+import json
+from multiprocessing import Pool
+from pathlib import Path
+import beastwick18_kitty_background_manager.state as state
+
+def increment(path: str):
+    for _ in range(20):
+        with state.transaction(Path(path)) as data:
+            data['count'] = data.get('count', 0) + 1
+            data.setdefault('writers', []).append(1)
+
+def test_transaction_creates_document(tmp_path: Path):
+    path = tmp_path / 'config.json'
+    with state.transaction(path, default=lambda: {'options': {}}) as data:
+        data['background'] = {'next': 'a'}
+    
+    assert json.loads(path.read_text()) == {'options': {}, 'background': {'next': 'a'}}
+    assert list(tmp_path.glob('*.tmp')) == []
+
+def test_nested_transactions_write_once(tmp_path: Path):
+    path = tmp_path / 'config.json'
+    path.write_text('{}')
+    with state.transaction(path) as outer:
+        with state.transaction(path) as inner:
+            inner['a'] = 1
+        assert outer is inner
+        assert json.loads(path.read_text()) == {}
+    
+    assert json.loads(path.read_text()) == {'a': 1}
+
+def test_failed_transaction_is_not_written(tmp_path: Path):
+    path = tmp_path / 'config.json'
+    path.write_text('{"a": 1}')
+    try:
+        with state.transaction(path) as data:
+            data['a'] = 2
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    
+    assert state.read(path) == {'a': 1}
+
+def test_concurrent_transactions(tmp_path: Path):
+    path = tmp_path / 'config.json'
+    path.write_text('{}')
+    with Pool(24) as pool:
+        pool.map(increment, [str(path)] * 24)
+    
+    data = json.loads(path.read_text())
+    assert data['count'] == 24 * 20
+    assert len(data['writers']) == 24 * 20
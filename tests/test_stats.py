@@ -0,0 +1,81 @@
+import os
+from pathlib import Path
+import pytest
+from PIL import Image
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.stats as stats
+import beastwick18_kitty_background_manager.actions as actions
+import beastwick18_kitty_background_manager.pipeline as pipeline
+
+COLOURS = {'navy': '#102080', 'forest': '#206020', 'sun': '#f0d020', 'ash': '#909090', 'rose': '#c02040', 'night': '#050510'}
+
+@pytest.fixture
+def coloured(library: Path):
+    for name in ('a', 'b', 'c', 'd'):
+        (library / f'{name}.png').unlink()
+    for name, colour in COLOURS.items():
+        Image.new('RGB', (64, 36), colour).save(library / f'{name}.png')
+    return library
+
+def test_compute():
+    s = stats.compute(Image.new('RGB', (300, 200), '#3060c0'))
+    assert s.luminance == pytest.approx(0.365, abs=0.01)
+    assert s.contrast == 0
+    assert 205 <= s.hue < 252.5
+    assert s.palette == '#3060c0'
+    assert stats.compute(Image.new('L', (30, 20), 128)).hue is None
+
+def test_hue_ranges_cover_the_circle():
+    def contains(r, hue):
+        low, high = r
+        return low <= hue < high if low < high else hue >= low or hue < high
+    ranges = [stats.hue_range(name) for name in stats.HUES]
+    for hue in range(360):
+        assert sum(contains(r, hue) for r in ranges) == 1
+    assert stats.hue_range('red') == (340, 15)
+
+def test_filtered_random(coloured: Path):
+    assert stats.fill_missing([coloured]) == len(COLOURS)
+    assert stats.fill_missing([coloured]) == 0
+
+    for hue, name in (('blue', None), ('green', 'forest'), ('yellow', 'sun'), ('red', 'rose')):
+        for shuffle in (True, False):
+            result = actions.random_background(shuffle=shuffle, hue=hue)
+            if name is not None:
+                assert Path(result['next']).stem == name
+    assert Path(actions.random_background(hue='blue')['next']).stem in ('navy', 'night')
+    with pytest.raises(actions.ActionError):
+        actions.random_background(hue='cyan')
+
+    dark = {Path(actions.random_background(dark=True)['next']).stem for _ in range(30)}
+    assert dark <= {'night', 'navy', 'forest'}
+    assert Path(actions.random_background(dark=False, hue='yellow')['next']).stem == 'sun'
+
+def test_list_sorted_by_luminance(coloured: Path):
+    assert actions.list_backgrounds(disabled=False, sort='luminance')['enabled'] == ['night', 'navy', 'forest', 'rose', 'ash', 'sun']
+
+def test_stats_are_dropped_when_the_file_changes(coloured: Path):
+    stats.fill_missing([coloured])
+    Image.new('RGB', (80, 36), 'white').save(coloured / 'night.png')
+    index.rebuild([coloured])
+    assert stats.fill_missing([coloured]) == 1
+
+def test_auto_brightness_reaches_the_target(tmp_path: Path):
+    settings = pipeline.Settings('fill', 64, 36, '#000000', 1.0, 0.1, stats=True, target_luminance=0.05)
+    for colour in ('#909090', '#404040'):
+        Image.new('RGB', (64, 36), colour).save(tmp_path / 'src.png')
+        result = pipeline.process_image(str(tmp_path / 'src.png'), str(tmp_path / 'out.png'), settings)
+        assert result.stats.luminance == pytest.approx(0.05, abs=0.01)
+
+def test_filters_decode_missing_statistics_on_every_core(coloured: Path, monkeypatch):
+    from concurrent import futures
+    workers = []
+    class Executor(futures.ThreadPoolExecutor):
+        def __init__(self, max_workers):
+            workers.append(max_workers)
+            super().__init__(max_workers)
+    monkeypatch.setattr(futures, 'ProcessPoolExecutor', Executor)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 3)
+
+    assert Path(actions.random_background(hue='yellow')['next']).stem == 'sun'
+    assert workers == [3]
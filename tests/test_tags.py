@@ -0,0 +1,59 @@
+from pathlib import Path
+import pytest
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.tags as tags
+import beastwick18_kitty_background_manager.actions as actions
+import beastwick18_kitty_background_manager.lookahead as lookahead
+
+def picked(**args):
+    return {Path(actions.random_background(**args)['next']).stem for _ in range(30)}
+
+def test_tag_filters(library: Path):
+    index.refresh(library)
+    assert tags.add('nature', [(library, 'a'), (library, 'b'), (library, 'c')]) == 3
+    assert tags.add('nature', [(library, 'a')]) == 0
+    tags.add('bright', [(library, 'b'), (library, 'd')])
+
+    assert picked(tag=['nature']) == {'a', 'b', 'c'}
+    assert picked(tag=['nature'], not_tag=['bright'], shuffle=True) == {'a', 'c'}
+    assert picked(tag=['nature', 'bright']) == {'b'}
+    assert [name for _, name, *_ in actions.entries(tag=['bright'])] == ['b', 'd']
+    with pytest.raises(actions.ActionError):
+        actions.random_background(tag=['nope'])
+
+    assert tags.of(library / 'b.png') == ['bright', 'nature']
+    assert tags.counts([library]) == [('bright', 2, 0), ('nature', 3, 0)]
+    assert tags.remove('nature', [(library, 'c')]) == 1
+    assert tags.delete('bright') and not tags.delete('bright')
+    assert tags.names() == ['nature']
+
+def test_tags_follow_the_image(library: Path):
+    index.refresh(library)
+    tags.add('nature', [(library, 'a'), (library, 'b')])
+    (library / 'a.png').rename(library / 'disabled' / 'a.png')
+    index.move_files([(library / 'a.png', library / 'disabled' / 'a.png')])
+    assert tags.of(library / 'disabled' / 'a.png') == ['nature']
+    (library / 'b.png').unlink()
+    assert [name for _, name, *_ in actions.entries(tag=['nature'])] == ['a']
+    assert tags.counts([library, library / 'disabled']) == [('nature', 1, 0)]
+
+def test_collections(library: Path):
+    index.refresh(library)
+    tags.add('work', [(library, 'a'), (library, 'b')], collection=True)
+    # Tags and collections do not share names
+    assert tags.names() == [] and tags.names(collection=True) == ['work']
+    lookahead.refill()
+
+    result = actions.set_background(collection='work')
+    assert tags.active() == 'work'
+    assert Path(result['next']).stem in ('a', 'b')
+    for _ in range(6):
+        assert Path(actions.next_background()['next']).stem in ('a', 'b')
+        lookahead.refill()
+    assert picked() == {'a', 'b'}
+
+    with pytest.raises(actions.ActionError):
+        actions.use_collection('play')
+    actions.use_collection(None)
+    assert tags.active() is None
+    assert picked() == {'a', 'b', 'c', 'd'}
@@ -0,0 +1,47 @@
+import os
+from pathlib import Path
+import pytest
+from PIL import Image
+import beastwick18_kitty_background_manager.thumbnails as thumbnails
+
+@pytest.fixture
+def image(library: Path):
+    path = library / 'wide.png'
+    Image.new('RGB', (400, 200), 'red').save(path)
+    return path
+
+def test_cache_key(image: Path):
+    key = thumbnails.cache_path(image, (64, 64), False)
+    assert thumbnails.cache_path(image, (64, 64), False) == key
+    assert len({key, thumbnails.cache_path(image, (32, 32), False), thumbnails.cache_path(image, (64, 64), True)}) == 3
+
+    # Changing the file in any way that shows in its mtime or size gives it a new thumbnail
+    os.utime(image, ns=(10**9, 10**9))
+    touched = thumbnails.cache_path(image, (64, 64), False)
+    Image.new('RGB', (400, 200), 'blue').save(image, compress_level=0)
+    os.utime(image, ns=(10**9, 10**9))
+    assert len({key, touched, thumbnails.cache_path(image, (64, 64), False)}) == 3
+
+def test_hits_do_not_decode(image: Path, monkeypatch):
+    path = thumbnails.get(image, 64, False)
+    assert Image.open(path).size == (64, 32)
+
+    os.utime(path, ns=(10**9, 10**9))
+    monkeypatch.setattr(Image, 'open', None)
+    assert thumbnails.get(image, 64, False) == path
+    # A hit counts as a use for the eviction
+    assert os.stat(path).st_mtime_ns > 10**9
+
+    monkeypatch.setattr(thumbnails, 'budget', lambda: 0)
+    assert thumbnails.get(image, 64, False) is None
+
+def test_least_recently_used_are_evicted_first(tmp_path: Path):
+    for n in range(5):
+        (tmp_path / f'{n}.png').write_bytes(b'x' * 100)
+        os.utime(tmp_path / f'{n}.png', ns=(n * 10**9, (5 - n) * 10**9))
+    (tmp_path / 'other.tmp').write_bytes(b'x' * 1000)
+
+    thumbnails.evict_folder(tmp_path, 500)
+    assert len(os.listdir(tmp_path)) == 6
+    thumbnails.evict_folder(tmp_path, 250)
+    assert sorted(os.listdir(tmp_path)) == ['0.png', '1.png', 'other.tmp']
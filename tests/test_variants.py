@@ -0,0 +1,65 @@
+from pathlib import Path
+import pytest
+from PIL import Image
+import beastwick18_kitty_background_manager.config as cfg
+import beastwick18_kitty_background_manager.actions as actions
+import beastwick18_kitty_background_manager.variants as variants
+
+@pytest.fixture
+def sized(library: Path, monkeypatch):
+    monkeypatch.setattr(cfg.conf['crop_size'], 'value', '1920x1080')
+    monkeypatch.setattr(cfg.conf['variant_sizes'], 'value', '3840x2160, 1080x1920,1280x720')
+    for name in ('a', 'b'):
+        Image.new('RGB', (1920, 1080), 'red').save(library / f'{name}.png')
+    return library
+
+def test_best_geometry_prefers_the_shape_of_the_window(sized: Path):
+    assert variants.best_geometry((1920, 1080)) == (1920, 1080)
+    assert variants.best_geometry((2560, 1440)) == (3840, 2160)
+    assert variants.best_geometry((1280, 700)) == (1280, 720)
+    assert variants.best_geometry((1200, 1900)) == (1080, 1920)
+    # Nothing covers it, so the largest one of the right shape
+    assert variants.best_geometry((7680, 4320)) == (3840, 2160)
+
+def test_variants_are_made_once_and_published(sized: Path):
+    current = sized / 'current' / 'current.png'
+    actions.set_background('a', size='1080x1920')
+    assert Image.open(current).size == (1080, 1920)
+    made = list(variants.cache_dir().iterdir())
+    assert len(made) == 1
+
+    actions.set_background('a', size='1920x1080')
+    assert Image.open(current).size == (1920, 1080)
+    # Without a size the last one is used again
+    actions.set_background('b')
+    assert Image.open(current).size == (1920, 1080)
+    actions.set_background('a', size='1000x1800')
+    assert list(variants.cache_dir().iterdir()) == made
+
+def test_window_size_can_be_overridden(monkeypatch):
+    monkeypatch.setenv(variants.ENV_WINDOW_SIZE, '800x600')
+    assert variants.detect() == '800x600'
+    monkeypatch.setattr(variants.tools, 'terminal_pixel_size', lambda: (1024, 768))
+    monkeypatch.setenv(variants.ENV_WINDOW_SIZE, 'nonsense')
+    assert variants.detect() == '1024x768'
+
+def test_a_cache_size_of_zero_turns_variants_off(sized: Path, monkeypatch):
+    monkeypatch.setattr(cfg.conf['variant_cache_size'], 'value', 0)
+    assert variants.pick(sized / 'a.png', '1080x1920') == sized / 'a.png'
+
+def test_variants_are_made_from_the_original(sized: Path, tmp_path: Path):
+    import beastwick18_kitty_background_manager.index as index
+    import beastwick18_kitty_background_manager.originals as originals
+    import beastwick18_kitty_background_manager.pipeline as pipeline
+    original = tmp_path / 'original.png'
+    Image.new('RGB', (3840, 2160), 'blue').save(original)
+    index.refresh(sized)
+    originals.record(sized / 'a.png', str(original), pipeline.fingerprint(pipeline.configured()))
+    originals.record(sized / 'b.png', str(original), '{}')
+
+    variant = Image.open(variants.pick(sized / 'a.png', '3840x2160'))
+    r, g, b = variant.getpixel((0, 0))
+    assert variant.size == (3840, 2160) and b > r
+    # Made with other settings than the ones in use now, the stored file is scaled up instead
+    r, g, b = Image.open(variants.pick(sized / 'b.png', '3840x2160')).getpixel((0, 0))
+    assert r > b
@@ -0,0 +1,64 @@
+import os
+import time
+from pathlib import Path
+import pytest
+from PIL import Image
+import beastwick18_kitty_background_manager.index as index
+import beastwick18_kitty_background_manager.config as cfg
+import beastwick18_kitty_background_manager.watch as watch
+
+@pytest.fixture
+def watcher(app_dirs: Path):
+    inbox, enabled = app_dirs / 'inbox', app_dirs / 'bg'
+    disabled = enabled / 'disabled'
+    w = watch.Watcher(inbox, [enabled, disabled], jobs=1, debounce=0, log=lambda msg: None)
+    w.start()
+    yield w
+    w.close()
+
+def wait_for(w, condition, timeout=20):
+    end = time.monotonic() + timeout
+    while not (condition() and w.idle()):
+        assert time.monotonic() < end, 'Timed out waiting for the watcher'
+        w.poll(0.05)
+
+def drop(img, folder: Path, name: str):
+    # Like a file manager would: written elsewhere, then moved in
+    tmp = folder.parent / ('.' + name)
+    img.save(tmp, format='JPEG' if name.endswith('.jpg') else 'PNG')
+    os.rename(tmp, folder / name)
+
+def test_inbox_images_are_processed_into_the_enabled_folder(watcher):
+    enabled = watcher.folders[0]
+    drop(Image.new('RGB', (800, 600), 'red'), watcher.inbox, 'photo.jpg')
+    wait_for(watcher, lambda: (enabled / 'photo.png').exists())
+
+    assert Image.open(enabled / 'photo.png').size == (1920, 1080)
+    assert not (watcher.inbox / 'photo.jpg').exists()
+    assert 'photo' in index.stored_names(enabled)
+
+def test_config_changes_apply_to_the_next_batch(watcher, monkeypatch):
+    enabled = watcher.folders[0]
+    # Put back once the test is done, the reload changes it for every test after this one
+    monkeypatch.setattr(cfg.conf['crop_size'], 'value', cfg.conf['crop_size'].value)
+    with cfg.transaction() as data:
+        data.setdefault('options', {})['crop_size'] = '64x36'
+    drop(Image.new('RGB', (800, 600), 'red'), watcher.inbox, 'small.jpg')
+    wait_for(watcher, lambda: (enabled / 'small.png').exists())
+    assert Image.open(enabled / 'small.png').size == (64, 36)
+
+def test_library_folders_are_indexed_without_rescans(watcher):
+    disabled = watcher.folders[1]
+    drop(Image.new('RGB', (64, 36)), disabled, 'kept.png')
+    drop(Image.new('RGB', (800, 600)), disabled, 'converted.jpg')
+    wait_for(watcher, lambda: (disabled / 'converted.png').exists())
+
+    assert sorted(index.stored_names(disabled)) == ['converted', 'kept']
+    assert Image.open(disabled / 'kept.png').size == (64, 36)
+    assert not (disabled / 'converted.jpg').exists()
+
+    (disabled / 'kept.png').unlink()
+    wait_for(watcher, lambda: 'kept' not in index.stored_names(disabled))
+    # The watcher caught the index up once it was idle, so a lookup does not have to rescan
+    key = index.folder_key(disabled)
+    assert index.connect().execute('SELECT mtime FROM folders WHERE path = ?', (key,)).fetchone()[0] == os.stat(disabled).st_mtime_ns